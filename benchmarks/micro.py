@@ -0,0 +1,264 @@
+"""
+🔬 Micro Benchmarks
+
+This module times the CPU-bound stages of a report on their own, so a slowdown in
+one of them shows up before it is lost in the noise of an end-to-end run:
+
+- render: generate_report, the Jinja render of email_template.html;
+- pdf: WeasyPrint's write_pdf of a rendered report;
+- load_translations: load_smart_translation for every locale in locale/;
+- merge_translations: merge_translations of every locale into sample.json;
+- capitalize_sentences: capitalize_sentences of a report header and footer;
+- mime: build_message with the report and PDF, serialized with as_string as
+  send_email does by default (mime[...]), and serialized once and addressed to
+  each of 10 recipients as with per_recipient (mime_per_recipient[...]).
+
+The report stages run with fixture statistics of several sizes, from the default
+top 5 up to thousands of rows per metric. The translation stages do not depend
+on the size and run once.
+
+Every stage is timed with timeit: repeated runs of as many calls as fit in 0.2
+seconds, of which the median and the fastest time per call are kept. The results
+are written to a JSON file, and `compare` checks a run against an earlier one:
+
+    python -m benchmarks.micro run --output .cache/benchmarks/baseline.json
+    python -m benchmarks.micro run --output .cache/benchmarks/current.json
+    python -m benchmarks.micro compare .cache/benchmarks/baseline.json .cache/benchmarks/current.json
+
+`compare` exits with status 1 when the median of a stage is more than the
+threshold (default 10%) slower than in the baseline.
+
+Functions:
+- make_fixture: Returns report statistics with a number of rows per metric.
+- run_benchmarks: Times every stage and returns the results.
+- compare_results: Compares two runs and returns the stages that slowed down.
+- main: Command line entry point.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+from benchmarks.mock_umami import metrics_payload, stats_payload
+from benchmarks.scale import REPO, STATS, write_workdir
+
+SIZES = [5, 50, 500, 2000]
+
+def make_fixture(rows):
+    """
+    Return report statistics with a number of rows per metric.
+
+    Args:
+        rows (int): The number of rows of every metric.
+
+    Returns:
+        dict: The statistics, as get_umami_data returns them.
+    """
+    from helpers.umami import parse_stats
+
+    website_id = f"fixture-{rows}"
+    fixture = {"stats": parse_stats("stats", json.loads(stats_payload(website_id)))}
+    for type in STATS[1:]:
+        fixture[type] = parse_stats(type, json.loads(metrics_payload(website_id, type, rows)))
+    return fixture
+
+def _time(func, repeat):
+    """Time a function, returning the median and fastest seconds per call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, number)  # autorange aims for 0.2 seconds per run
+    times = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(times), "min": min(times), "calls": number * repeat}
+
+def run_benchmarks(sizes=SIZES, stages=None, repeat=5, progress=print):
+    """
+    Time every stage and return the results.
+
+    Runs in a temporary working directory with the templates and locales of the
+    repository, as umami_report.py reads its configuration from the working directory.
+
+    Args:
+        sizes (list): The numbers of rows per metric to time the report stages with.
+        stages (list): The stages to time, or None for all.
+        repeat (int): The number of timed runs per stage.
+        progress (function): Called with a line of text after every stage.
+
+    Returns:
+        dict: The median and fastest seconds per call, keyed on "stage[size]"
+        (just the stage for the translation stages).
+    """
+    directory = tempfile.mkdtemp(prefix="umami_micro_")
+    cwd = os.getcwd()
+    try:
+        write_workdir(directory, 0, "http://127.0.0.1:9/api", ("127.0.0.1", 25))
+        os.chdir(directory)
+        sys.path.insert(0, REPO)
+        return _run_stages(sizes, stages, repeat, progress)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _run_stages(sizes, stages, repeat, progress):
+    """Time the stages in the current working directory."""
+    import umami_report
+    umami_report.load_settings()
+    from helpers.email import build_message, personalise, shared_body
+    from helpers.general import capitalize_sentences
+    from helpers.pipeline import render_pdf
+    from helpers.translation_validator import load_base_translation, load_smart_translation, merge_translations
+
+    wanted = lambda stage: stages is None or stage in stages
+    results = {}
+
+    def record(name, func):
+        results[name] = _time(func, repeat)
+        progress(f"{name:<32} {results[name]['median'] * 1000:10.3f} ms")
+
+    languages = sorted(name[:-5] for name in os.listdir("locale")
+                       if name.endswith(".json") and name != "sample.json")
+    if wanted("load_translations"):
+        record("load_translations", lambda: [load_smart_translation(lang) for lang in languages])
+    if wanted("merge_translations"):
+        base = load_base_translation("locale")
+        locales = []
+        for lang in languages:
+            with open(os.path.join("locale", f"{lang}.json"), encoding="utf-8") as f:
+                locales.append(json.load(f))
+        record("merge_translations", lambda: [merge_translations(base, locale) for locale in locales])
+
+    # A due website, so prepare_website builds the job as a real run does
+    site = {"website_id": "fixture", "name": "Fixture site", "frequency": "week", "lang": "en",
+            "send_day": [], "emails": ["recipient@example.com"], "what_stats": STATS,
+            "email_time": "08:00", "send_pdf": True}
+    now = datetime(2026, 1, 5, 8, 0)
+
+    for rows in sizes:
+        job = umami_report.prepare_website({**site, "top": rows}, now)
+        subject, context = umami_report.build_context(job, make_fixture(rows))
+        report, _ = umami_report.generate_report(job['website_name'], context, job['email_template'], False, False)
+
+        if wanted("render"):
+            record(f"render[{rows}]", lambda: umami_report.generate_report(
+                job['website_name'], context, job['email_template'], False, False))
+
+        pdf_data = None
+        if wanted("pdf") or wanted("mime"):
+            pdf_data = render_pdf(report)
+        if wanted("pdf"):
+            record(f"pdf[{rows}]", lambda: render_pdf(report))
+
+        if wanted("capitalize_sentences"):
+            translations = job['translations']
+            text = " ".join([translations["report_header"], translations["report_footer"]] * rows)
+            record(f"capitalize_sentences[{rows}]", lambda: capitalize_sentences(text))
+
+        if wanted("mime"):
+            recipients = [f"recipient{i}@example.com" for i in range(10)]
+            record(f"mime[{rows}]", lambda: build_message(
+                subject, report, recipients, "reports@example.com",
+                pdf_data=pdf_data, pdf_name="report.pdf").as_string())
+            record(f"mime_per_recipient[{rows}]", lambda: personalise(shared_body(build_message(
+                subject, report, [], "reports@example.com",
+                pdf_data=pdf_data, pdf_name="report.pdf")), recipients))
+
+    return results
+
+def _git_commit():
+    """Return the current git commit of the repository, or None."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(baseline, current, threshold=0.10):
+    """
+    Compare two runs and return the stages that slowed down.
+
+    Args:
+        baseline (dict): The results of the earlier run, as stored by `run`.
+        current (dict): The results of the new run.
+        threshold (float): The slowdown of the median that is allowed, 0.10 for 10%.
+
+    Returns:
+        tuple: (rows, slower) where rows are (stage, baseline seconds, current seconds,
+        ratio) tuples of the stages in both runs, and slower lists the stages whose
+        median grew by more than the threshold.
+    """
+    rows = []
+    slower = []
+    for stage, result in current["results"].items():
+        before = baseline["results"].get(stage)
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        rows.append((stage, before["median"], result["median"], ratio))
+        if ratio > 1 + threshold:
+            slower.append(stage)
+    return rows, slower
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Time the CPU-bound stages of a report.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="time the stages and store the results as JSON")
+    run.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                     help=f"rows per metric in the fixtures (default: {' '.join(map(str, SIZES))})")
+    run.add_argument("--stages", nargs="+",
+                     choices=["render", "pdf", "load_translations", "merge_translations", "capitalize_sentences",
+                              "mime"],
+                     help="the stages to time (default: all)")
+    run.add_argument("--repeat", type=int, default=5, help="timed runs per stage (default: 5)")
+    run.add_argument("--output", help="the JSON file to write (default: .cache/benchmarks/micro-<time>.json)")
+
+    compare = commands.add_parser("compare", help="compare a run with a baseline, failing when a stage slowed down")
+    compare.add_argument("baseline", help="JSON file of the earlier run")
+    compare.add_argument("current", help="JSON file of the new run")
+    compare.add_argument("--threshold", type=float, default=0.10,
+                         help="allowed slowdown of the median, as a fraction (default: 0.10)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        output = args.output or os.path.join(".cache", "benchmarks", f"micro-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        results = run_benchmarks(sizes=args.sizes, stages=args.stages, repeat=args.repeat)
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "results": results
+            }, f, indent=4)
+        print(f"Results written to {output}")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    rows, slower = compare_results(baseline, current, args.threshold)
+    print(f"{'stage':<32} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for stage, before, after, ratio in rows:
+        flag = "  SLOWER" if stage in slower else ""
+        print(f"{stage:<32} {before * 1000:12.3f} {after * 1000:12.3f} {(ratio - 1) * 100:+7.1f}%{flag}")
+
+    if slower:
+        print(f"{len(slower)} stage(s) slowed down by more than {args.threshold:.0%}: {', '.join(slower)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+🧪 Mock Umami Server
+
+This module provides a local stand-in for the Umami API, so the report run can be
+benchmarked without a live Umami instance. It answers the endpoints the reports
+use, with the response shapes shown in data.txt:
+
+- POST .../auth/login returns a bearer token.
+- GET .../websites/{id}/stats returns the totals with their previous values.
+- GET .../websites/{id}/metrics?type=... returns label-value rows.
+
+Every response waits `latency` seconds (give or take `jitter`) and metric
+responses have `rows` rows, so slow or large Umami installations can be
+simulated. The data is generated from the website id and stat type, so every
+website gets different but repeatable statistics.
+
+Functions:
+- stats_payload: Returns the stats response of a website.
+- metrics_payload: Returns the metrics response of a website for a stat type.
+
+Classes:
+- MockUmami: Threaded HTTP server answering the Umami API endpoints.
+"""
+import re
+import json
+import time
+import uuid
+import zlib
+import random
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_STATS_PATH = re.compile(r"/websites/([^/]+)/(stats|metrics)$")
+
+# The first labels of every metric, as in data.txt; more rows get numbered labels
+_LABELS = {
+    "url": ["/", "/about", "/blog", "/contact", "/pricing"],
+    "referrer": ["linkedin.com", "", "com.linkedin.android", "google.com", "github.com"],
+    "browser": ["ios-webview", "chrome", "crios", "ios", "firefox", "safari", "edge"],
+    "os": ["iOS", "Android OS", "Windows 10", "Mac OS", "Linux"],
+    "device": ["mobile", "desktop", "laptop", "tablet"],
+    "country": ["NL", "BE", "DE", "US", "GB", "FR"],
+    "event": ["Click", "Signup", "Download", "Share"],
+}
+
+def _random(website_id, type):
+    """Return a random generator seeded on a website and stat type."""
+    return random.Random(zlib.crc32(f"{website_id}|{type}".encode("utf-8")))
+
+@lru_cache(maxsize=65536)
+def stats_payload(website_id):
+    """
+    Return the stats response of a website.
+
+    Args:
+        website_id (str): The ID of the website.
+
+    Returns:
+        bytes: The JSON response.
+    """
+    rng = _random(website_id, "stats")
+    pageviews = rng.randint(10, 100000)
+    data = {
+        "pageviews": pageviews,
+        "visitors": pageviews // 3,
+        "visits": pageviews // 2,
+        "bounces": pageviews // 4,
+        "totaltime": pageviews * 40,
+    }
+    return json.dumps({
+        name: {"value": value, "prev": int(value * rng.uniform(0.5, 1.5))}
+        for name, value in data.items()
+    }).encode("utf-8")
+
+@lru_cache(maxsize=65536)
+def metrics_payload(website_id, type, rows):
+    """
+    Return the metrics response of a website for a stat type.
+
+    Args:
+        website_id (str): The ID of the website.
+        type (str): The stat type ("url", "referrer", ...).
+        rows (int): The number of rows.
+
+    Returns:
+        bytes: The JSON response, highest value first.
+    """
+    rng = _random(website_id, type)
+    labels = _LABELS.get(type, [])
+    values = sorted((rng.randint(1, 10000) for _ in range(rows)), reverse=True)
+    return json.dumps([
+        {"x": labels[i] if i < len(labels) else f"{type}-{i}", "y": value}
+        for i, value in enumerate(values)
+    ]).encode("utf-8")
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler of the mock server; the settings live on the server."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, as the real server behind a proxy
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.mock.count(bytes_sent=len(body))
+
+    def _wait(self):
+        mock = self.server.mock
+        if mock.latency:
+            time.sleep(max(0.0, random.gauss(mock.latency, mock.latency * mock.jitter)))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not urlparse(self.path).path.endswith("/auth/login"):
+            return self._reply(404, b'{"error":"not found"}')
+
+        self._wait()
+        self.server.mock.count(logins=1)
+        self._reply(200, json.dumps({"token": uuid.uuid4().hex}).encode("utf-8"))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = _STATS_PATH.search(url.path)
+        if not match:
+            return self._reply(404, b'{"error":"not found"}')
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._reply(401, b'{"error":"unauthorized"}')
+
+        self._wait()
+        self.server.mock.count(requests=1)
+        website_id, endpoint = match.groups()
+        if endpoint == "stats":
+            return self._reply(200, stats_payload(website_id))
+
+        type = parse_qs(url.query).get("type", [""])[0]
+        self._reply(200, metrics_payload(website_id, type, self.server.mock.rows))
+
+class MockUmami:
+    """
+    Threaded HTTP server answering the Umami API endpoints.
+
+    Args:
+        latency (float): Seconds every response waits, on average.
+        jitter (float): Standard deviation of the latency, as a fraction of it.
+        rows (int): Number of rows in every metrics response.
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 for any free port.
+    """
+
+    def __init__(self, latency=0.02, jitter=0.25, rows=10, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rows = rows
+        self.counters = {"requests": 0, "logins": 0, "bytes_sent": 0}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_url(self):
+        """The base URL to configure as umami.api_url."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def count(self, **amounts):
+        """Add to the counters."""
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def snapshot(self):
+        """Return a copy of the counters."""
+        with self._lock:
+            return dict(self.counters)
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
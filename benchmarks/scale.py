@@ -0,0 +1,267 @@
+"""
+📈 Scale Benchmark
+
+This module runs umami_report.py end to end for a synthetic set of websites,
+against the mock Umami server and the SMTP sink, and reports how it scales:
+
+- sites/sec over the whole run, start-up included;
+- p50 / p99 latency per website;
+- peak RSS of the report process;
+- API calls, bytes fetched, SMTP connections and emails sent.
+
+Every run uses a fresh working directory with a generated config.json and
+websites_config.json (every website due now, with the languages of locale/), and
+runs in its own Python process, so module state, caches and peak memory do not
+leak from one run into the next.
+
+In the default scheduled mode the latency of a website is the time
+process_website takes for it. With --pipeline, work is done per stage
+instead, so the latency of a website is the time from the start of the run until
+its email was handed to the mail sender.
+
+Usage:
+    python -m benchmarks.scale --sites 10 100 1000 --latency 0.02 --rows 10
+
+Functions:
+- write_workdir: Creates the working directory for a run.
+- run_size: Runs the report for one number of websites.
+- percentile: Returns a percentile of a list of values.
+- main: Command line entry point.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATS = ["stats", "event", "url", "referrer", "browser", "os", "device", "country"]
+
+def percentile(values, fraction):
+    """
+    Return a percentile of a list of values (nearest rank).
+
+    Args:
+        values (list): The values.
+        fraction (float): The percentile as a fraction, 0.99 for p99.
+
+    Returns:
+        float: The value, or 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def _languages():
+    """Return the languages with a translation in locale/."""
+    return sorted(name[:-5] for name in os.listdir(os.path.join(REPO, "locale")) if name.endswith(".json"))
+
+def write_workdir(directory, sites, api_url, smtp_address, top=5, pdf=False):
+    """
+    Create the working directory for a run.
+
+    Args:
+        directory (str): The directory.
+        sites (int): The number of websites.
+        api_url (str): The URL of the mock Umami API.
+        smtp_address (tuple): The (host, port) of the SMTP sink.
+        top (int): The number of rows shown per metric.
+        pdf (bool): Whether the reports include a PDF.
+    """
+    os.makedirs(os.path.join(directory, "configs"), exist_ok=True)
+    for folder in ("templates", "locale"):
+        os.symlink(os.path.join(REPO, folder), os.path.join(directory, folder))
+
+    config = {
+        "umami": {"api_url": api_url, "username": "benchmark", "password": "benchmark"},
+        "company": {"name": "Benchmark", "url": "https://example.com", "email": "benchmark@example.com"},
+        "smtp": {
+            "host": smtp_address[0],
+            "port": smtp_address[1],
+            "username": "benchmark@example.com",
+            "password": "benchmark",
+            "from_email": "benchmark@example.com",
+            "from_name": "Benchmark"
+        }
+    }
+
+    # Every website is due in the current hour
+    email_time = f"{datetime.now().hour:02d}:00"
+    languages = _languages()
+    websites = [
+        {
+            "website_id": f"benchmark-{i:05d}",
+            "name": f"Benchmark site {i}",
+            "frequency": "day",
+            "lang": languages[i % len(languages)],
+            "send_day": [],
+            "top": top,
+            "emails": [f"recipient{i}@example.com"],
+            "what_stats": STATS,
+            "email_template": "email_template.html",
+            "email_time": email_time,
+            "send_pdf": pdf
+        }
+        for i in range(sites)
+    ]
+
+    with open(os.path.join(directory, "configs", "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=4)
+    with open(os.path.join(directory, "configs", "websites_config.json"), "w", encoding="utf-8") as f:
+        json.dump(websites, f, indent=4)
+
+def _worker(mode):
+    """Run the report in this process (started in the working directory) and print the measurements."""
+    sys.path.insert(0, REPO)
+    import umami_report
+
+    latencies = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    if mode == "scheduled":
+        process_website = umami_report.process_website
+
+        def timed_process_website(site, now):
+            start = time.perf_counter()
+            try:
+                process_website(site, now)
+            finally:
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        umami_report.process_website = timed_process_website
+    else:
+        send_email = umami_report.send_email
+
+        def timed_send_email(*args, **kwargs):
+            try:
+                return send_email(*args, **kwargs)
+            finally:
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+        umami_report.send_email = timed_send_email
+
+    sys.argv = ["umami_report.py"] + {"scheduled": [], "pipeline": ["--pipeline"]}[mode]
+    umami_report.main()
+    elapsed = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+    print(json.dumps({"elapsed": elapsed, "latencies": latencies, "peak_rss": peak_rss}))
+
+def run_size(sites, mock, sink, mode="scheduled", top=5, pdf=False, keep=False):
+    """
+    Run the report for one number of websites.
+
+    Args:
+        sites (int): The number of websites.
+        mock (MockUmami): The running mock Umami server.
+        sink (SMTPSink): The running SMTP sink.
+        mode (str): "scheduled" or "pipeline".
+        top (int): The number of rows shown per metric.
+        pdf (bool): Whether the reports include a PDF.
+        keep (bool): Keep the working directory (with its logs) after the run.
+
+    Returns:
+        dict: The measurements of the run.
+    """
+    directory = tempfile.mkdtemp(prefix=f"umami_scale_{sites}_")
+    write_workdir(directory, sites, mock.api_url, sink.address, top=top, pdf=pdf)
+    api_before, smtp_before = mock.snapshot(), sink.snapshot()
+
+    process = subprocess.run(
+        [sys.executable, "-m", "benchmarks.scale", "--worker", mode],
+        cwd=directory, stdout=subprocess.PIPE, text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")]))}
+    )
+    if process.returncode != 0 or not process.stdout.strip():
+        # The working directory is kept, with the logs of the failed run
+        raise RuntimeError(f"The report run for {sites} websites failed (exit code {process.returncode}), "
+                           f"see {directory}/logs")
+    measured = json.loads(process.stdout.strip().splitlines()[-1])
+    if not keep:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    api, smtp = mock.snapshot(), sink.snapshot()
+    latencies = measured["latencies"]
+    return {
+        "sites": sites,
+        "mode": mode,
+        "elapsed": round(measured["elapsed"], 3),
+        "sites_per_sec": round(sites / measured["elapsed"], 2) if measured["elapsed"] else 0.0,
+        "p50": round(percentile(latencies, 0.50), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+        "peak_rss_mb": round(measured["peak_rss"] / (1024 * 1024), 1),
+        "api_calls": api["requests"] - api_before["requests"],
+        "bytes_fetched": api["bytes_sent"] - api_before["bytes_sent"],
+        "smtp_connections": smtp["connections"] - smtp_before["connections"],
+        "emails": smtp["messages"] - smtp_before["messages"],
+    }
+
+def _print_table(results):
+    """Print the results of all runs as a table."""
+    columns = ["sites", "mode", "elapsed", "sites_per_sec", "p50", "p99", "peak_rss_mb",
+               "api_calls", "bytes_fetched", "smtp_connections", "emails"]
+    widths = {name: max(len(name), *(len(str(result[name])) for result in results)) for name in columns}
+    print("  ".join(name.rjust(widths[name]) for name in columns))
+    for result in results:
+        print("  ".join(str(result[name]).rjust(widths[name]) for name in columns))
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark umami_report.py end to end against a mock Umami "
+                                                 "server and an SMTP sink.")
+    parser.add_argument("--sites", type=int, nargs="+", default=[10, 100],
+                        help="numbers of websites to run with (default: 10 100)")
+    parser.add_argument("--mode", choices=["scheduled", "pipeline"], default="scheduled",
+                        help="how umami_report.py is run (default: scheduled)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds every mock API response takes (default: 0.02)")
+    parser.add_argument("--jitter", type=float, default=0.25,
+                        help="standard deviation of the latency as a fraction of it (default: 0.25)")
+    parser.add_argument("--rows", type=int, default=10, help="rows in every metrics response (default: 10)")
+    parser.add_argument("--top", type=int, default=5, help="rows shown per metric in the reports (default: 5)")
+    parser.add_argument("--pdf", action="store_true", help="attach a PDF to every report")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories and their logs")
+    parser.add_argument("--worker", choices=["scheduled", "pipeline"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker)
+        return
+
+    from benchmarks.mock_umami import MockUmami
+    from benchmarks.smtp_sink import SMTPSink
+
+    mock = MockUmami(latency=args.latency, jitter=args.jitter, rows=args.rows).start()
+    sink = SMTPSink().start()
+    results = []
+    try:
+        for sites in args.sites:
+            results.append(run_size(sites, mock, sink, mode=args.mode, top=args.top, pdf=args.pdf, keep=args.keep))
+    finally:
+        mock.stop()
+        sink.stop()
+
+    _print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": {"latency": args.latency, "jitter": args.jitter, "rows": args.rows,
+                                    "top": args.top, "pdf": args.pdf, "mode": args.mode},
+                       "results": results}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
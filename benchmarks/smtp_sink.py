@@ -0,0 +1,142 @@
+"""
+📭 SMTP Sink
+
+This module provides a local SMTP server that accepts every message and throws it
+away, so the report run can be benchmarked without a real mail server. It speaks
+enough SMTP for `smtplib`: EHLO, STARTTLS, AUTH PLAIN, MAIL, RCPT, DATA, RSET,
+NOOP and QUIT. The reports always use STARTTLS, so the sink serves TLS with a
+throwaway self-signed certificate made with the `openssl` command.
+
+Classes:
+- SMTPSink: Threaded SMTP server that counts and discards messages.
+"""
+import os
+import ssl
+import shutil
+import tempfile
+import threading
+import subprocess
+import socketserver
+
+def _self_signed_context(directory):
+    """Create a self-signed certificate in a directory and return a TLS server context for it."""
+    if not shutil.which("openssl"):
+        raise RuntimeError("The SMTP sink needs the openssl command to create a certificate for STARTTLS")
+
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One SMTP session."""
+
+    def setup(self):
+        self._open(self.request)
+
+    def _open(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    def _reply(self, *lines):
+        # Multi-line replies use "250-" for every line but the last
+        text = "".join(f"{line[:3]}{'-' if i < len(lines) - 1 else ' '}{line[4:]}\r\n"
+                       for i, line in enumerate(lines))
+        self.sock.sendall(text.encode("ascii"))
+
+    def handle(self):
+        sink = self.server.sink
+        sink.count(connections=1)
+        tls = False
+        self._reply("220 sink ESMTP")
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.split(b" ", 1)[0].strip().upper()
+
+            if command in (b"EHLO", b"HELO"):
+                extensions = ["250 sink", "250 AUTH PLAIN", "250 SIZE 104857600"]
+                if not tls:
+                    extensions.append("250 STARTTLS")
+                self._reply(*extensions)
+            elif command == b"STARTTLS" and not tls:
+                self._reply("220 ready to start TLS")
+                self.rfile.close()
+                self._open(sink.tls_context.wrap_socket(self.sock, server_side=True))
+                tls = True
+            elif command == b"AUTH":
+                self._reply("235 authenticated")
+            elif command == b"DATA":
+                self._reply("354 end data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data in iter(self.rfile.readline, b""):
+                    if data == b".\r\n":
+                        break
+                    size += len(data)
+                else:
+                    return
+                sink.count(messages=1, bytes_received=size)
+                self._reply("250 queued")
+            elif command == b"QUIT":
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("250 ok")
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class SMTPSink:
+    """
+    Threaded SMTP server that counts and discards messages.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 for any free port.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.counters = {"connections": 0, "messages": 0, "bytes_received": 0}
+        self._lock = threading.Lock()
+        self._cert_dir = tempfile.mkdtemp(prefix="smtp_sink_")
+        self.tls_context = _self_signed_context(self._cert_dir)
+
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        """The (host, port) to configure as smtp.host and smtp.port."""
+        return self._server.server_address[:2]
+
+    def count(self, **amounts):
+        """Add to the counters."""
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def snapshot(self):
+        """Return a copy of the counters."""
+        with self._lock:
+            return dict(self.counters)
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and remove the certificate."""
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._cert_dir, ignore_errors=True)
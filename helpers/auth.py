@@ -2,16 +2,39 @@
 🔒 Authentication Helper for Umami API
 
 This module provides a function to authenticate with the Umami API and retrieve
-a bearer token for subsequent API requests.
+a bearer token for subsequent API requests, and a token manager that keeps the
+token on disk so it can be reused across runs until it expires.
 
 Functions:
 - authenticate: Logs in to the Umami API and returns an authentication token.
+- token_expiry: Reads the expiry time from a JWT bearer token, if it has one.
+
+Classes:
+- AuthenticationError: Raised when logging in to the Umami API fails.
+- TokenManager: Caches the bearer token on disk and refreshes it when it expires or is rejected.
 """
+import os
+import json
+import time
+import base64
+import hashlib
 import logging
-import requests
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, fall back to in-process locking only
+    fcntl = None
+
+from helpers.http_client import request
+from helpers.telemetry import span
 
 logger = logging.getLogger(__name__)
 
+class AuthenticationError(Exception):
+    """Raised when logging in to the Umami API fails."""
+
 def authenticate(api_url: str, username: str, password: str):
     """
     Authenticates with the Umami API and retrieves a bearer token.
@@ -25,12 +48,13 @@ def authenticate(api_url: str, username: str, password: str):
         str: The bearer token if authentication is successful.
 
     Raises:
-        SystemExit: If authentication fails due to missing parameters or API errors.
+        AuthenticationError: If authentication fails due to missing parameters or API errors.
     """
     # Ensure required parameters are provided
     if not api_url or not username or not password:
-        logger.error("Authentication failed: Missing required parameters.")
-        exit(1)
+        raise AuthenticationError("Missing required parameters")
+
+    import requests
 
     # Construct the login URL
     login_url = f"{api_url}/auth/login"
@@ -38,18 +62,181 @@ def authenticate(api_url: str, username: str, password: str):
 
     try:
         # Send POST request to authenticate
-        response = requests.post(login_url, json=payload)
+        with span("authenticate") as attributes:
+            response = request("POST", login_url, json=payload)
+            attributes["status"] = response.status_code
         response.raise_for_status()  # Raise an exception for HTTP errors
 
         # Extract the token from the response
         token = response.json().get("token")
         if not token:
-            logger.error("Authentication failed: No token received.")
-            exit(1)
+            raise AuthenticationError("No token received")
 
         return token
 
     except requests.exceptions.RequestException as e:
         # Handle request errors
-        logger.error(f"Failed to authenticate: {e}")
-        exit(1)
+        raise AuthenticationError(str(e)) from e
+
+def token_expiry(token):
+    """
+    Read the expiry time from a JWT bearer token.
+
+    Args:
+        token (str): The bearer token.
+
+    Returns:
+        float | None: The expiry time as a Unix timestamp, or None if the token is not
+        a JWT or has no expiry claim.
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+
+    try:
+        payload = parts[1] + "=" * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"]) if "exp" in claims else None
+    except (ValueError, TypeError):
+        return None
+
+class TokenManager:
+    """
+    Keeps a valid bearer token for the Umami API.
+
+    The token is stored in a file (readable by the owner only) so the next run can
+    reuse it until it expires. When the API rejects the token, `refresh` logs in again
+    exactly once: concurrent callers wait for that refresh and get the new token.
+
+    Args:
+        api_url (str): The base URL of the Umami API.
+        username (str): The username for the Umami account.
+        password (str): The password for the Umami account.
+        token_file (str): File to store the token in.
+        max_age (float): Seconds a token is reused when it has no expiry of its own.
+    """
+
+    # Refresh a little before the token actually expires
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, api_url, username, password, token_file=".cache/umami_token.json", max_age=12 * 3600):
+        self.api_url = api_url
+        self.username = username
+        self.password = password
+        self.token_file = token_file
+        self.max_age = max_age
+        self._account = hashlib.sha256(f"{api_url}|{username}".encode("utf-8")).hexdigest()
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def token(self):
+        """The current bearer token, loaded from disk or obtained by logging in when needed."""
+        if self._token and time.time() < self._expires_at:
+            return self._token
+
+        with self._lock:
+            if self._token and time.time() < self._expires_at:
+                return self._token
+
+            with self._file_lock():
+                if not self._load():
+                    self._login()
+            return self._token
+
+    def refresh(self, stale_token):
+        """
+        Replace a token that was rejected by the API.
+
+        Args:
+            stale_token (str): The token that was rejected.
+
+        Returns:
+            str: A new token. When another worker already refreshed the token, its
+            token is returned without logging in again.
+        """
+        with self._lock:
+            if self._token and self._token != stale_token:
+                return self._token
+
+            with self._file_lock():
+                # Another process may have refreshed the token in the meantime
+                if not self._load() or self._token == stale_token:
+                    logger.info("Bearer token rejected, logging in again")
+                    self._login()
+            return self._token
+
+    def _login(self):
+        """Log in to the Umami API and store the new token."""
+        token = authenticate(self.api_url, self.username, self.password)
+        expires_at = token_expiry(token) or time.time() + self.max_age
+
+        self._token = token
+        self._expires_at = expires_at - self.EXPIRY_MARGIN
+        self._save(token, expires_at)
+
+    def _load(self):
+        """
+        Load the token from the token file.
+
+        Returns:
+            bool: True if a token for this account was loaded that has not expired.
+        """
+        try:
+            with open(self.token_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("account") != self._account or not data.get("token"):
+            return False
+
+        expires_at = float(data.get("expires_at", 0)) - self.EXPIRY_MARGIN
+        if time.time() >= expires_at:
+            return False
+
+        self._token = data["token"]
+        self._expires_at = expires_at
+        return True
+
+    def _save(self, token, expires_at):
+        """Write the token to the token file atomically, readable by the owner only."""
+        data = {"account": self._account, "token": token, "expires_at": expires_at}
+        tmp_file = f"{self.token_file}.{os.getpid()}.tmp"
+        try:
+            directory = os.path.dirname(self.token_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.token_file)
+        except OSError as e:
+            logger.error(f"Failed to store bearer token: {e}")
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold an exclusive lock on the token file, so processes do not log in at the same time."""
+        if fcntl is None:
+            yield
+            return
+
+        lock_file = f"{self.token_file}.lock"
+        try:
+            directory = os.path.dirname(lock_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            logger.error(f"Failed to lock bearer token file: {e}")
+            yield
+            return
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
@@ -0,0 +1,174 @@
+"""
+🗄️ Response Cache
+
+This module provides an on-disk cache for Umami API responses, so the same
+statistics are not fetched twice for websites that share a `website_id`, for
+reports that cover the same range, or when a failed run is repeated.
+
+Responses are stored in a SQLite database, keyed on website, endpoint, stat type
+and the query range. Entries for ranges that are already closed never expire;
+entries for ranges that are still open expire after a TTL. The cache is bounded
+in size and evicts the least recently used entries first.
+
+Classes:
+- ResponseCache: SQLite backed TTL/LRU cache for API responses.
+
+Functions:
+- make_cache_key: Builds the cache key for an API request.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_URL_PATTERN = re.compile(r"/websites/([^/]+)/([^/?]+)$")
+
+# Ranges ending more than this many milliseconds ago are considered closed
+CLOSED_RANGE_GRACE_MS = 5 * 60 * 1000
+
+def make_cache_key(url, params):
+    """
+    Build the cache key for an API request.
+
+    Args:
+        url (str): The API endpoint URL.
+        params (dict): Query parameters for the API request.
+
+    Returns:
+        str | None: The cache key, or None if the request is not cacheable.
+    """
+    match = _URL_PATTERN.search(url)
+    if not match:
+        return None
+
+    website_id, endpoint = match.groups()
+    parts = [
+        website_id,
+        endpoint,
+        params.get("type") or "",
+        params.get("startAt"),
+        params.get("endAt"),
+        params.get("unit"),
+        params.get("tz"),
+    ]
+    return "|".join(str(part) for part in parts)
+
+class ResponseCache:
+    """
+    SQLite backed cache for Umami API responses.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        ttl (float): Seconds an entry for a range that is still open stays valid.
+        max_entries (int): Maximum number of entries before the least recently used are evicted.
+    """
+
+    def __init__(self, path=".cache/umami_responses.sqlite", ttl=300, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+
+    def get(self, key):
+        """
+        Return the cached response for a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict | list | None: The cached JSON data, or None on a miss or expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            body, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+
+        return json.loads(body)
+
+    def set(self, key, data, range_end=None):
+        """
+        Store a response in the cache.
+
+        Args:
+            key (str): The cache key.
+            data (dict | list): The JSON data to store.
+            range_end (int): End of the queried range in epoch milliseconds. Responses for
+                ranges that have already closed are stored without expiry.
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        if range_end is not None and int(range_end) < (now * 1000) - CLOSED_RANGE_GRACE_MS:
+            expires_at = None
+
+        body = json.dumps(data, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, body, created_at, accessed_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, body, now, now, expires_at)
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        """Remove expired entries and the least recently used entries above the size limit."""
+        self._conn.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                           (time.time(),))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -1,54 +1,150 @@
 """
 📅 Date Range Calculator
 
-This module provides a utility function to calculate date ranges for
-analytics reports based on a specified frequency.
+This module provides utilities to calculate date ranges for analytics reports
+based on a specified frequency.
+
+Reports cover calendar-aligned, half-open periods in the website's timezone: the
+previous day, the previous ISO week (Monday to Monday), the previous calendar
+month, quarter or year. Every period has a canonical key such as
+"week:2026-W41:Europe/Amsterdam", so caches, rollups and the mail spool recognise
+the same period in every run and it is never queried with slightly shifted
+boundaries. Boundaries are computed once per frequency, timezone and day.
 
 Functions:
+- get_timezone: Returns the timezone for a name.
+- report_period: Returns the period a report sent at a given moment covers.
+- previous_period: Returns the period before a period.
 - calculate_date_range: Computes the start and end dates for a report based on frequency.
 """
 import logging
-from datetime import timedelta
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 logger = logging.getLogger(__name__)
 
-def calculate_date_range(now, frequency):
+FREQUENCIES = ("day", "week", "month", "quarter", "year")
+
+# A half-open period [start, end) in epoch milliseconds; tz is the timezone name
+# ("" for the local timezone of the machine)
+Period = namedtuple("Period", ["key", "frequency", "start", "end", "tz"])
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """
+    Return the timezone for a name.
+
+    Args:
+        name (str): An IANA timezone name such as "Europe/Amsterdam", or "" / None
+            for the local timezone of the machine.
+
+    Returns:
+        ZoneInfo | None: The timezone, or None for the local timezone.
+
+    Raises:
+        ValueError: If the timezone is unknown.
+    """
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown timezone: {name}") from e
+
+def _epoch_ms(day, tz):
+    """Return the start of a day in a timezone, in epoch milliseconds."""
+    return int(datetime.combine(day, time(), tzinfo=tz).timestamp() * 1000)
+
+def _local_date(moment, tz):
+    """Return the date of a moment in a timezone (naive moments are in local time)."""
+    if tz is None:
+        return moment.astimezone().replace(tzinfo=None).date() if moment.tzinfo else moment.date()
+    return moment.astimezone(tz).date()
+
+@lru_cache(maxsize=4096)
+def _period_before(frequency, tz_name, day):
+    """Return the last complete period of a frequency that ended on or before a day."""
+    if frequency == "day":
+        start, end = day - timedelta(days=1), day
+        label = start.isoformat()
+    elif frequency == "week":
+        end = day - timedelta(days=day.weekday())
+        start = end - timedelta(days=7)
+        year, week, _ = start.isocalendar()
+        label = f"{year}-W{week:02d}"
+    elif frequency == "month":
+        end = day.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+        label = f"{start.year}-{start.month:02d}"
+    elif frequency == "quarter":
+        end = date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+        start = date(end.year - 1, 10, 1) if end.month == 1 else date(end.year, end.month - 3, 1)
+        label = f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    elif frequency == "year":
+        start, end = date(day.year - 1, 1, 1), date(day.year, 1, 1)
+        label = str(start.year)
+    else:
+        raise ValueError(f"Invalid frequency: {frequency}")
+
+    tz = get_timezone(tz_name)
+    return Period(f"{frequency}:{label}:{tz_name or 'local'}", frequency,
+                  _epoch_ms(start, tz), _epoch_ms(end, tz), tz_name or "")
+
+def report_period(now, frequency, tz=None):
+    """
+    Return the period a report sent at a given moment covers: the last complete
+    day, ISO week, calendar month, quarter or year in the website's timezone.
+
+    Args:
+        now (datetime): The moment the report is sent.
+        frequency (str): The report frequency, one of "day", "week", "month", "quarter", "year".
+        tz (str): The website's timezone name, or None for the local timezone.
+
+    Returns:
+        Period: The period.
+
+    Raises:
+        ValueError: If the frequency or timezone is invalid.
+    """
+    return _period_before(frequency, tz or "", _local_date(now, get_timezone(tz)))
+
+def previous_period(period):
+    """
+    Return the period before a period, for the comparison in a report.
+
+    Args:
+        period (Period): The period.
+
+    Returns:
+        Period: The period of the same frequency that ends where this one starts.
+    """
+    tz = get_timezone(period.tz)
+    start = datetime.fromtimestamp(period.start / 1000, tz=tz)
+    return _period_before(period.frequency, period.tz, start.date())
+
+def calculate_date_range(now, frequency, tz=None):
     """
     Calculates the start and end date range for analytics reports.
 
     Args:
         now (datetime): The current date and time.
         frequency (str): The report frequency, one of "day", "week", "month", "quarter", "year".
+        tz (str): The website's timezone name, or None for the local timezone.
 
     Returns:
-        tuple: A tuple containing the start and end dates as epoch timestamps in milliseconds.
+        tuple: A tuple containing the start and end dates as epoch timestamps in
+        milliseconds. The end is the last millisecond of the period, as the Umami
+        API includes it.
 
     Raises:
         ValueError: If the frequency is invalid.
         Exception: For other errors during calculation.
     """
     try:
-        # Convert the current datetime to an epoch timestamp in milliseconds
-        end_date = int(now.timestamp() * 1000)
-
-        # Map each frequency to a corresponding timedelta in days
-        frequency_map = {
-            "day": 1,
-            "week": 7,
-            "month": 30,
-            "quarter": 90,
-            "year": 365
-        }
-
-        # Validate the frequency input
-        if frequency not in frequency_map:
-            raise ValueError(f"Invalid frequency: {frequency}")
-
-        # Calculate the start date based on the frequency
-        new_datetime = now - timedelta(days=frequency_map[frequency])
-        range_start = int(new_datetime.timestamp() * 1000)
-
-        return range_start, end_date
+        period = report_period(now, frequency, tz)
+        return period.start, period.end - 1
 
     except Exception as e:
         # Handle unexpected errors and return default values
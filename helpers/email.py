@@ -4,26 +4,600 @@
 This module provides a function to send emails using an SMTP server. It supports
 customizable subject lines, email content, and recipient lists.
 
+To avoid a new connection, TLS handshake and login for every report, messages can
+be sent through a pool of authenticated SMTP connections that are reused. A
+`MailSender` queues messages and drains the queue with a number of worker threads
+that share the pool.
+
+When a mail spool is set, every message is stored in it before it is sent and
+acknowledged once the SMTP server has accepted it, so messages of a run that was
+interrupted can be sent by the next one.
+
+Reports can also be sent as a separate message per recipient. The body and
+attachments are then serialized once and shared by all messages; each recipient
+only gets its own `To:` header, and all messages of a report are streamed over
+one SMTP session.
+
+smtplib and the MIME classes are imported on first use, so a run with no report
+due never loads them.
+
 Functions:
+- build_message: Builds the MIME message for a report.
+- shared_body: Serializes a message once so it can be shared by per-recipient envelopes.
+- personalise: Builds the per-recipient envelopes for a shared body.
 - send_email: Sends an email with the given content to specified recipients.
+- set_mail_sender: Sets the pooled sender used by send_email.
+- set_mail_spool: Sets the spool messages are stored in before they are sent.
+- set_dry_run: Builds messages as usual but does not send them.
+- send_spooled_messages: Sends the messages earlier runs left in the spool.
+
+Classes:
+- SMTPPool: A pool of reusable, authenticated SMTP connections.
+- MailSender: Queues messages and sends them from worker threads through an SMTPPool.
 """
+import re
+import time
+import queue
 import logging
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+import threading
+import contextvars
+from concurrent.futures import Future
+
+from helpers.telemetry import span
 
 logger = logging.getLogger(__name__)
 
-def send_email(subject, email_content, recipient_emails, smtp_config, pdf_filename):
+_mail_sender = None
+_mail_spool = None
+_dry_run = False
+
+# Marks the end of the work in the send queue
+_DONE = object()
+
+def _send_message(server, from_email, recipient_emails, message):
+    """Send a message over an SMTP connection, timed as an "smtp_send" span."""
+    size = sum(map(len, message)) if isinstance(message, tuple) else len(message)
+    with span("smtp_send", recipients=len(recipient_emails), bytes=size):
+        _transmit(server, from_email, recipient_emails, message)
+
+def _transmit(server, from_email, recipient_emails, message):
+    """Send a complete message, or stream a per-recipient envelope and its shared body."""
+    import smtplib
+
+    if not isinstance(message, tuple):
+        server.sendmail(from_email, recipient_emails, message)
+        return
+
+    header, body = message
+    server.ehlo_or_helo_if_needed()
+    code, reply = server.mail(from_email)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, reply, from_email)
+
+    refused = {}
+    for recipient in recipient_emails:
+        code, reply = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, reply)
+    if len(refused) == len(recipient_emails):
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, reply = server.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, reply)
+
+    # The shared body is already CRLF terminated and dot-stuffed
+    server.send(header)
+    server.send(body)
+    server.send(b"." + smtplib.bCRLF)
+    code, reply = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, reply)
+
+def _reset(server):
+    """Reset the SMTP transaction after a refused message, so the connection can be reused."""
+    import smtplib
+
+    try:
+        server.rset()
+    except smtplib.SMTPException:
+        pass
+
+class SMTPPool:
+    """
+    A pool of reusable, authenticated SMTP connections.
+
+    Connections are opened when needed (up to `size`), checked with NOOP when they
+    have been idle for a while, and replaced when they fail or have sent
+    `max_messages` messages.
+
+    Args:
+        smtp_config (dict): SMTP configuration details (host, port, username, password).
+        size (int): Maximum number of open connections.
+        max_messages (int): Number of messages sent over one connection before it is replaced.
+        idle_check (float): Seconds a connection may be idle before it is checked with NOOP.
+        timeout (float): Socket timeout in seconds for SMTP commands.
+    """
+
+    def __init__(self, smtp_config, size=2, max_messages=100, idle_check=30, timeout=60):
+        self.smtp_config = smtp_config
+        self.size = max(1, size)
+        self.max_messages = max_messages
+        self.idle_check = idle_check
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(self.size)
+
+    def _connect(self):
+        """Open and authenticate a new SMTP connection."""
+        import smtplib
+
+        server = smtplib.SMTP(self.smtp_config['host'], self.smtp_config['port'], timeout=self.timeout)
+        server.starttls()  # Enable TLS encryption
+        server.login(self.smtp_config['username'], self.smtp_config['password'])  # Login with credentials
+        return {'server': server, 'messages': 0, 'last_used': time.monotonic()}
+
+    @staticmethod
+    def _close(connection):
+        """Close a connection, ignoring errors of a connection that is already gone."""
+        try:
+            connection['server'].quit()
+        except Exception:
+            try:
+                connection['server'].close()
+            except Exception:
+                pass
+
+    def _healthy(self, connection):
+        """Check a connection that has been idle for a while with NOOP."""
+        if time.monotonic() - connection['last_used'] < self.idle_check:
+            return True
+        try:
+            return connection['server'].noop()[0] == 250
+        except Exception:
+            return False
+
+    def _acquire(self):
+        """Take an idle, healthy connection from the pool or open a new one."""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._healthy(connection):
+                    return connection
+                self._close(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, broken=False):
+        """Return a connection to the pool, or close it when it is broken or used up."""
+        if broken or connection['messages'] >= self.max_messages:
+            self._close(connection)
+        else:
+            connection['last_used'] = time.monotonic()
+            self._idle.put(connection)
+        self._slots.release()
+
+    def send(self, from_email, recipient_emails, message):
+        """
+        Send a message over a pooled connection. When the connection turns out to be
+        dead, the message is sent once more over a fresh connection.
+
+        Args:
+            from_email (str): Sender's email address.
+            recipient_emails (list): Recipient email addresses.
+            message (str | bytes | tuple): The complete message, or a per-recipient
+                envelope (see personalise).
+
+        Raises:
+            smtplib.SMTPException | OSError: If the message could not be sent.
+        """
+        error = self.send_batch(from_email, [(recipient_emails, message)])[0]
+        if error is not None:
+            raise error
+
+    def send_batch(self, from_email, messages):
+        """
+        Send several messages over one pooled connection. A lost connection is
+        reopened and the message it failed on is sent once more; a message that is
+        refused does not stop the others.
+
+        Args:
+            from_email (str): Sender's email address.
+            messages (list): (recipients, message) tuples.
+
+        Returns:
+            list: None for every message that was accepted, or the exception it failed with.
+        """
+        import smtplib
+
+        results = []
+        connection = None
+        try:
+            for recipient_emails, message in messages:
+                error = None
+                for attempt in range(2):
+                    if connection is None:
+                        try:
+                            connection = self._acquire()
+                        except Exception as e:
+                            error = e
+                            break
+                    try:
+                        _send_message(connection['server'], from_email, recipient_emails, message)
+                    except smtplib.SMTPServerDisconnected as e:
+                        error = e
+                    except smtplib.SMTPException as e:
+                        # Refused by the server, the connection itself is fine
+                        error = e
+                        _reset(connection['server'])
+                        break
+                    except OSError as e:
+                        error = e
+                    else:
+                        error = None
+                        connection['messages'] += 1
+                        if connection['messages'] >= self.max_messages:
+                            self._release(connection)
+                            connection = None
+                        break
+
+                    # The connection was lost
+                    self._release(connection, broken=True)
+                    connection = None
+                    if not attempt:
+                        logger.warning("SMTP connection lost, reconnecting")
+                results.append(error)
+        finally:
+            if connection is not None:
+                self._release(connection)
+        return results
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+class MailSender:
+    """
+    Queues messages and sends them from worker threads through an SMTPPool.
+
+    Args:
+        pool (SMTPPool): The connection pool to send with.
+        workers (int): Number of sender threads.
+        queue_size (int): Maximum number of messages waiting to be sent.
+
+    Attributes:
+        sent (int): Number of messages accepted by the server.
+        failed (int): Number of messages that could not be sent.
+    """
+
+    def __init__(self, pool, workers=2, queue_size=100):
+        self.pool = pool
+        self.sent = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f"smtp-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, from_email, recipient_emails, message):
+        """
+        Queue a message for sending.
+
+        Args:
+            from_email (str): Sender's email address.
+            recipient_emails (list): Recipient email addresses.
+            message (str | bytes | tuple): The complete message, or a per-recipient envelope.
+
+        Returns:
+            concurrent.futures.Future: Resolves when the message has been accepted by the server.
+        """
+        return self.submit_batch(from_email, [(recipient_emails, message)])[0]
+
+    def submit_batch(self, from_email, messages):
+        """
+        Queue messages that are sent together over one SMTP session.
+
+        Args:
+            from_email (str): Sender's email address.
+            messages (list): (recipients, message) tuples.
+
+        Returns:
+            list: A concurrent.futures.Future for every message.
+        """
+        futures = [Future() for _ in messages]
+        # Sent in the context of the caller, so spans know which website the messages are for
+        self._queue.put((from_email, messages, futures, contextvars.copy_context()))
+        return futures
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+
+            from_email, messages, futures, context = item
+            try:
+                errors = context.run(self.pool.send_batch, from_email, messages)
+            except Exception as e:
+                errors = [e] * len(messages)
+
+            for (recipient_emails, _), future, error in zip(messages, futures, errors):
+                if error is None:
+                    with self._lock:
+                        self.sent += 1
+                    future.set_result(True)
+                else:
+                    logger.error(f"Failed to send email to {', '.join(recipient_emails)}: {error}")
+                    with self._lock:
+                        self.failed += 1
+                    future.set_exception(error)
+
+    def close(self):
+        """Send all queued messages, stop the workers and close the connections."""
+        for _ in self._workers:
+            self._queue.put(_DONE)
+        for worker in self._workers:
+            worker.join()
+        self.pool.close()
+
+    def reset_counters(self):
+        """Reset the sent and failed counters."""
+        with self._lock:
+            self.sent = 0
+            self.failed = 0
+
+def set_mail_sender(sender):
+    """
+    Set the pooled sender used by send_email.
+
+    Args:
+        sender (MailSender | None): The sender, or None to open a connection per email.
+    """
+    global _mail_sender
+    _mail_sender = sender
+
+def set_mail_spool(spool):
+    """
+    Set the spool messages are stored in before they are sent.
+
+    Args:
+        spool (MailSpool | None): The spool, or None to send without storing messages.
+    """
+    global _mail_spool
+    _mail_spool = spool
+
+def set_dry_run(enabled):
     """
-    Sends an email using the provided SMTP configuration.
+    Build messages as usual but do not send them, for example while profiling.
+
+    Args:
+        enabled (bool): True to skip the spool and the SMTP server in send_email.
+    """
+    global _dry_run
+    _dry_run = enabled
+
+def _acknowledge(message_id, error=None):
+    """Record the outcome of a spooled message."""
+    spool = _mail_spool
+    if spool is None or message_id is None:
+        return
+    try:
+        if error is None:
+            spool.ack(message_id)
+        else:
+            spool.fail(message_id, error)
+    except Exception as e:
+        logger.error(f"Failed to update mail spool for message {message_id}: {e}")
+
+def _deliver(from_email, messages, smtp_config, message_ids):
+    """Send messages through the pooled sender, or over one connection of their own."""
+    sender = _mail_sender
+    if sender:
+        futures = sender.submit_batch(from_email, messages)
+        for future, message_id in zip(futures, message_ids):
+            if message_id is not None:
+                future.add_done_callback(lambda f, message_id=message_id: _acknowledge(message_id, f.exception()))
+        return
+
+    import smtplib
+
+    sent = 0
+    try:
+        # Connect to the SMTP server and send the emails in one session
+        with smtplib.SMTP(smtp_config['host'], smtp_config['port']) as server:
+            server.starttls()  # Enable TLS encryption
+            server.login(smtp_config['username'], smtp_config['password'])  # Login with credentials
+            for (recipient_emails, message), message_id in zip(messages, message_ids):
+                try:
+                    _send_message(server, from_email, recipient_emails, message)  # Send the email
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except smtplib.SMTPException as e:
+                    logger.error(f"Failed to send email to {', '.join(recipient_emails)}: {e}")
+                    _acknowledge(message_id, e)
+                    _reset(server)
+                else:
+                    _acknowledge(message_id)
+                sent += 1
+    except Exception as e:
+        for message_id in message_ids[sent:]:
+            _acknowledge(message_id, e)
+        raise
+
+def send_spooled_messages(smtp_config):
+    """
+    Send the messages that earlier runs stored in the spool but never got accepted
+    by the SMTP server.
+
+    Args:
+        smtp_config (dict): SMTP configuration details (host, port, username, password).
+
+    Returns:
+        int: Number of messages handed to the sender.
+    """
+    if _mail_spool is None:
+        return 0
+
+    messages = _mail_spool.claim_pending()
+
+    # Messages from the same sender are sent together
+    batches = {}
+    for message_id, from_email, recipient_emails, message in messages:
+        batches.setdefault(from_email, []).append((message_id, recipient_emails, message))
+
+    for from_email, batch in batches.items():
+        try:
+            _deliver(from_email, [(recipients, message) for _, recipients, message in batch],
+                     smtp_config, [message_id for message_id, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Failed to send spooled emails: {e}")
+
+    if messages:
+        logger.info(f"Resumed {len(messages)} emails from the mail spool")
+    return len(messages)
+
+def build_message(subject, email_content, recipient_emails, from_email, pdf_filename=None, pdf_data=None, pdf_name=None):
+    """
+    Builds the MIME message for a report.
+
+    Args:
+        subject (str): Subject of the email.
+        email_content (str): The HTML email body.
+        recipient_emails (list): List of recipient email addresses. Leave empty to
+            add the `To:` header per recipient (see personalise).
+        from_email (str): Sender's email address.
+        pdf_filename (str): The filename of a PDF on disk to attach to the email.
+        pdf_data (bytes): A PDF document in memory to attach to the email (instead of pdf_filename).
+        pdf_name (str): The file name for the attached pdf_data.
+
+    Returns:
+        MIMEMultipart: The message.
+    """
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.application import MIMEApplication
+
+    # Create the email container (MIMEMultipart object)
+    msg = MIMEMultipart()
+    msg['From'] = from_email  # Set sender's email address
+    if recipient_emails:
+        msg['To'] = ", ".join(recipient_emails)  # Join recipient emails into a string
+    msg['Subject'] = subject  # Set the email subject
+
+    # Attach the email content (body)
+    msg.attach(MIMEText(email_content, 'html'))
+
+    # Attach the PDF document if provided, straight from memory
+    if pdf_data:
+        pdf_attachment = MIMEApplication(pdf_data, _subtype="pdf")
+        pdf_attachment.add_header('Content-Disposition', 'attachment', filename=pdf_name or "report.pdf")
+        msg.attach(pdf_attachment)
+
+    # Attach the PDF file if provided
+    elif pdf_filename:
+        try:
+            with open(pdf_filename, 'rb') as pdf_file:
+                pdf_attachment = MIMEApplication(pdf_file.read(), _subtype="pdf")
+                pdf_attachment.add_header('Content-Disposition', 'attachment', filename=pdf_filename)
+                msg.attach(pdf_attachment)
+        except Exception as e:
+            logger.error(f"Failed to attach PDF: {e}")
+
+    return msg
+
+def shared_body(msg):
+    """
+    Serialize a message once, so it can be shared by per-recipient envelopes.
+
+    Args:
+        msg (email.message.Message): The message, without a `To:` header.
+
+    Returns:
+        bytes: The message with CRLF line endings and dot-stuffed, ready to stream
+        after the DATA command.
+    """
+    import smtplib
+
+    data = re.sub(rb"(?m)^\.", b"..", msg.as_bytes(policy=msg.policy.clone(linesep="\r\n")))
+    if not data.endswith(smtplib.bCRLF):
+        data += smtplib.bCRLF
+    return data
+
+def _to_header(recipient):
+    """
+    Build the `To:` header line of a per-recipient envelope.
+
+    Args:
+        recipient (str): The recipient, an address with an optional display name.
+
+    Returns:
+        bytes: The encoded header line, ending in CRLF.
+
+    Raises:
+        ValueError: If the recipient contains a line break or is not an address.
+    """
+    from email.utils import parseaddr, formataddr
+
+    # A line break would end the header and let the rest be read as headers of its own
+    if "\r" in recipient or "\n" in recipient:
+        raise ValueError(f"Recipient {recipient!r} contains a line break")
+    name, address = parseaddr(recipient)
+    if "@" not in address:
+        raise ValueError(f"Recipient {recipient!r} is not an email address")
+
+    try:
+        # Encodes a non-ASCII display name (RFC 2047)
+        value = formataddr((name, address), charset="utf-8")
+    except UnicodeEncodeError:
+        value = address  # Non-ASCII address, sent as is
+    return f"To: {value}\r\n".encode("utf-8")
+
+def personalise(body, recipient_emails):
+    """
+    Build a message per recipient that shares one serialized body.
+
+    Args:
+        body (bytes): The shared body, see shared_body.
+        recipient_emails (list): Recipient email addresses.
+
+    Returns:
+        list: (recipients, (header, body)) tuples; only the small `To:` header is
+        built per recipient, the body is not copied.
+
+    Raises:
+        ValueError: If a recipient contains a line break or is not an address.
+    """
+    return [([recipient], (_to_header(recipient), body)) for recipient in recipient_emails]
+
+def send_email(subject, email_content, recipient_emails, smtp_config, pdf_filename=None, pdf_data=None, pdf_name=None,
+               spool_key=None, per_recipient=False):
+    """
+    Sends an email using the provided SMTP configuration. When a pooled sender is set
+    (see set_mail_sender) the message is queued on it; otherwise a connection is
+    opened for this email only.
 
     Args:
         subject (str): Subject of the email.
         email_content (MIMEText): The email body as a MIMEText object.
         recipient_emails (list): List of recipient email addresses.
-        pdf-filename (str): The filename of the PDF to attach to the email.
+        pdf_filename (str): The filename of a PDF on disk to attach to the email.
+        pdf_data (bytes): A PDF document in memory to attach to the email (instead of pdf_filename).
+        pdf_name (str): The file name for the attached pdf_data.
+        spool_key (str): The report job the email belongs to. When a mail spool is set,
+            the email is stored in it before it is sent.
+        per_recipient (bool): Send a separate message to every recipient, sharing one
+            serialized body and attachment.
         smtp_config (dict): SMTP configuration details, including:
             - host (str): SMTP server host.
             - port (int): SMTP server port.
@@ -36,32 +610,24 @@ def send_email(subject, email_content, recipient_emails, smtp_config, pdf_filena
     """
 
     try:
-        # Create the email container (MIMEMultipart object)
-        msg = MIMEMultipart()
-        msg['From'] = smtp_config['from_email']  # Set sender's email address
-        msg['To'] = ", ".join(recipient_emails)  # Join recipient emails into a string
-        msg['Subject'] = subject  # Set the email subject
+        if per_recipient:
+            msg = build_message(subject, email_content, [], smtp_config['from_email'],
+                                pdf_filename, pdf_data, pdf_name)
+            messages = personalise(shared_body(msg), recipient_emails)
+        else:
+            msg = build_message(subject, email_content, recipient_emails, smtp_config['from_email'],
+                                pdf_filename, pdf_data, pdf_name)
+            messages = [(recipient_emails, msg.as_string())]
 
-        # Attach the email content (body)
-        msg.attach(MIMEText(email_content, 'html'))
+        if _dry_run:
+            logger.info(f"Dry run, email to {', '.join(recipient_emails)} not sent")
+            return
 
-        # Attach the PDF file if provided
-        if pdf_filename:
-            try:
-                with open(pdf_filename, 'rb') as pdf_file:
-                    pdf_attachment = MIMEApplication(pdf_file.read(), _subtype="pdf")
-                    pdf_attachment.add_header('Content-Disposition', 'attachment', filename=pdf_filename)
-                    msg.attach(pdf_attachment)
-            except Exception as e:
-                logger.error(f"Failed to attach PDF: {e}")
+        message_ids = [None] * len(messages)
+        if _mail_spool is not None and spool_key:
+            message_ids = _mail_spool.enqueue(spool_key, smtp_config['from_email'], messages)
 
-        # Connect to the SMTP server and send the email
-        with smtplib.SMTP(smtp_config['host'], smtp_config['port']) as server:
-            server.starttls()  # Enable TLS encryption
-            server.login(smtp_config['username'], smtp_config['password'])  # Login with credentials
-            server.sendmail(
-                smtp_config['from_email'], recipient_emails, msg.as_string()
-            )  # Send the email
+        _deliver(smtp_config['from_email'], messages, smtp_config, message_ids)
 
     except Exception as e:
         # Handle any exceptions during the email sending process
@@ -0,0 +1,284 @@
+"""
+🌐 Shared HTTP Client
+
+This module provides one pooled, keep-alive HTTP session that is shared by all
+Umami API calls, so connections (and their TLS handshakes) are reused across
+requests and worker threads.
+
+Requests that fail with a connection error or are answered with 429/502/503/504
+are retried with jittered exponential backoff, honouring `Retry-After`. The number
+of requests in flight per host is governed by an AIMD limiter: it starts at the
+pool size, is halved whenever the server pushes back and grows again while the
+server keeps up.
+
+`requests` is imported on first use, so a run with no report due never loads it.
+
+Functions:
+- configure_http: Sets the pool size, timeouts, retry and concurrency settings.
+- get_session: Returns the shared session, creating it on first use.
+- get_timeout: Returns the (connect, read) timeout tuple for requests.
+- get_limiter: Returns the concurrency limiter for a host.
+- retry_delay: Computes how long to wait before the next attempt.
+- request: Performs an HTTP request through the shared session.
+
+Classes:
+- HostLimiter: Additive-increase/multiplicative-decrease concurrency limiter.
+"""
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from helpers.telemetry import count
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean "try again later"
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_settings = {
+    "pool_size": 10,
+    "connect_timeout": 5,
+    "read_timeout": 30,
+    "retries": 3,
+    "backoff_base": 0.5,
+    "backoff_max": 30,
+    "min_concurrency": 1,
+    "initial_concurrency": 0,  # 0 starts at the pool size
+}
+_session = None
+_limiters = {}
+_lock = threading.Lock()
+
+class HostLimiter:
+    """
+    Limits the number of requests in flight to one host using AIMD: the limit grows
+    by one for every window of successful requests and is halved when the server
+    answers with a throttling status or fails. Push-back from requests that were
+    already in flight when the limit was lowered does not lower it again.
+
+    Args:
+        initial (int): The starting limit.
+        minimum (int): The limit never drops below this value.
+        maximum (int): The limit never grows above this value.
+    """
+
+    # Seconds between two decreases of the limit
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(self, initial=8, minimum=1, maximum=10):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until a request may be sent."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        """
+        Mark a request as finished and adapt the limit.
+
+        Args:
+            throttled (bool): True if the server pushed back or the request failed.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.DECREASE_INTERVAL:
+                    self._last_decrease = now
+                    self.limit = max(self.minimum, self.limit / 2)
+                    logger.info(f"Server pushed back, concurrency limit lowered to {int(self.limit)}")
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+def configure_http(pool_size=None, connect_timeout=None, read_timeout=None, retries=None,
+                   backoff_base=None, backoff_max=None, min_concurrency=None, initial_concurrency=None):
+    """
+    Configure the shared HTTP session. An existing session is closed and will be
+    recreated with the new settings on the next request.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host. Should match
+            the number of threads that can call the API at the same time. This is also
+            the highest concurrency the limiter will grow to.
+        connect_timeout (float): Seconds to wait for a connection to be established.
+        read_timeout (float): Seconds to wait for the server to send data.
+        retries (int): Number of retries after a failed or throttled request.
+        backoff_base (float): Base delay in seconds for the exponential backoff.
+        backoff_max (float): Maximum delay in seconds between two attempts.
+        min_concurrency (int): Lowest number of requests in flight per host.
+        initial_concurrency (int): Number of requests in flight per host to start with,
+            or 0 to start at pool_size and only lower it when the server pushes back.
+    """
+    global _session
+
+    values = {
+        "pool_size": pool_size,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout,
+        "retries": retries,
+        "backoff_base": backoff_base,
+        "backoff_max": backoff_max,
+        "min_concurrency": min_concurrency,
+        "initial_concurrency": initial_concurrency,
+    }
+
+    with _lock:
+        for key, value in values.items():
+            if value is not None:
+                _settings[key] = type(_settings[key])(value)
+
+        if _session is not None:
+            _session.close()
+            _session = None
+        _limiters.clear()
+
+    logger.info(f"HTTP client configured: {_settings}")
+
+def get_session():
+    """
+    Return the shared HTTP session, creating it on first use.
+
+    Returns:
+        requests.Session: A session with connection pooling and keep-alive enabled.
+    """
+    global _session
+
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=_settings["pool_size"],
+                    pool_block=True  # Wait for a free connection instead of opening extra ones
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Accept": "application/json",
+                    "Accept-Encoding": "gzip, deflate",
+                    "Connection": "keep-alive",
+                })
+                _session = session
+    return _session
+
+def get_timeout():
+    """
+    Return the timeout used for every request.
+
+    Returns:
+        tuple: The (connect, read) timeout in seconds.
+    """
+    return (_settings["connect_timeout"], _settings["read_timeout"])
+
+def get_limiter(host):
+    """
+    Return the concurrency limiter for a host.
+
+    Args:
+        host (str): The host (and port) requests are sent to.
+
+    Returns:
+        HostLimiter: The limiter shared by all requests to the host.
+    """
+    with _lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = HostLimiter(
+                initial=_settings["initial_concurrency"] or _settings["pool_size"],
+                minimum=_settings["min_concurrency"],
+                maximum=_settings["pool_size"]
+            )
+            _limiters[host] = limiter
+        return limiter
+
+def retry_delay(attempt, response=None):
+    """
+    Compute how long to wait before the next attempt.
+
+    Args:
+        attempt (int): The number of the attempt that failed, starting at 0.
+        response (requests.Response): The throttled response, if there was one.
+
+    Returns:
+        float: Seconds to wait. The server's Retry-After header is honoured,
+        otherwise an exponential backoff with full jitter is used.
+    """
+    backoff_max = _settings["backoff_max"]
+
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(backoff_max, max(0.0, float(retry_after)))
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return min(backoff_max, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+            except (TypeError, ValueError):
+                pass
+
+    return random.uniform(0, min(backoff_max, _settings["backoff_base"] * (2 ** attempt)))
+
+def request(method, url, **kwargs):
+    """
+    Perform an HTTP request through the shared session, retrying connection errors
+    and throttled responses.
+
+    Args:
+        method (str): The HTTP method ("GET", "POST", ...).
+        url (str): The URL to request.
+        **kwargs: Extra arguments passed on to requests (headers, params, json, ...).
+
+    Returns:
+        requests.Response: The response of the request. After the last retry the
+        throttled response itself is returned.
+
+    Raises:
+        requests.exceptions.RequestException: If the request still fails after all retries.
+    """
+    import requests
+
+    kwargs.setdefault("timeout", get_timeout())
+    limiter = get_limiter(urlparse(url).netloc)
+    retries = _settings["retries"]
+
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            limiter.release(throttled=True)
+            if attempt >= retries:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"Request to {url} failed ({e}), retrying in {delay:.1f}s")
+        else:
+            throttled = response.status_code in RETRY_STATUSES
+            limiter.release(throttled=throttled)
+            if not throttled or attempt >= retries:
+                return response
+            delay = retry_delay(attempt, response)
+            logger.warning(f"Request to {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+
+        attempt += 1
+        count("retries")
+        time.sleep(delay)
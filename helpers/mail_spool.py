@@ -0,0 +1,353 @@
+"""
+📮 Mail Spool
+
+This module provides a durable outbound mail queue, so a run that crashes or is
+killed halfway does not lose or duplicate reports.
+
+Every report job is recorded in a SQLite database before its data is fetched, and
+every rendered message is stored before it is handed to the SMTP server. A
+message is acknowledged once the server has accepted it. The next run sends the
+messages that were never acknowledged and runs the report jobs that never got as
+far as a message, while jobs that were already sent are skipped.
+
+Messages sent per recipient share one body, which is stored only once.
+
+Rows are owned by the run that created them. Rows of a run that is no longer
+alive, or that nobody touched for `lease` seconds, may be taken over by the next
+run; that is also how a daemon retries its own failed messages. Messages that
+are still pending after `resume_window` seconds are given up as abandoned.
+
+Classes:
+- MailSpool: SQLite backed spool for report jobs and outbound messages.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+def _owner_alive(owner):
+    """Check whether the run owning a row is still running (only known for this host)."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+class MailSpool:
+    """
+    SQLite backed spool for report jobs and outbound messages.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        max_attempts (int): Number of times a job or message is tried before it is given up.
+        lease (float): Seconds after which rows of a run that still seems alive may be taken over.
+        retention (float): Seconds sent jobs are remembered, to skip duplicate reports.
+        resume_window (float): Jobs planned longer ago than this are not resumed anymore.
+    """
+
+    def __init__(self, path=".cache/mail_spool.sqlite", max_attempts=3, lease=900,
+                 retention=7 * 24 * 3600, resume_window=24 * 3600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.retention = retention
+        self.resume_window = resume_window
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")  # An acknowledgement must survive a crash
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                key TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                run_at TEXT NOT NULL,
+                state TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_key TEXT NOT NULL,
+                from_email TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                message BLOB,
+                body_id INTEGER,
+                state TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bodies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data BLOB NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "body_id" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN body_id INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_state ON messages (state)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_job ON messages (job_key)")
+
+    def _stale(self, owner, updated_at, now):
+        """Check whether a row may be taken over: its run is gone, or it was not touched for `lease` seconds."""
+        return updated_at < now - self.lease or (owner != self.owner and not _owner_alive(owner))
+
+    def plan(self, key, site, run_at):
+        """
+        Record a report job before it is run.
+
+        Args:
+            key (str): The key that identifies the report (website, recipients and period).
+            site (dict): The website configuration.
+            run_at (datetime): The moment the run was started.
+
+        Returns:
+            bool: True if the job should be run, False if it was already sent or is
+            handled by another run.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (key, site, run_at, state, owner, attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'planned', ?, 1, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET updated_at = excluded.updated_at "
+                "WHERE jobs.owner = excluded.owner AND jobs.state = 'planned'",
+                (key, json.dumps(site), run_at.isoformat(), self.owner, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def unfinished_jobs(self):
+        """
+        Take over the jobs of earlier runs that never got as far as a message.
+
+        Returns:
+            list: (key, site, run_at) tuples of the jobs to run again.
+        """
+        now = time.time()
+        jobs = []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, site, run_at, owner, updated_at FROM jobs "
+                "WHERE state = 'planned' AND attempts < ? AND created_at >= ?",
+                (self.max_attempts, now - self.resume_window)
+            ).fetchall()
+            for key, site, run_at, owner, updated_at in rows:
+                if not self._stale(owner, updated_at, now):
+                    continue
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET owner = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE key = ? AND owner = ? AND state = 'planned'",
+                    (self.owner, now, key, owner)
+                )
+                if cursor.rowcount == 1:
+                    jobs.append((key, json.loads(site), datetime.fromisoformat(run_at)))
+        return jobs
+
+    def has_unfinished_work(self):
+        """
+        Check, without taking anything over, whether earlier runs left jobs or
+        messages that may have to be resumed.
+
+        Returns:
+            bool: True if there are planned jobs or pending messages left to try.
+        """
+        since = time.time() - self.resume_window
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM jobs WHERE state = 'planned' AND attempts < ? AND created_at >= ?) "
+                "OR EXISTS (SELECT 1 FROM messages WHERE state = 'pending' AND attempts < ? AND created_at >= ?)",
+                (self.max_attempts, since, self.max_attempts, since)
+            ).fetchone()
+        return bool(row[0])
+
+    def enqueue(self, key, from_email, messages):
+        """
+        Store the rendered messages of a job, in one transaction.
+
+        Args:
+            key (str): The key of the job.
+            from_email (str): Sender's email address.
+            messages (list): (recipients, message) tuples. A message is the complete
+                message, or a (header, body) envelope; a body shared by several envelopes
+                is stored once.
+
+        Returns:
+            list: The ids of the stored messages.
+        """
+        now = time.time()
+        ids = []
+        body_ids = {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for recipients, message in messages:
+                    body_id = None
+                    if isinstance(message, tuple):
+                        message, body = message
+                        body_id = body_ids.get(id(body))
+                        if body_id is None:
+                            body_id = self._conn.execute("INSERT INTO bodies (data) VALUES (?)", (body,)).lastrowid
+                            body_ids[id(body)] = body_id
+
+                    cursor = self._conn.execute(
+                        "INSERT INTO messages (job_key, from_email, recipients, message, body_id, state, owner, "
+                        "attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'pending', ?, 0, ?, ?)",
+                        (key, from_email, json.dumps(list(recipients)), message, body_id, self.owner, now, now)
+                    )
+                    ids.append(cursor.lastrowid)
+                self._conn.execute("UPDATE jobs SET state = 'queued', updated_at = ? WHERE key = ?", (now, key))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def claim_pending(self):
+        """
+        Take over the messages of earlier runs that were never acknowledged.
+
+        Returns:
+            list: (id, from_email, recipients, message) tuples of the messages to send.
+            A message is the complete message or a (header, body) envelope.
+        """
+        now = time.time()
+        messages = []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, from_email, recipients, message, body_id, owner, updated_at FROM messages "
+                "WHERE state = 'pending' AND attempts < ? AND created_at >= ?",
+                (self.max_attempts, now - self.resume_window)
+            ).fetchall()
+            bodies = {}
+            for message_id, from_email, recipients, message, body_id, owner, updated_at in rows:
+                if not self._stale(owner, updated_at, now):
+                    continue
+                cursor = self._conn.execute(
+                    "UPDATE messages SET owner = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                    (self.owner, now, message_id, owner)
+                )
+                if cursor.rowcount != 1:
+                    continue
+
+                if body_id is not None:
+                    # Load a shared body once for all its envelopes
+                    if body_id not in bodies:
+                        row = self._conn.execute("SELECT data FROM bodies WHERE id = ?", (body_id,)).fetchone()
+                        bodies[body_id] = row[0] if row else None
+                    if bodies[body_id] is None:
+                        continue
+                    message = (message, bodies[body_id])
+                messages.append((message_id, from_email, json.loads(recipients), message))
+        return messages
+
+    def ack(self, message_id):
+        """
+        Mark a message as accepted by the SMTP server. The job is marked as sent once
+        all its messages are.
+
+        Args:
+            message_id (int): The id of the message.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE messages SET state = 'sent', message = NULL, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (now, message_id)
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'sent', updated_at = ? "
+                    "WHERE key = (SELECT job_key FROM messages WHERE id = ?) AND NOT EXISTS "
+                    "(SELECT 1 FROM messages WHERE job_key = jobs.key AND state != 'sent')",
+                    (now, message_id)
+                )
+                self._delete_unused_bodies()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def fail(self, message_id, error):
+        """
+        Record a failed delivery. The message is tried again by a later run until
+        max_attempts is reached.
+
+        Args:
+            message_id (int): The id of the message.
+            error (str): Why the delivery failed.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET attempts = attempts + 1, last_error = ?, updated_at = ?, "
+                "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE state END WHERE id = ?",
+                (str(error), time.time(), self.max_attempts, message_id)
+            )
+
+    def _delete_unused_bodies(self):
+        """Remove shared bodies that no pending message needs anymore."""
+        self._conn.execute(
+            "DELETE FROM bodies WHERE NOT EXISTS "
+            "(SELECT 1 FROM messages WHERE body_id = bodies.id AND state = 'pending')"
+        )
+
+    def purge(self):
+        """
+        Give up pending messages that are too old to be resumed, and remove sent,
+        failed and abandoned jobs and messages older than the retention period.
+        """
+        now = time.time()
+        cutoff = now - self.retention
+        with self._lock:
+            # claim_pending skips them, so they would otherwise stay pending forever
+            abandoned = self._conn.execute(
+                "UPDATE messages SET state = 'abandoned', updated_at = ? WHERE state = 'pending' AND created_at < ?",
+                (now, now - self.resume_window)
+            ).rowcount
+            if abandoned:
+                logger.warning(f"Gave up {abandoned} emails that could not be sent within the resume window")
+            self._conn.execute("DELETE FROM messages WHERE state != 'pending' AND updated_at < ?", (cutoff,))
+            self._conn.execute(
+                "DELETE FROM jobs WHERE updated_at < ? AND NOT EXISTS "
+                "(SELECT 1 FROM messages WHERE job_key = jobs.key)",
+                (cutoff,)
+            )
+            self._delete_unused_bodies()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
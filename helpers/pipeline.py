@@ -0,0 +1,162 @@
+"""
+🏭 Report Pipeline
+
+This module runs report jobs through separate stages, so slow network I/O and
+CPU-bound PDF rendering do not block each other:
+
+    fetch (I/O threads) -> render HTML (threads) -> PDF (process pool) -> send (threads)
+
+Every stage has its own number of workers and the stages are connected by
+bounded queues, so a fast stage cannot run far ahead of a slow one. WeasyPrint
+holds the GIL while it lays out a document, which is why PDFs are rendered in
+separate processes that import WeasyPrint (and load their fonts) once. The
+processes are started by a fork server (or spawned where there is none) rather
+than forked from the threaded main process.
+
+Functions:
+- render_pdf: Renders an HTML string to PDF bytes (runs in a worker process).
+- run_pipeline: Runs report jobs through the fetch, render, PDF and send stages.
+"""
+import time
+import queue
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.telemetry import record_span
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the work in a queue
+_DONE = object()
+
+def _warm_up_worker():
+    """Import WeasyPrint and load its fonts once when a PDF worker process starts."""
+    from weasyprint import HTML
+    HTML(string="<p>warm-up</p>").write_pdf()
+
+def render_pdf(html):
+    """
+    Render an HTML string to a PDF document.
+
+    Args:
+        html (str): The HTML to render.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
+
+def _render_pdf_timed(html):
+    """Render a PDF and return it with the seconds it took, for the "pdf" span."""
+    started = time.perf_counter()
+    return render_pdf(html), time.perf_counter() - started
+
+def _job_name(job):
+    """Return a readable name for a job in log messages."""
+    return job.get('website_name', 'unknown') if isinstance(job, dict) else str(job)
+
+def run_pipeline(jobs, fetch, render, send, fetch_workers=5, render_workers=1,
+                 pdf_workers=2, send_workers=2, queue_size=20):
+    """
+    Run report jobs through the fetch, render, PDF and send stages.
+
+    Args:
+        jobs (list): The report jobs.
+        fetch (function): fetch(job) returns the data for a job (runs in an I/O thread).
+        render (function): render(job, data) returns (rendered, pdf_html); pdf_html is
+            None or the HTML to render to PDF in the PDF process pool.
+        send (function): send(job, rendered, pdf_data) delivers the report; pdf_data is
+            the rendered PDF bytes, or None when no PDF was rendered.
+        fetch_workers (int): Number of threads fetching data.
+        render_workers (int): Number of threads rendering HTML.
+        pdf_workers (int): Number of processes rendering PDFs.
+        send_workers (int): Number of threads sending reports.
+        queue_size (int): Maximum number of jobs waiting between two stages.
+
+    Returns:
+        int: Number of jobs that were sent.
+    """
+    if not jobs:
+        return 0
+
+    render_queue = queue.Queue(maxsize=queue_size)
+    send_queue = queue.Queue(maxsize=queue_size)
+    sent = []
+    sent_lock = threading.Lock()
+
+    def fetch_job(job):
+        try:
+            data = fetch(job)
+        except Exception as e:
+            logger.error(f"Failed to fetch data for {_job_name(job)}: {e}")
+            logger.debug(traceback.format_exc())
+            return
+        render_queue.put((job, data))  # Blocks while the render stage is behind
+
+    def render_stage(pdf_pool):
+        while True:
+            item = render_queue.get()
+            if item is _DONE:
+                return
+            job, data = item
+            try:
+                rendered, pdf_html = render(job, data)
+                pdf_future = pdf_pool.submit(_render_pdf_timed, pdf_html) if pdf_html else None
+            except Exception as e:
+                logger.error(f"Failed to render report for {_job_name(job)}: {e}")
+                logger.debug(traceback.format_exc())
+                continue
+            send_queue.put((job, rendered, pdf_future))  # Bounds the PDFs in flight
+
+    def send_stage():
+        while True:
+            item = send_queue.get()
+            if item is _DONE:
+                return
+            job, rendered, pdf_future = item
+            try:
+                pdf_data = None
+                if pdf_future:
+                    pdf_data, seconds = pdf_future.result()
+                    record_span("pdf", seconds, site=job.get('website_id') if isinstance(job, dict) else None)
+                send(job, rendered, pdf_data)
+            except Exception as e:
+                logger.error(f"Failed to send report for {_job_name(job)}: {e}")
+                logger.debug(traceback.format_exc())
+                continue
+            with sent_lock:
+                sent.append(job)
+
+    import multiprocessing  # Only needed here
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Forking copies the locks held by the running threads (logging, the HTTP
+    # session, the SQLite stores) into the worker, so workers are started from
+    # a clean server process instead
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=pdf_workers, initializer=_warm_up_worker,
+                             mp_context=multiprocessing.get_context(method)) as pdf_pool:
+        renderers = [threading.Thread(target=render_stage, args=(pdf_pool,), name=f"render-{i}")
+                     for i in range(render_workers)]
+        senders = [threading.Thread(target=send_stage, name=f"send-{i}")
+                   for i in range(send_workers)]
+        for thread in renderers + senders:
+            thread.start()
+
+        with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="fetch") as fetch_pool:
+            list(fetch_pool.map(fetch_job, jobs))
+
+        for _ in renderers:
+            render_queue.put(_DONE)
+        for thread in renderers:
+            thread.join()
+
+        for _ in senders:
+            send_queue.put(_DONE)
+        for thread in senders:
+            thread.join()
+
+    return len(sent)
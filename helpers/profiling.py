@@ -0,0 +1,207 @@
+"""
+🔍 Run Profiler
+
+This module profiles a complete report run, so it is clear whether WeasyPrint,
+the Jinja render, JSON parsing or something else dominates, without patching the
+script by hand. While it runs it collects:
+
+- a cProfile profile of every thread, merged into one;
+- the peak traced memory (tracemalloc) per stage, where the stages are the
+  telemetry spans: authenticate, fetch_stats, render, pdf and smtp_send. A
+  memory snapshot is kept of the run of every stage with the highest peak.
+  Stages that overlap in time share their peak;
+- stack samples of all threads, taken every few milliseconds by a sampler thread.
+
+When it stops it writes to its output directory:
+
+- profile.prof: the merged profile, for pstats, snakeviz and the like;
+- profile.txt: the profile sorted by cumulative and by own time;
+- memory.txt: the peak memory per stage and the largest allocations;
+- memory-<stage>.snapshot: the tracemalloc snapshots, for tracemalloc.Snapshot.load;
+- stacks.collapsed: the stack samples in collapsed-stack format, for
+  flamegraph.pl, speedscope or inferno.
+
+Work in other processes (the PDF workers of the pipeline mode) is not profiled.
+
+Classes:
+- Profiler: Profiles a run and writes the results.
+"""
+import os
+import io
+import re
+import sys
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+def _frame_label(code):
+    """Return the name of a frame in a collapsed stack."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Profiler:
+    """
+    Profiles a run and writes the results.
+
+    Args:
+        output_dir (str): Directory the results are written to.
+        interval (float): Seconds between two stack samples.
+        frames (int): Number of frames tracemalloc keeps per allocation.
+    """
+
+    def __init__(self, output_dir, interval=0.005, frames=25):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._stages = {}
+        self._active = Counter()
+        self._samples = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._thread_run = None
+        self._main_profile = None
+
+    def start(self):
+        """Start profiling this thread and every thread started from now on."""
+        tracemalloc.start(self.frames)
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._sampler.start()
+
+        # cProfile only sees the thread it was enabled in, so every new thread gets its own
+        profiler = self
+        thread_run = self._thread_run = threading.Thread.run
+
+        def profiled_run(thread):
+            profile = cProfile.Profile()
+            with profiler._lock:
+                profiler._profiles.append(profile)
+            profile.enable()
+            try:
+                thread_run(thread)
+            finally:
+                profile.disable()
+
+        threading.Thread.run = profiled_run
+
+        self._main_profile = cProfile.Profile()
+        self._main_profile.enable()
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the peak traced memory of a stage.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        with self._lock:
+            if not self._active:
+                tracemalloc.reset_peak()
+            self._active[name] += 1
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            with self._lock:
+                self._active[name] -= 1
+                if not self._active[name]:
+                    del self._active[name]
+                stats = self._stages.setdefault(name, {"runs": 0, "peak": 0, "snapshot": None})
+                stats["runs"] += 1
+                new_peak = peak > stats["peak"]
+                if new_peak:
+                    stats["peak"] = peak
+            if new_peak:
+                # Taken outside the lock, it copies every traced allocation; filtered when written
+                snapshot = tracemalloc.take_snapshot()
+                with self._lock:
+                    if stats["peak"] == peak:
+                        stats["snapshot"] = snapshot
+
+    def _sample(self):
+        """Take a stack sample of every thread until stopped."""
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: re.sub(r"[-_]\d+$", "", thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self._samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """
+        Stop profiling and write the results.
+
+        Returns:
+            str: The output directory.
+        """
+        self._main_profile.disable()
+        threading.Thread.run = self._thread_run
+        self._stop.set()
+        self._sampler.join()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._write_profile()
+        self._write_memory(peak)
+        with open(os.path.join(self.output_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, samples in sorted(self._samples.items()):
+                f.write(f"{stack} {samples}\n")
+
+        return self.output_dir
+
+    def _write_profile(self):
+        """Merge the profiles of all threads and write them, raw and sorted."""
+        stats = pstats.Stats(self._main_profile)
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            try:
+                stats.add(profile)
+            except TypeError:
+                continue  # A thread that never ran any Python code
+        stats.dump_stats(os.path.join(self.output_dir, "profile.prof"))
+
+        text = io.StringIO()
+        stats.stream = text
+        text.write(f"Profile of {len(profiles) + 1} threads, sorted by cumulative time\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+        text.write("\nSorted by own time\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(60)
+        with open(os.path.join(self.output_dir, "profile.txt"), "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+
+    def _write_memory(self, peak):
+        """Write the peak memory per stage and the largest allocations of every snapshot."""
+        lines = [f"Peak traced memory of the run: {peak / 1024 / 1024:.1f} MiB", "",
+                 f"{'stage':<16} {'runs':>6} {'peak MiB':>10}"]
+        for name, stats in sorted(self._stages.items(), key=lambda item: item[1]["peak"], reverse=True):
+            lines.append(f"{name:<16} {stats['runs']:>6} {stats['peak'] / 1024 / 1024:>10.1f}")
+
+        for name, stats in sorted(self._stages.items()):
+            snapshot = stats["snapshot"]
+            if snapshot is None:
+                continue
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*"),
+            ])
+            snapshot.dump(os.path.join(self.output_dir, f"memory-{name}.snapshot"))
+            lines += ["", f"Largest allocations at the end of the {name} run with the highest peak:"]
+            for statistic in snapshot.statistics("lineno")[:15]:
+                lines.append(f"  {statistic}")
+
+        with open(os.path.join(self.output_dir, "memory.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
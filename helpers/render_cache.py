@@ -0,0 +1,179 @@
+"""
+🧾 Render Cache
+
+This module provides a content-addressed cache for rendered reports. Reports for
+the same template and the same data (for example several config entries for one
+website with different recipients) are rendered once; the HTML and PDF are then
+reused instead of running Jinja2 and WeasyPrint again.
+
+Entries are files named after the hash of the template source and the template
+context. The cache is bounded in size and removes the least recently used files
+first. The size is kept up to date in memory as reports are stored, so the
+folder is only listed when the cache has grown too large, and every
+`evict_every` stores to pick up what other runs stored.
+
+Functions:
+- hash_context: Computes a stable hash of a template context.
+
+Classes:
+- RenderCache: File based cache for rendered HTML and PDF reports.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections.abc import Mapping
+
+logger = logging.getLogger(__name__)
+
+def _jsonable(value):
+    """Convert values json does not know (read-only mappings, sets, ...) for hashing."""
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+def hash_context(context):
+    """
+    Compute a stable hash of a template context.
+
+    Args:
+        context (dict): The template context.
+
+    Returns:
+        str: Hex digest that only changes when the context data changes.
+    """
+    data = json.dumps(context, sort_keys=True, default=_jsonable, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+class RenderCache:
+    """
+    File based cache for rendered HTML and PDF reports.
+
+    Args:
+        cache_dir (str): Folder to store the rendered reports in.
+        max_bytes (int): Maximum total size of the cache, in bytes.
+        evict_every (int): Number of stores after which the folder is listed again,
+            even when the cache seems small enough.
+
+    Attributes:
+        hits (int): Number of lookups that were served from the cache.
+        misses (int): Number of lookups that had to be rendered.
+    """
+
+    def __init__(self, cache_dir="pdf-files/.cache", max_bytes=200 * 1024 * 1024, evict_every=100):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None  # Total size of the cache, unknown until the folder is listed
+        self._puts = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(template_hash, context):
+        """
+        Build the cache key for a report.
+
+        Args:
+            template_hash (str): Hash of the template source.
+            context (dict): The template context.
+
+        Returns:
+            str: The cache key.
+        """
+        return hashlib.sha256(f"{template_hash}:{hash_context(context)}".encode("utf-8")).hexdigest()
+
+    def _path(self, key, kind):
+        return os.path.join(self.cache_dir, f"{key}.{kind}")
+
+    def get(self, key, kind):
+        """
+        Return a cached report.
+
+        Args:
+            key (str): The cache key.
+            kind (str): "html" or "pdf".
+
+        Returns:
+            bytes | None: The cached report, or None on a miss.
+        """
+        path = self._path(key, kind)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, kind, data):
+        """
+        Store a rendered report and evict the least recently used files when the
+        cache has grown too large.
+
+        Args:
+            key (str): The cache key.
+            kind (str): "html" or "pdf".
+            data (bytes): The rendered report.
+        """
+        path = self._path(key, kind)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to store rendered report in cache: {e}")
+            return
+
+        with self._lock:
+            self._puts += 1
+            if self._size is not None:
+                self._size += len(data) - replaced
+            if self._size is None or self._size > self.max_bytes or self._puts % self.evict_every == 0:
+                self._evict()
+
+    def _evict(self):
+        """
+        List the cache and, when it is larger than max_bytes, remove the least recently
+        used files until it is back at 90% of max_bytes, so the next stores fit without
+        listing the folder again.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        target = self.max_bytes if total <= self.max_bytes else int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    def reset_counters(self):
+        """Reset the hit and miss counters."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,289 @@
+"""
+📦 Daily Rollup Store
+
+This module keeps the statistics of every finished day in a local SQLite store, so
+week, month, quarter and year reports are built by merging day buckets instead of
+asking Umami to aggregate the whole window again.
+
+Only metrics that count pageviews and events (url, referrer, event) add up over
+days. The general stats include unique visitors, and the browser, os, device and
+country metrics count sessions; added up per day, a visitor who returns on
+another day would be counted again. Those are fetched for the whole range in one
+query, which also returns the comparison with the previous period.
+
+Days are fed by the reports themselves: the few days a report needs that are not
+stored yet (at most `max_missing_days`) are fetched and stored. When more are
+missing, as for the first long report of a website, the report is fetched as one
+range instead of day by day, and a backfill fills the store up front.
+
+Functions:
+- days_in_range: Lists the days of a range.
+- day_bounds: Returns the start and end of a day in epoch milliseconds.
+- day_types: Returns the stat types that are built from day buckets.
+- merge_days: Merges day buckets into the statistics of a report.
+- get_rollup_data: Returns report statistics from the store, fetching missing days.
+
+Classes:
+- RollupStore: SQLite store of per-day statistics.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as day_start, timedelta
+
+from helpers.cache import CLOSED_RANGE_GRACE_MS
+from helpers.date_ranges import get_timezone
+
+logger = logging.getLogger(__name__)
+
+_STATS = ("pageviews", "visitors", "visits", "bounces", "totaltime")
+
+# Metrics that count pageviews or events, so the counts of days add up to the
+# count of a range; the other types count unique visitors or sessions
+_DAY_TYPES = ("url", "referrer", "event")
+
+def day_types(what_stats):
+    """
+    Return the stat types of a report that are built from day buckets.
+
+    Args:
+        what_stats (list): The stat types of the report.
+
+    Returns:
+        list: The types whose day counts add up; the others are fetched for the whole range.
+    """
+    return [type for type in what_stats if type in _DAY_TYPES]
+
+def days_in_range(range_start, range_end, tz=None):
+    """
+    List the days of a range.
+
+    Args:
+        range_start (int): Start of the range in epoch milliseconds.
+        range_end (int): End of the range in epoch milliseconds.
+        tz (str): The timezone the days are in, or None for the local timezone.
+
+    Returns:
+        list: The dates from the first to the last day of the range.
+    """
+    zone = get_timezone(tz)
+    first = datetime.fromtimestamp(range_start / 1000, tz=zone).date()
+    last = datetime.fromtimestamp(range_end / 1000, tz=zone).date()
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+def day_bounds(day, tz=None):
+    """
+    Return the start and end of a day.
+
+    Args:
+        day (date): The day.
+        tz (str): The timezone the day is in, or None for the local timezone.
+
+    Returns:
+        tuple: The first and last millisecond of the day, in epoch milliseconds.
+    """
+    zone = get_timezone(tz)
+    start = int(datetime.combine(day, day_start(), tzinfo=zone).timestamp() * 1000)
+    end = int(datetime.combine(day + timedelta(days=1), day_start(), tzinfo=zone).timestamp() * 1000) - 1
+    return start, end
+
+def _to_bucket(type, data):
+    """Convert the statistics of one day into what is stored: the totals without prev."""
+    if type == "stats":
+        return {name: data[name]["value"] for name in _STATS}
+    return data
+
+def _merge_metric(buckets):
+    """Add up label-value rows of several days, highest value first."""
+    totals = Counter()
+    for rows in buckets:
+        for row in rows:
+            totals[row["label"]] += row["value"]
+    ordered = sorted(totals.items(), key=lambda item: (-item[1], "" if item[0] is None else str(item[0])))
+    return [{"label": label, "value": value} for label, value in ordered]
+
+def merge_days(stored, days, what_stats):
+    """
+    Merge day buckets into the statistics of a report.
+
+    Args:
+        stored (dict): Day buckets keyed on (day, type).
+        days (list): The days of the report.
+        what_stats (list): The stat types to merge, see day_types.
+
+    Returns:
+        dict: The statistics, in the same structure as get_umami_data returns.
+    """
+    return {type: _merge_metric(stored[(day, type)] for day in days) for type in what_stats}
+
+class RollupStore:
+    """
+    SQLite store of per-day statistics. A day is kept per timezone, as a day in
+    Amsterdam covers other hours than a day in New York.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, path=".cache/rollups.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS day_buckets (
+                website_id TEXT NOT NULL,
+                tz TEXT NOT NULL,
+                day TEXT NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (website_id, tz, day, type)
+            )
+            """
+        )
+
+        # Days stored before timezones were kept are days in the local timezone
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'days'").fetchone():
+            self._conn.execute(
+                "INSERT OR IGNORE INTO day_buckets (website_id, tz, day, type, data, created_at) "
+                "SELECT website_id, '', day, type, data, created_at FROM days"
+            )
+            self._conn.execute("DROP TABLE days")
+
+    def get(self, website_id, first, last, types, tz=None):
+        """
+        Return the stored day buckets of a website.
+
+        Args:
+            website_id (str): The ID of the website in Umami.
+            first (date): The first day.
+            last (date): The last day.
+            types (list): The stat types.
+            tz (str): The timezone of the days, or None for the local timezone.
+
+        Returns:
+            dict: Day buckets keyed on (day, type).
+        """
+        types = list(types)
+        if not types:
+            return {}
+
+        in_list = ", ".join("?" * len(types))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT day, type, data FROM day_buckets WHERE website_id = ? AND tz = ? "
+                f"AND day >= ? AND day <= ? AND type IN ({in_list})",
+                (website_id, tz or "", first.isoformat(), last.isoformat(), *types)
+            ).fetchall()
+        return {(date.fromisoformat(day), type): json.loads(data) for day, type, data in rows}
+
+    def put(self, website_id, day, mystats, tz=None):
+        """
+        Store the statistics of one finished day.
+
+        Args:
+            website_id (str): The ID of the website in Umami.
+            day (date): The day.
+            mystats (dict): The statistics of the day, as get_umami_data returns them.
+            tz (str): The timezone of the day, or None for the local timezone.
+        """
+        rows = []
+        now = time.time()
+        for type, data in mystats.items():
+            bucket = json.dumps(_to_bucket(type, data), separators=(",", ":"))
+            rows.append((website_id, tz or "", day.isoformat(), type, bucket, now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO day_buckets (website_id, tz, day, type, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+def get_rollup_data(store, fetch, website_id, range_start, range_end, what_stats, max_missing_days=7,
+                    max_workers=8, tz=None):
+    """
+    Return the statistics of a report, merging the stored days of the metrics that
+    add up over days and fetching the other types for the whole range. Up to
+    `max_missing_days` days that are not stored yet are fetched and stored; with more
+    missing days the whole report is fetched as one range.
+
+    Args:
+        store (RollupStore): The rollup store.
+        fetch (function): fetch(range_start, range_end, what_stats) returns the statistics
+            of a range, as get_umami_data does.
+        website_id (str): The ID of the website in Umami.
+        range_start (int): Start of the range in epoch milliseconds, at the start of a day in tz.
+        range_end (int): End of the range in epoch milliseconds, at the end of a day in tz.
+        what_stats (list): The stat types of the report.
+        max_missing_days (int): Most days that are fetched one by one for one report.
+        max_workers (int): Most API calls in flight for this report, as for get_umami_data:
+            missing days are fetched concurrently, each with all its stat types at once.
+        tz (str): The timezone of the report, or None for the local timezone.
+
+    Returns:
+        dict: The statistics, in the same structure as get_umami_data returns.
+    """
+    days = days_in_range(range_start, range_end, tz)
+    closed_before = time.time() * 1000 - CLOSED_RANGE_GRACE_MS
+
+    merged_types = day_types(what_stats)
+    # Only finished days are stored; today is always fetched with the range
+    if not merged_types or day_bounds(days[-1], tz)[1] > closed_before:
+        return fetch(range_start, range_end, what_stats)
+
+    stored = store.get(website_id, days[0], days[-1], merged_types, tz)
+    missing = {}
+    for day in days:
+        types = [type for type in merged_types if (day, type) not in stored]
+        if types:
+            missing[day] = types
+
+    if len(missing) > max_missing_days:
+        logger.info(f"{len(missing)} days of website {website_id} are not in the rollup store, fetching the "
+                    f"whole range; fill the store with --backfill")
+        return fetch(range_start, range_end, what_stats)
+
+    if missing:
+        logger.info(f"Fetching {len(missing)} days of website {website_id} that are not in the rollup store")
+
+        def fetch_day(item):
+            day, types = item
+            return day, fetch(*day_bounds(day, tz), types)
+
+        # Every day fetches its types concurrently, so the days share the workers
+        workers = max(1, min(len(missing), max_workers // len(merged_types)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for day, day_stats in executor.map(fetch_day, sorted(missing.items())):
+                if day_stats:
+                    store.put(website_id, day, day_stats, tz)
+                    stored.update({(day, type): _to_bucket(type, data) for type, data in day_stats.items()})
+
+    if any((day, type) not in stored for day in days for type in merged_types):
+        logger.error(f"Not every day of website {website_id} could be fetched, fetching the whole range")
+        return fetch(range_start, range_end, what_stats)
+
+    merged = merge_days(stored, days, merged_types)
+    range_types = [type for type in what_stats if type not in merged]
+    fetched = fetch(range_start, range_end, range_types) if range_types else {}
+    # In the order of what_stats, as get_umami_data returns them
+    return {type: merged[type] if type in merged else fetched[type]
+            for type in what_stats if type in merged or type in fetched}
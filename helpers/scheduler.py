@@ -2,30 +2,43 @@
 📅 Scheduler Helper
 
 This module provides functions to determine whether reports should be sent based
-on scheduling frequencies and to execute the report generation process concurrently.
+on scheduling frequencies and to execute the report generation process concurrently,
+either once (from cron) or as a long-running daemon.
 
 Functions:
 - should_send_report: Determines if a report should be sent based on frequency and specified days.
-- schedule_reports: Executes the report generation for multiple websites concurrently.
+- is_due: Determines if a website's report is due in a given hour.
+- next_due_time: Calculates the next moment a website's report is due.
+- process_sites: Executes the report generation for multiple websites concurrently.
+- due_websites: Returns the websites that are due in a given hour.
+- schedule_reports: Processes the websites that are due in the current hour.
+- run_daemon: Keeps running and processes every website when its report is due.
+
+Classes:
+- DueIndex: Heap of websites ordered by their next due moment.
 """
+import heapq
 import logging
-from datetime import datetime
+import itertools
+import threading
+from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-def should_send_report(frequency, send_day):
+def should_send_report(frequency, send_day, now=None):
     """
     Determines if a report should be sent based on the frequency and the current date.
 
     Args:
         frequency (str): The frequency of the report ("day", "week", "month", "quarter", "year").
         send_day (list): List of days for sending reports (e.g., ["mon", "wed"] for "day" or ["mon"] for "week").
+        now (datetime): The date to check, defaults to the current date.
 
     Returns:
         bool: True if a report should be sent, False otherwise.
     """
-    now = datetime.now()
+    now = now or datetime.now()
     day_name = now.strftime('%a').lower()  # Current day of the week (e.g., 'mon', 'tue')
 
     if frequency == 'day':
@@ -45,21 +58,139 @@ def should_send_report(frequency, send_day):
         return now.day == 1 and now.month == 1
     return False
 
-def schedule_reports(websites, process_website):
+def _email_hour(site):
+    """Return the hour of the day a website's report is sent, or None if it is invalid."""
+    try:
+        return int(site.get('email_time', "08:00").split(":")[0])
+    except (AttributeError, ValueError):
+        logger.error(f"Invalid email_time for website {site.get('name', 'unknown')}")
+        return None
+
+def _first_of_next_month(moment):
+    """Return the same time of day on the first day of the next month."""
+    if moment.month == 12:
+        return moment.replace(year=moment.year + 1, month=1, day=1)
+    return moment.replace(month=moment.month + 1, day=1)
+
+def is_due(site, now):
+    """
+    Determines if a website's report is due in the hour of `now`.
+
+    Args:
+        site (dict): The website configuration.
+        now (datetime): The moment to check.
+
+    Returns:
+        bool: True if the report should be sent in this hour.
+    """
+    return (_email_hour(site) == now.hour and
+            should_send_report(site.get('frequency', 'daily'), site.get('send_day', []), now))
+
+def next_due_time(site, after):
+    """
+    Calculates the next moment a website's report is due.
+
+    Args:
+        site (dict): The website configuration.
+        after (datetime): Moment to search from (a report due at exactly this moment counts).
+
+    Returns:
+        datetime | None: The next due moment, or None if the report is never due.
+    """
+    hour = _email_hour(site)
+    if hour is None:
+        return None
+
+    frequency = site.get('frequency', 'daily')
+    send_day = site.get('send_day', [])
+
+    candidate = after.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if candidate < after:
+        candidate += timedelta(days=1)
+
+    # Monthly, quarterly and yearly reports can only be due on the first of a month
+    monthly = frequency in ('month', 'quarter', 'year')
+    if monthly and candidate.day != 1:
+        candidate = _first_of_next_month(candidate)
+
+    # A week covers every weekday, twelve months cover every first of the month
+    for _ in range(13 if monthly else 7):
+        if should_send_report(frequency, send_day, candidate):
+            return candidate
+        candidate = _first_of_next_month(candidate) if monthly else candidate + timedelta(days=1)
+    return None
+
+class DueIndex:
+    """
+    Index of websites ordered by the moment their next report is due, so a run only
+    has to look at the websites that are actually due.
+
+    Args:
+        websites (list): A list of website configurations.
+        after (datetime): Moment to start scheduling from.
+    """
+
+    def __init__(self, websites, after):
+        self._heap = []
+        self._counter = itertools.count()  # Tie-breaker, website configs are not comparable
+        for site in websites:
+            self._push(site, after)
+
+    def _push(self, site, after):
+        due = next_due_time(site, after)
+        if due:
+            heapq.heappush(self._heap, (due, next(self._counter), site))
+
+    def __len__(self):
+        return len(self._heap)
+
+    def next_due(self):
+        """
+        Returns:
+            datetime | None: The earliest due moment, or None if no report is ever due.
+        """
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """
+        Remove and return the websites that are due at or before `now`. They are put
+        back into the index with their next due moment.
+
+        Args:
+            now (datetime): The current moment.
+
+        Returns:
+            list: (due moment, website configuration) tuples, earliest first.
+        """
+        due_sites = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, site = heapq.heappop(self._heap)
+            due_sites.append((due, site))
+
+        for due, site in due_sites:
+            self._push(site, due + timedelta(seconds=1))
+        return due_sites
+
+def process_sites(websites, process_website, max_workers=5, now=None):
     """
-    Schedules and processes report generation for multiple websites concurrently.
+    Processes the given websites concurrently.
 
     Args:
         websites (list): A list of website configurations.
         process_website (function): A function to process an individual website.
+        max_workers (int): Number of websites processed at the same time.
+        now (datetime): The moment the reports are for, defaults to the current datetime.
 
     Execution:
         - Creates a thread pool to handle report generation concurrently.
         - Ensures errors during processing are caught and logged.
     """
-    now = datetime.now()  # Capture the current datetime for consistent usage
+    if not websites:
+        return
+
+    now = now or datetime.now()  # Capture the current datetime for consistent usage
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(websites))) as executor:
         # Submit report generation tasks for each website
         futures = [executor.submit(process_website, site, now) for site in websites]
         for future in futures:
@@ -68,3 +199,96 @@ def schedule_reports(websites, process_website):
                 future.result()
             except Exception as e:
                 logger.error(f"Error processing a website: {e}")
+
+def due_websites(websites, now):
+    """
+    Returns the websites whose report is due in the hour of `now`.
+
+    For a single run this is cheaper than building a DueIndex: websites sent at
+    another hour are skipped on their email_time alone.
+
+    Args:
+        websites (list): A list of website configurations.
+        now (datetime): The current moment.
+
+    Returns:
+        list: The website configurations that are due.
+    """
+    return [site for site in websites if is_due(site, now)]
+
+def schedule_reports(websites, process_website, max_workers=5, now=None):
+    """
+    Schedules and processes report generation for the websites that are due in the
+    current hour. When no website is due, no threads are started.
+
+    Args:
+        websites (list): A list of website configurations.
+        process_website (function): A function to process an individual website.
+        max_workers (int): Number of websites processed at the same time.
+        now (datetime): The moment the reports are for, defaults to the current datetime.
+    """
+    now = now or datetime.now()  # Capture the current datetime for consistent usage
+
+    due_sites = due_websites(websites, now)
+    if not due_sites:
+        logger.info("No reports due")
+        return
+
+    process_sites(due_sites, process_website, max_workers=max_workers, now=now)
+
+def run_daemon(websites, process_website, max_workers=5, stop_event=None, on_tick=None, reload=None):
+    """
+    Keeps running and processes every website at the moment its report is due,
+    sleeping in between. State such as HTTP connections, the bearer token and
+    loaded templates stays in memory for the lifetime of the process.
+
+    Args:
+        websites (list): A list of website configurations.
+        process_website (function): A function to process an individual website.
+        max_workers (int): Number of websites processed at the same time.
+        stop_event (threading.Event): Set this event to stop the daemon.
+        on_tick (function): Called with the due moment and the processed websites after each run.
+        reload (function): Called while sleeping; returns the new list of website
+            configurations when the configuration changed, otherwise None.
+    """
+    stop_event = stop_event or threading.Event()
+    index = DueIndex(websites, datetime.now())
+
+    while not stop_event.is_set():
+        next_time = index.next_due()
+        if next_time is None and not reload:
+            logger.error("No website report is ever due, stopping daemon")
+            return
+
+        if next_time is None:
+            logger.warning("No website report is ever due, waiting for a configuration change")
+        else:
+            logger.info(f"Next reports due at {next_time}")
+
+        # Sleep in short steps, so clock changes, stop requests and configuration changes are noticed
+        reloaded = None
+        while not stop_event.is_set():
+            reloaded = reload() if reload else None
+            if reloaded is not None:
+                break
+            remaining = (next_time - datetime.now()).total_seconds() if next_time else 60
+            if next_time and remaining <= 0:
+                break
+            stop_event.wait(min(remaining, 60))
+
+        if stop_event.is_set():
+            break
+
+        if reloaded is not None:
+            # Reports due from the moment that was waited for are still sent
+            now = datetime.now()
+            index = DueIndex(reloaded, min(now, next_time) if next_time else now)
+            logger.info(f"Configuration changed, {len(index)} websites scheduled")
+            continue
+
+        due_sites = [site for _, site in index.pop_due(next_time)]
+        process_sites(due_sites, process_website, max_workers=max_workers, now=next_time)
+        if on_tick:
+            on_tick(next_time, due_sites)
+
+    logger.info("Daemon stopped")
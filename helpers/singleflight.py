@@ -0,0 +1,78 @@
+"""
+🔀 In-flight Request Coalescing
+
+This module makes concurrent callers that ask for the same thing share a single
+call: the first caller does the work, every caller that arrives while it is still
+running waits for and receives the same result (or exception).
+
+Classes:
+- SingleFlight: Coalesces concurrent calls that share a key.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one call.
+
+    Attributes:
+        calls (int): Number of calls made through `do` since the last reset.
+        saved (int): Number of calls that were served by another call in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.saved = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call `func`, unless a call with the same key is already running, in which
+        case wait for that call and return its result.
+
+        Args:
+            key (hashable): Identifies calls that can share a result.
+            func (callable): The function to call.
+            *args: Positional arguments for `func`.
+            **kwargs: Keyword arguments for `func`.
+
+        Returns:
+            Any: The result of `func` (shared between coalesced callers).
+
+        Raises:
+            Exception: Whatever `func` raised, for every coalesced caller.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.saved += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def reset(self):
+        """Reset the call counters."""
+        with self._lock:
+            self.calls = 0
+            self.saved = 0
@@ -0,0 +1,140 @@
+"""
+📸 Startup Snapshot
+
+This module keeps what every run parses at start-up (the configuration files and
+the merged translations) in one snapshot file, so the next run can reuse it
+instead of parsing and merging the source files again. Entries are reused only
+while the modification time and size of their source files are unchanged; a
+changed source is loaded again and the snapshot is rewritten at the end of the
+run.
+
+The snapshot holds plain data only (dicts, lists, strings and numbers) and is
+written with `marshal`, the format Python uses for its compiled modules, which
+loads faster than JSON. A snapshot that was written by another Python version or
+cannot be read is ignored. The parsed configuration includes the Umami and SMTP
+passwords, so the snapshot is only readable by its owner.
+
+Classes:
+- StartupSnapshot: Parsed configuration files and translations, reused while their sources are unchanged.
+"""
+import os
+import sys
+import marshal
+import logging
+
+from helpers.config import load_config
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the snapshot changes
+SNAPSHOT_FORMAT = 1
+
+def _file_version(file_path):
+    """Return the (modification time, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class StartupSnapshot:
+    """
+    Parsed configuration files and translations, reused while their sources are unchanged.
+
+    Args:
+        path (str): Path of the snapshot file.
+    """
+
+    def __init__(self, path=".cache/startup.snapshot"):
+        self.path = path
+        self._configs = {}
+        self._translations = {}
+        self._changed = False
+        self._read()
+
+    def _read(self):
+        """Read the snapshot file, if there is a usable one."""
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = marshal.load(f)
+                readable_by_others = os.fstat(f.fileno()).st_mode & 0o077
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable startup snapshot {self.path}: {e}")
+            return
+
+        if not isinstance(snapshot, dict) or snapshot.get("format") != (SNAPSHOT_FORMAT, *sys.version_info[:2]):
+            return
+        self._configs = snapshot.get("configs", {})
+        self._translations = snapshot.get("translations", {})
+        # Rewritten with owner-only permissions by the next save
+        self._changed = bool(readable_by_others)
+
+    def load_config(self, file_path):
+        """
+        Load a JSON configuration file, from the snapshot while the file is unchanged.
+
+        Args:
+            file_path (str): The path to the JSON configuration file.
+
+        Returns:
+            dict | list: The parsed contents of the file, a fresh copy on every call.
+
+        Raises:
+            SystemExit: If the file is not found (see helpers.config.load_config).
+        """
+        version = _file_version(file_path)
+        cached = self._configs.get(file_path)
+        if version is not None and cached and cached[0] == version:
+            return marshal.loads(cached[1])
+
+        config = load_config(file_path)
+        # Stored serialized, so later changes to the returned config do not end up in the snapshot
+        self._configs[file_path] = (version, marshal.dumps(config))
+        self._changed = True
+        return config
+
+    def restore_translations(self, catalog):
+        """
+        Memoize the translations of the snapshot in a translation catalog.
+
+        Args:
+            catalog (TranslationCatalog): The catalog, see helpers.translation_validator.
+        """
+        catalog.restore(self._translations)
+
+    def store_translations(self, catalog):
+        """
+        Take the translations memoized by a translation catalog into the snapshot.
+
+        Args:
+            catalog (TranslationCatalog): The catalog, see helpers.translation_validator.
+        """
+        translations = catalog.export()
+        if translations != self._translations:
+            self._translations = translations
+            self._changed = True
+
+    def save(self):
+        """Write the snapshot if anything changed, readable by its owner only. The file is replaced in one go."""
+        if not self._changed:
+            return
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # It holds the credentials of the configuration
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump({
+                    "format": (SNAPSHOT_FORMAT, *sys.version_info[:2]),
+                    "configs": self._configs,
+                    "translations": self._translations
+                }, f)
+            os.replace(tmp_path, self.path)
+            self._changed = False
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to write startup snapshot {self.path}: {e}")
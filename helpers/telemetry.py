@@ -0,0 +1,334 @@
+"""
+⏱️ Run Telemetry
+
+This module records where the time of a run goes. The slow steps of a report
+(logging in, every API call, rendering the template, rendering the PDF and
+sending the email) are timed as spans and written as JSON lines, one object per
+span, tagged with the website they were for:
+
+    {"ts": 1760680800.123, "span": "fetch_stats", "site": "abc", "ms": 84.2, "type": "url", "status": 200, ...}
+
+At the end of a run the spans are summed up into a summary (time and count per
+span, the slowest websites, bytes fetched and retries), which is logged, written
+as the last JSON line of the run and optionally exported as a Prometheus textfile
+for node_exporter's textfile collector.
+
+Telemetry is off until `set_telemetry` is called; spans then cost nothing but a
+check of a module global. A profiler set with `set_stage_profiler` measures the
+memory of every span as a stage.
+
+Functions:
+- set_telemetry: Sets the telemetry spans are recorded in.
+- get_telemetry: Returns the telemetry spans are recorded in.
+- set_stage_profiler: Sets the profiler that measures every span as a stage.
+- site_context: Marks the website the work in a block is for.
+- per_site: Decorates a function that works on one website.
+- span: Times a block of work as a span.
+- record_span: Records a span that was timed elsewhere.
+- count: Adds to a counter of the run.
+
+Classes:
+- Telemetry: Writes spans as JSON lines and sums them up into a run summary.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from functools import wraps
+from contextlib import ExitStack, contextmanager
+
+logger = logging.getLogger(__name__)
+
+_telemetry = None
+_stage_profiler = None
+
+# The website the current work is for; copied into threads that send its emails
+_site = contextvars.ContextVar("telemetry_site", default=None)
+
+def _prometheus_label(value):
+    """Escape a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Telemetry:
+    """
+    Writes spans as JSON lines and sums them up into a run summary.
+
+    Args:
+        path (str): JSON-lines file the spans are appended to, or None to only keep the summary.
+        prometheus_path (str): Prometheus textfile written with the summary, or None.
+        slowest_sites (int): Number of websites listed in the summary as the slowest.
+    """
+
+    def __init__(self, path=None, prometheus_path=None, slowest_sites=5):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.slowest_sites = slowest_sites
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+        self.reset()
+
+    def reset(self):
+        """Start the totals of a new run."""
+        with self._lock:
+            self.started = time.time()
+            self._spans = {}
+            self._sites = {}
+            self._counters = {"retries": 0, "bytes_fetched": 0}
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        try:
+            self._file.write(json.dumps(record, default=str, separators=(",", ":")) + "\n")
+            self._file.flush()
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to write span: {e}")
+
+    def record(self, name, seconds, start=None, site=None, **attributes):
+        """
+        Record a span.
+
+        Args:
+            name (str): The name of the span ("fetch_stats", "render", ...).
+            seconds (float): How long the span took.
+            start (float): When the span started, as a Unix timestamp (default: now - seconds).
+            site (str): The website the span was for.
+            **attributes: Extra attributes of the span (type, status, bytes, ...).
+        """
+        now = time.time()
+        record = {"ts": round(start if start is not None else now - seconds, 3), "span": name,
+                  "site": site, "ms": round(seconds * 1000, 3), **attributes}
+        failed = "error" in attributes
+
+        with self._lock:
+            totals = self._spans.setdefault(name, {"count": 0, "seconds": 0.0, "max": 0.0, "errors": 0})
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max"] = max(totals["max"], seconds)
+            totals["errors"] += failed
+            if site is not None:
+                self._sites[site] = self._sites.get(site, 0.0) + seconds
+            if name == "fetch_stats":
+                self._counters["bytes_fetched"] += attributes.get("bytes") or 0
+            self._write(record)
+
+    def count(self, name, amount=1):
+        """Add to a counter of the run."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def summary(self):
+        """
+        Sum up the spans of the run.
+
+        Returns:
+            dict: The run duration, totals per span, the slowest websites (by the
+            time spent in their spans) and the counters.
+        """
+        with self._lock:
+            slowest = sorted(self._sites.items(), key=lambda item: item[1], reverse=True)[:self.slowest_sites]
+            return {
+                "duration": round(time.time() - self.started, 3),
+                "sites": len(self._sites),
+                "spans": {name: {**totals, "seconds": round(totals["seconds"], 3), "max": round(totals["max"], 3)}
+                          for name, totals in sorted(self._spans.items())},
+                "slowest_sites": [{"site": site, "seconds": round(seconds, 3)} for site, seconds in slowest],
+                **self._counters
+            }
+
+    def finish_run(self):
+        """Log the summary of the run, write it and export it, and start a new run."""
+        summary = self.summary()
+        spans = ", ".join(f"{name}: {totals['count']} in {totals['seconds']:.2f}s"
+                          for name, totals in summary["spans"].items())
+        logger.info(f"Run took {summary['duration']:.2f}s for {summary['sites']} websites ({spans}); "
+                    f"fetched {summary['bytes_fetched']} bytes with {summary['retries']} retries")
+        if summary["slowest_sites"]:
+            logger.info("Slowest websites: " + ", ".join(f"{item['site']} ({item['seconds']:.2f}s)"
+                                                         for item in summary["slowest_sites"]))
+
+        with self._lock:
+            self._write({"ts": round(time.time(), 3), "summary": summary})
+        if self.prometheus_path:
+            self.write_prometheus(summary)
+        self.reset()
+
+    def write_prometheus(self, summary):
+        """
+        Write a summary as a Prometheus textfile. The file is replaced in one go, so
+        node_exporter never reads half of it.
+
+        Args:
+            summary (dict): The summary, as returned by summary().
+        """
+        lines = [
+            "# HELP umami_report_last_run_timestamp_seconds When the last run finished.",
+            "# TYPE umami_report_last_run_timestamp_seconds gauge",
+            f"umami_report_last_run_timestamp_seconds {time.time():.3f}",
+            "# HELP umami_report_run_duration_seconds How long the last run took.",
+            "# TYPE umami_report_run_duration_seconds gauge",
+            f"umami_report_run_duration_seconds {summary['duration']}",
+            "# HELP umami_report_sites Number of websites worked on in the last run.",
+            "# TYPE umami_report_sites gauge",
+            f"umami_report_sites {summary['sites']}",
+            "# HELP umami_report_span_seconds Time spent per span in the last run.",
+            "# TYPE umami_report_span_seconds gauge",
+        ]
+        lines += [f'umami_report_span_seconds{{span="{_prometheus_label(name)}"}} {totals["seconds"]}'
+                  for name, totals in summary["spans"].items()]
+        lines += ["# HELP umami_report_spans Number of spans in the last run.",
+                  "# TYPE umami_report_spans gauge"]
+        lines += [f'umami_report_spans{{span="{_prometheus_label(name)}"}} {totals["count"]}'
+                  for name, totals in summary["spans"].items()]
+        lines += ["# HELP umami_report_span_errors Number of failed spans in the last run.",
+                  "# TYPE umami_report_span_errors gauge"]
+        lines += [f'umami_report_span_errors{{span="{_prometheus_label(name)}"}} {totals["errors"]}'
+                  for name, totals in summary["spans"].items()]
+        lines += [
+            "# HELP umami_report_bytes_fetched Bytes fetched from the Umami API in the last run.",
+            "# TYPE umami_report_bytes_fetched gauge",
+            f"umami_report_bytes_fetched {summary['bytes_fetched']}",
+            "# HELP umami_report_retries Umami API calls retried in the last run.",
+            "# TYPE umami_report_retries gauge",
+            f"umami_report_retries {summary['retries']}",
+        ]
+
+        tmp_path = f"{self.prometheus_path}.{os.getpid()}.tmp"
+        try:
+            directory = os.path.dirname(self.prometheus_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.prometheus_path)
+        except OSError as e:
+            logger.error(f"Failed to write Prometheus textfile {self.prometheus_path}: {e}")
+
+    def close(self):
+        """Close the spans file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def set_telemetry(telemetry):
+    """
+    Set the telemetry spans are recorded in.
+
+    Args:
+        telemetry (Telemetry | None): The telemetry, or None to stop recording.
+    """
+    global _telemetry
+    _telemetry = telemetry
+
+def get_telemetry():
+    """Return the telemetry spans are recorded in, or None."""
+    return _telemetry
+
+def set_stage_profiler(profiler):
+    """
+    Set the profiler that measures every span as a stage.
+
+    Args:
+        profiler (Profiler | None): The profiler, see helpers.profiling, or None.
+    """
+    global _stage_profiler
+    _stage_profiler = profiler
+
+@contextmanager
+def site_context(website_id):
+    """
+    Mark the website the work in a block is for; spans in the block are tagged with it.
+
+    Args:
+        website_id (str): The ID of the website in Umami.
+    """
+    token = _site.set(website_id)
+    try:
+        yield
+    finally:
+        _site.reset(token)
+
+def per_site(func):
+    """
+    Decorate a function whose first argument is a website configuration or report
+    job, so the spans it records are tagged with the website.
+
+    Args:
+        func (function): The function.
+
+    Returns:
+        function: The decorated function.
+    """
+    @wraps(func)
+    def wrapper(item, *args, **kwargs):
+        with site_context(item.get("website_id")):
+            return func(item, *args, **kwargs)
+    return wrapper
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block of work as a span. The block can add attributes to the yielded
+    dictionary; a block that raises gets an "error" attribute.
+
+    Args:
+        name (str): The name of the span.
+        **attributes: Attributes of the span; "site" defaults to the current website.
+
+    Yields:
+        dict: The attributes of the span.
+    """
+    telemetry = _telemetry
+    profiler = _stage_profiler
+    if telemetry is None and profiler is None:
+        yield attributes
+        return
+
+    with ExitStack() as stack:
+        if profiler is not None:
+            stack.enter_context(profiler.stage(name))
+
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            record_span(name, time.perf_counter() - started, start=start, **attributes)
+
+def record_span(name, seconds, **attributes):
+    """
+    Record a span that was timed elsewhere (for example in another process).
+
+    Args:
+        name (str): The name of the span.
+        seconds (float): How long the span took.
+        **attributes: Attributes of the span; "site" defaults to the current website.
+    """
+    telemetry = _telemetry
+    if telemetry is None:
+        return
+    site = attributes.pop("site", None) or _site.get()
+    telemetry.record(name, seconds, site=site, **attributes)
+
+def count(name, amount=1):
+    """
+    Add to a counter of the run, such as "retries".
+
+    Args:
+        name (str): The name of the counter.
+        amount (int): The amount to add.
+    """
+    telemetry = _telemetry
+    if telemetry is not None:
+        telemetry.count(name, amount)
@@ -0,0 +1,117 @@
+"""
+🧩 Template Registry
+
+This module keeps one Jinja2 environment per template folder for the whole
+process, so every template is parsed and compiled once instead of once per
+website. Compiled templates are also written to a bytecode cache on disk, so
+the next run (from cron or a restarted daemon) skips compilation as well.
+
+Templates are reloaded automatically when their file changes. Jinja2 is imported
+when the first environment is created, so a run with no report due never loads it.
+
+Functions:
+- get_environment: Returns the shared Jinja2 environment for a template folder.
+- get_template: Returns a compiled template from the shared environment.
+- template_source_hash: Returns a hash of a template's source.
+- precompile_templates: Compiles templates up front and reports the invalid ones.
+"""
+import os
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_environments = {}
+_source_hashes = {}
+_lock = threading.Lock()
+
+def get_environment(template_dir="templates", cache_dir=".cache/jinja"):
+    """
+    Return the shared Jinja2 environment for a template folder, creating it on first use.
+
+    Args:
+        template_dir (str): Folder containing the templates.
+        cache_dir (str): Folder for the compiled template bytecode, or None to disable it.
+
+    Returns:
+        jinja2.Environment: The shared environment.
+    """
+    env = _environments.get(template_dir)
+    if env is not None:
+        return env
+
+    with _lock:
+        env = _environments.get(template_dir)
+        if env is None:
+            from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+            bytecode_cache = None
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+            env = Environment(
+                loader=FileSystemLoader(template_dir),
+                bytecode_cache=bytecode_cache,
+                auto_reload=True
+            )
+            _environments[template_dir] = env
+    return env
+
+def get_template(name, template_dir="templates"):
+    """
+    Return a compiled template. Jinja2's template cache is thread-safe, so this can
+    be called from the scheduler's worker threads.
+
+    Args:
+        name (str): File name of the template.
+        template_dir (str): Folder containing the templates.
+
+    Returns:
+        jinja2.Template: The compiled template.
+    """
+    return get_environment(template_dir).get_template(name)
+
+def template_source_hash(name, template_dir="templates"):
+    """
+    Return a hash of a template's source, recomputed only when the file changes.
+
+    Args:
+        name (str): File name of the template.
+        template_dir (str): Folder containing the templates.
+
+    Returns:
+        str: Hex digest of the template source.
+    """
+    cached = _source_hashes.get((template_dir, name))
+    if cached and cached[1]():
+        return cached[0]
+
+    env = get_environment(template_dir)
+    source, _, uptodate = env.loader.get_source(env, name)
+    digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    _source_hashes[(template_dir, name)] = (digest, uptodate or (lambda: True))
+    return digest
+
+def precompile_templates(names, template_dir="templates"):
+    """
+    Compile templates up front, so errors show up at start-up instead of halfway a run.
+
+    Args:
+        names (iterable): File names of the templates to compile.
+        template_dir (str): Folder containing the templates.
+
+    Returns:
+        list: The names of the templates that could not be loaded or compiled.
+    """
+    from jinja2 import TemplateError
+
+    invalid = []
+    for name in sorted(set(names)):
+        try:
+            get_template(name, template_dir)
+        except TemplateError as e:
+            logger.error(f"Invalid email template {name}: {e}")
+            invalid.append(name)
+    return invalid
@@ -5,15 +5,28 @@ This module handles translation file loading with automatic fallback to sample.j
 for missing translations. It ensures all required keys are present by filling gaps
 with English translations from the sample file.
 
+Merged translations are memoized by `TranslationCatalog`: every locale is loaded and
+merged at most once (again only when sample.json or the locale file changes) and is
+handed out as a read-only mapping that can be shared by all websites. The catalog
+can be exported as plain dictionaries and restored in the next run.
+
 Functions:
 - load_base_translation: Load the sample/base translation file
 - merge_translations: Merge missing translations from base into target
 - load_smart_translation: Main function to load and complete translations
+- freeze_translations: Turn a translation dictionary into a read-only mapping
+- thaw_translations: Turn a read-only translation mapping back into a dictionary
+- get_translation: Get the memoized, read-only translation for a language
+
+Classes:
+- TranslationCatalog: Memoized, read-only translations invalidated by file mtime
 """
 import os
 import json
 import logging
-from typing import Dict, Union
+import threading
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple, Union
 from copy import deepcopy
 
 logger = logging.getLogger(__name__)
@@ -127,3 +140,125 @@ def verify_translation_structure(translations: Dict, base: Dict, path: str = "")
                 return False
 
     return True
+
+def freeze_translations(translations: Dict) -> Mapping:
+    """
+    Turn a translation dictionary (and nested dictionaries) into a read-only mapping.
+
+    Args:
+        translations (dict): Translation dictionary
+
+    Returns:
+        Mapping: Read-only view of the translations
+    """
+    return MappingProxyType({
+        key: freeze_translations(value) if isinstance(value, dict) else value
+        for key, value in translations.items()
+    })
+
+def thaw_translations(translations: Mapping) -> Dict:
+    """
+    Turn a read-only translation mapping (and nested mappings) back into a dictionary.
+
+    Args:
+        translations (Mapping): Read-only translation mapping
+
+    Returns:
+        dict: Plain translation dictionary
+    """
+    return {
+        key: thaw_translations(value) if isinstance(value, Mapping) else value
+        for key, value in translations.items()
+    }
+
+class TranslationCatalog:
+    """
+    Memoized catalog of complete (merged) translations.
+
+    Each language is loaded and merged with sample.json at most once. The result is
+    kept as a read-only mapping and reloaded only when the modification time of
+    sample.json or the language file changes.
+
+    Args:
+        locale_dir (str): Directory containing translation files
+    """
+
+    def __init__(self, locale_dir: str = "locale"):
+        self.locale_dir = locale_dir
+        self._catalog: Dict[str, Tuple[Tuple, Mapping]] = {}
+        self._lock = threading.Lock()
+
+    def _mtime(self, file_name: str) -> Optional[float]:
+        """Return the modification time of a locale file, or None if it does not exist."""
+        try:
+            return os.stat(os.path.join(self.locale_dir, file_name)).st_mtime
+        except OSError:
+            return None
+
+    def get(self, lang_code: str) -> Mapping:
+        """
+        Get the complete, read-only translations for a language.
+
+        Args:
+            lang_code (str): Language code for the translation file
+
+        Returns:
+            Mapping: Read-only translation mapping
+        """
+        version = (self._mtime("sample.json"), self._mtime(f"{lang_code}.json"))
+
+        cached = self._catalog.get(lang_code)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._catalog.get(lang_code)
+            if cached and cached[0] == version:
+                return cached[1]
+
+            translations = freeze_translations(load_smart_translation(lang_code, self.locale_dir))
+            self._catalog[lang_code] = (version, translations)
+            return translations
+
+    def export(self) -> Dict[str, Tuple[Tuple, Dict]]:
+        """
+        Export the memoized translations as plain dictionaries.
+
+        Returns:
+            dict: (version, translations) per language, where the version holds the
+            modification times of the files the translations were loaded from
+        """
+        with self._lock:
+            return {lang_code: (version, thaw_translations(translations))
+                    for lang_code, (version, translations) in self._catalog.items()}
+
+    def restore(self, entries: Mapping[str, Tuple[Tuple, Dict]]) -> None:
+        """
+        Memoize exported translations. A language whose files changed since it was
+        exported is reloaded on first use.
+
+        Args:
+            entries (dict): (version, translations) per language, as returned by export()
+        """
+        with self._lock:
+            for lang_code, (version, translations) in entries.items():
+                self._catalog.setdefault(lang_code, (tuple(version), freeze_translations(translations)))
+
+    def clear(self) -> None:
+        """Forget all memoized translations."""
+        with self._lock:
+            self._catalog.clear()
+
+translation_catalog = TranslationCatalog()
+
+def get_translation(lang_code: str) -> Mapping:
+    """
+    Get the memoized, read-only translations for a language from the default catalog.
+
+    Args:
+        lang_code (str): Language code for the translation file
+
+    Returns:
+        Mapping: Read-only translation mapping
+    """
+    return translation_catalog.get(lang_code)
@@ -4,17 +4,38 @@
 This module provides functions to interact with the Umami Analytics API,
 fetching and processing statistics for reporting.
 
+Concurrent calls for the same request (e.g. two websites entries with the same
+website_id being processed at the same moment) are coalesced into one HTTP call;
+`request_coalescer.saved` counts the calls that were saved.
+
 Functions:
 - validate_date_range: Ensures the provided date range is valid.
+- set_response_cache: Sets the response cache used by fetch_stats.
+- set_token_manager: Sets the token manager used to authorize and re-authorize requests.
 - fetch_stats: Performs an API request and returns the JSON response.
 - determine_unit: Maps reporting frequency to the appropriate unit.
+- parse_stats: Converts a raw API response into label-value pairs or general stats.
+- build_stat_requests: Builds the (type, url, params) requests for the requested stats.
 - get_umami_data: Fetches and processes data for specified statistics.
 """
+import re
 import logging
-import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.auth import AuthenticationError
+from helpers.cache import make_cache_key
+from helpers.http_client import request
+from helpers.singleflight import SingleFlight
+from helpers.telemetry import span
 
 logger = logging.getLogger(__name__)
 
+_WEBSITE_PATTERN = re.compile(r"/websites/([^/]+)/")
+
+_response_cache = None
+_token_manager = None
+request_coalescer = SingleFlight()
+
 def validate_date_range(range_start, range_end):
     """
     Validate that the date range is valid.
@@ -31,9 +52,32 @@ def validate_date_range(range_start, range_end):
     if range_start < 0 or range_end < 0:
         raise ValueError("range_start and range_end must be non-negative")
 
+def set_response_cache(cache):
+    """
+    Set the response cache used by fetch_stats.
+
+    Args:
+        cache (ResponseCache | None): The cache to use, or None to disable caching.
+    """
+    global _response_cache
+    _response_cache = cache
+
+def set_token_manager(manager):
+    """
+    Set the token manager used by fetch_stats. When set, requests use its current
+    token, and a request rejected with 401 is retried once after a token refresh.
+
+    Args:
+        manager (TokenManager | None): The token manager, or None to use the headers as given.
+    """
+    global _token_manager
+    _token_manager = manager
+
 def fetch_stats(url, headers, params):
     """
-    Perform the API request and return JSON data.
+    Perform the API request and return JSON data. Responses are served from and
+    stored in the response cache when one is set, and identical requests that are
+    in flight at the same time share one call.
 
     Args:
         url (str): The API endpoint URL.
@@ -45,10 +89,54 @@ def fetch_stats(url, headers, params):
 
     Raises:
         requests.exceptions.RequestException: If the request fails.
+        AuthenticationError: If logging in again after a rejected token fails.
     """
-    response = requests.get(url, headers=headers, params=params)
+    signature = (url, tuple(sorted((key, str(value)) for key, value in params.items())))
+    return request_coalescer.do(signature, _fetch_stats, url, headers, params)
+
+def _fetch_stats(url, headers, params):
+    """Fetch a response from the cache or the API, see fetch_stats."""
+    website = _WEBSITE_PATTERN.search(url)
+    with span("fetch_stats", site=website.group(1) if website else None,
+              type=params.get("type") or "stats") as attributes:
+        return _fetch_response(url, headers, params, attributes)
+
+def _fetch_response(url, headers, params, attributes):
+    """Fetch a response from the cache or the API, adding the outcome to the span attributes."""
+    cache = _response_cache
+    cache_key = make_cache_key(url, params) if cache else None
+    if cache_key:
+        try:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                attributes["cache"] = "hit"
+                return cached
+        except Exception as e:
+            logger.error(f"Failed to read response cache: {e}")
+
+    manager = _token_manager
+    if manager:
+        token = manager.token
+        headers = {**headers, "Authorization": f"Bearer {token}"}
+
+    response = request("GET", url, headers=headers, params=params)
+    if response.status_code == 401 and manager:
+        # The token expired or was revoked during the run: refresh once and retry
+        token = manager.refresh(token)
+        headers = {**headers, "Authorization": f"Bearer {token}"}
+        response = request("GET", url, headers=headers, params=params)
+    attributes["status"] = response.status_code
+    attributes["bytes"] = len(response.content)
     response.raise_for_status()  # Raise exception for HTTP errors
-    return response.json()
+    data = response.json()
+
+    if cache_key:
+        try:
+            cache.set(cache_key, data, range_end=params.get("endAt"))
+        except Exception as e:
+            logger.error(f"Failed to write response cache: {e}")
+
+    return data
 
 def determine_unit(frequency):
     """
@@ -74,35 +162,58 @@ def determine_unit(frequency):
         raise ValueError(f"Unsupported frequency: {frequency}")
     return unit_mapping[frequency]
 
-def get_umami_data(api_url, token, website_id, range_start, range_end, frequency="week", what_stats=[]):
+def parse_stats(type, raw_data):
     """
-    Fetch and process data from Umami API for the requested statistics.
+    Convert a raw API response into the structure used by the report templates.
+
+    Args:
+        type (str): The stat type the response belongs to ("stats", "url", ...).
+        raw_data (dict | list): The JSON response from the API.
+
+    Returns:
+        dict | list: The general statistics dict for "stats", otherwise a list of
+        label-value pairs.
+    """
+    # Process stats differently for general statistics
+    if type == "stats":
+        return {
+            "pageviews": raw_data["pageviews"],
+            "visitors": raw_data["visitors"],
+            "visits": raw_data["visits"],
+            "bounces": raw_data["bounces"],
+            "totaltime": raw_data["totaltime"],
+        }
+
+    # Process other stats as label-value pairs
+    return [{"label": item["x"], "value": item["y"]} for item in raw_data]
+
+def build_stat_requests(api_url, website_id, range_start, range_end, frequency="week", what_stats=[], tz="CET"):
+    """
+    Build the API requests needed for the requested statistics.
 
     Args:
         api_url (str): The base URL for the Umami API.
-        token (str): The bearer token for authentication.
         website_id (str): The ID of the website in Umami.
         range_start (int): Start of the date range in epoch milliseconds.
         range_end (int): End of the date range in epoch milliseconds.
         frequency (str): The reporting frequency ("day", "week", etc.).
-        what_stats (list): A list of stat types to retrieve (e.g., "urls", "countries").
+        what_stats (list): A list of stat types to retrieve (e.g., "url", "country").
+        tz (str): The timezone Umami groups the statistics in.
 
     Returns:
-        dict: A dictionary containing processed statistics.
+        list: (type, url, params) tuples, one per stat type to fetch.
 
     Raises:
-        requests.exceptions.RequestException: For API request errors.
         ValueError: For invalid inputs like unsupported frequency or invalid date ranges.
     """
     validate_date_range(range_start, range_end)  # Ensure date range is valid
     unit = determine_unit(frequency)  # Map frequency to API unit
 
-    headers = {"Authorization": f"Bearer {token}"}
     params = {
         "startAt": range_start,
         "endAt": range_end,
         "unit": unit,
-        "tz": "CET"
+        "tz": tz
     }
 
     stats_url = f"{api_url}/websites/{website_id}/stats"
@@ -110,40 +221,82 @@ def get_umami_data(api_url, token, website_id, range_start, range_end, frequency
 
     # https://umami.is/docs/api/website-stats-api#get-/api/websites/:websiteid/metrics
     types = ["stats", "url", "referrer", "browser", "os", "device", "country", "event"]
-    mystats = {}
-    try:
-        for type in types:
-            if type not in what_stats:
-                logger.error(f"Warning: Unsupported stat type '{type}'. Skipping.")
-                continue
-
-            params_with_type = {**params}
-            params_with_type["type"] = None
-            url = stats_url
-            if type != "stats":
-                params_with_type["type"] = type
-                url = metrics_url
-
-            # Fetch data from the API
-            raw_data = fetch_stats(url, headers, params_with_type)
-
-            # Process stats differently for general statistics
-            if type == "stats":
-                mystats["stats"] = {
-                    "pageviews": raw_data["pageviews"],
-                    "visitors": raw_data["visitors"],
-                    "visits": raw_data["visits"],
-                    "bounces": raw_data["bounces"],
-                    "totaltime": raw_data["totaltime"],
-                }
-            else:
-                # Process other stats as label-value pairs
-                mystats[type] = [{"label": item["x"], "value": item["y"]} for item in raw_data]
-
-        return mystats
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch stats for website {website_id}: {e}")
-        return {}
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
+    for type in what_stats:
+        if type not in types:
+            logger.error(f"Warning: Unsupported stat type '{type}'. Skipping.")
+
+    stat_requests = []
+    for type in types:
+        if type not in what_stats:
+            continue  # Not requested
+
+        params_with_type = {**params}
+        params_with_type["type"] = None
+        url = stats_url
+        if type != "stats":
+            params_with_type["type"] = type
+            url = metrics_url
+
+        stat_requests.append((type, url, params_with_type))
+
+    return stat_requests
+
+def get_umami_data(api_url, token, website_id, range_start, range_end, frequency="week", what_stats=[], max_workers=8,
+                   tz="CET"):
+    """
+    Fetch and process data from Umami API for the requested statistics.
+
+    The requests for the different stat types are sent concurrently. A failing
+    stat type is logged and left out of the result; the others are kept. A failed
+    login fails the whole call.
+
+    Args:
+        api_url (str): The base URL for the Umami API.
+        token (str): The bearer token for authentication.
+        website_id (str): The ID of the website in Umami.
+        range_start (int): Start of the date range in epoch milliseconds.
+        range_end (int): End of the date range in epoch milliseconds.
+        frequency (str): The reporting frequency ("day", "week", etc.).
+        what_stats (list): A list of stat types to retrieve (e.g., "urls", "countries").
+        max_workers (int): Maximum number of concurrent requests for this website.
+        tz (str): The timezone Umami groups the statistics in.
+
+    Returns:
+        dict: A dictionary containing processed statistics.
+
+    Raises:
+        ValueError: For invalid inputs like unsupported frequency or invalid date ranges.
+        AuthenticationError: If logging in to the Umami API fails.
+    """
+    import requests
+
+    stat_requests = build_stat_requests(api_url, website_id, range_start, range_end,
+                                        frequency, what_stats, tz)
+    if not stat_requests:
         return {}
+
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def fetch_type(type, url, params):
+        # Fetch data from the API
+        return parse_stats(type, fetch_stats(url, headers, params))
+
+    mystats = {}
+    workers = max(1, min(max_workers, len(stat_requests)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {type: executor.submit(fetch_type, type, url, params)
+                   for type, url, params in stat_requests}
+
+        # Collect in the original order so the result is deterministic
+        for type, future in futures.items():
+            try:
+                mystats[type] = future.result()
+            except AuthenticationError:
+                # Without a token no other stat can be fetched either: fail the report
+                raise
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Failed to fetch {type} stats for website {website_id}: {e}")
+            except Exception as e:
+                logger.error(f"An error occurred fetching {type} stats for website {website_id}: {e}")
+
+    return mystats
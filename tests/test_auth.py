@@ -0,0 +1,136 @@
+"""Tests for helpers.auth: reusing, expiring and refreshing the bearer token."""
+import base64
+import json
+import os
+import stat
+import threading
+import time
+
+import pytest
+import requests
+
+import helpers.auth
+from helpers.auth import AuthenticationError, TokenManager, authenticate, token_expiry
+
+API_URL = "https://umami.example.com/api"
+
+def jwt(expires_at):
+    """An unsigned JWT that expires at a Unix timestamp."""
+    claims = base64.urlsafe_b64encode(json.dumps({"exp": expires_at}).encode()).decode().rstrip("=")
+    return f"header.{claims}.signature"
+
+class FakeLogin:
+    """Stands in for authenticate, handing out a new token on every login."""
+
+    def __init__(self, lifetime=3600, delay=0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.logins = 0
+
+    def __call__(self, api_url, username, password):
+        time.sleep(self.delay)
+        self.logins += 1
+        return jwt(time.time() + self.lifetime) + str(self.logins)
+
+@pytest.fixture
+def login(monkeypatch):
+    fake = FakeLogin()
+    monkeypatch.setattr(helpers.auth, "authenticate", fake)
+    return fake
+
+@pytest.fixture
+def token_file(tmp_path):
+    return str(tmp_path / "cache" / "umami_token.json")
+
+def manager(token_file, username="user", **kwargs):
+    return TokenManager(API_URL, username, "secret", token_file=token_file, **kwargs)
+
+def test_token_expiry_reads_the_jwt_claim():
+    assert token_expiry(jwt(1700000000)) == 1700000000
+    assert token_expiry("not-a-jwt") is None
+    assert token_expiry("a.!!!.c") is None
+
+def test_token_is_reused_across_runs(login, token_file):
+    token = manager(token_file).token
+    assert manager(token_file).token == token
+    assert login.logins == 1
+    assert stat.S_IMODE(os.stat(token_file).st_mode) == 0o600
+
+def test_token_of_another_account_is_not_reused(login, token_file):
+    manager(token_file).token
+    manager(token_file, username="someone else").token
+    assert login.logins == 2
+
+def test_expired_token_logs_in_again(login, token_file):
+    login.lifetime = TokenManager.EXPIRY_MARGIN - 1
+    first = manager(token_file)
+    token = first.token
+
+    # Within the margin before it expires the token is not used any more
+    assert first.token != token
+    assert login.logins == 2
+
+def test_token_without_expiry_is_kept_for_max_age(monkeypatch, token_file):
+    monkeypatch.setattr(helpers.auth, "authenticate", lambda api_url, username, password: "opaque-token")
+    first = manager(token_file, max_age=TokenManager.EXPIRY_MARGIN + 3600)
+    assert first.token == "opaque-token"
+    assert first._expires_at == pytest.approx(time.time() + 3600, abs=5)
+
+def test_concurrent_refreshes_log_in_once(login, token_file):
+    tokens = manager(token_file)
+    stale = tokens.token
+    login.delay = 0.05
+
+    refreshed = []
+    workers = [threading.Thread(target=lambda: refreshed.append(tokens.refresh(stale))) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert login.logins == 2
+    assert len(set(refreshed)) == 1 and refreshed[0] != stale
+
+def test_refresh_uses_the_token_another_process_stored(login, token_file):
+    mine, theirs = manager(token_file), manager(token_file)
+    stale = mine.token
+    fresh = theirs.refresh(stale)
+
+    assert mine.refresh(stale) == fresh
+    assert login.logins == 2
+
+def test_failed_login_raises_instead_of_exiting(monkeypatch, token_file):
+    def refuse(method, url, **kwargs):
+        raise requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(helpers.auth, "request", refuse)
+    with pytest.raises(AuthenticationError, match="connection refused"):
+        authenticate(API_URL, "user", "secret")
+    with pytest.raises(AuthenticationError):
+        authenticate(API_URL, "user", "")
+    with pytest.raises(AuthenticationError):
+        manager(token_file).token
+    assert not os.path.exists(token_file)
+
+def test_failed_refresh_fails_the_whole_report(monkeypatch, login, token_file):
+    import helpers.umami
+    from helpers.umami import get_umami_data, set_token_manager
+
+    class Rejected:
+        status_code = 401
+        content = b""
+
+    def refuse(api_url, username, password):
+        raise AuthenticationError("401 Unauthorized")
+
+    tokens = manager(token_file)
+    tokens.token
+    monkeypatch.setattr(helpers.umami, "request", lambda method, url, **kwargs: Rejected())
+    monkeypatch.setattr(helpers.auth, "authenticate", refuse)
+    set_token_manager(tokens)
+    try:
+        # A report without any statistics is not sent: the error reaches the caller
+        with pytest.raises(AuthenticationError):
+            get_umami_data(API_URL, None, "site-1", 0, 86400000, "day", ["stats", "url"])
+    finally:
+        set_token_manager(None)
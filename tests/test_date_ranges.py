@@ -0,0 +1,115 @@
+"""Tests for helpers.date_ranges: report periods across DST changes and week, month and year boundaries."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from helpers.date_ranges import calculate_date_range, get_timezone, previous_period, report_period
+
+AMSTERDAM = "Europe/Amsterdam"
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+def local(tz, *args):
+    """An aware moment in a timezone."""
+    return datetime(*args, tzinfo=get_timezone(tz))
+
+def ms(tz, *args):
+    """A moment in a timezone, in epoch milliseconds."""
+    return int(local(tz, *args).timestamp() * 1000)
+
+def test_day_is_the_previous_calendar_day():
+    period = report_period(local(AMSTERDAM, 2026, 10, 17, 8, 5), "day", AMSTERDAM)
+    assert period.key == "day:2026-10-16:Europe/Amsterdam"
+    assert (period.start, period.end) == (ms(AMSTERDAM, 2026, 10, 16), ms(AMSTERDAM, 2026, 10, 17))
+
+def test_the_day_depends_on_the_timezone_of_the_website():
+    moment = datetime(2026, 10, 16, 23, 30, tzinfo=timezone.utc)
+    # Already the 17th in Amsterdam, still the 16th in New York
+    assert report_period(moment, "day", AMSTERDAM).key == "day:2026-10-16:Europe/Amsterdam"
+    assert report_period(moment, "day", "America/New_York").key == "day:2026-10-15:America/New_York"
+
+@pytest.mark.parametrize("day, hours", [
+    ((2026, 3, 29), 23),  # Clocks go forward
+    ((2026, 10, 25), 25),  # Clocks go back
+    ((2026, 10, 24), 24),
+])
+def test_days_follow_daylight_saving_time(day, hours):
+    report_day = datetime(*day) + timedelta(days=1)
+    period = report_period(local(AMSTERDAM, report_day.year, report_day.month, report_day.day, 8), "day", AMSTERDAM)
+    assert period.start == ms(AMSTERDAM, *day)
+    assert period.end - period.start == hours * HOUR_MS
+
+def test_week_containing_a_dst_change_is_one_hour_short():
+    period = report_period(local(AMSTERDAM, 2026, 3, 30, 8), "week", AMSTERDAM)
+    assert period.key == "week:2026-W13:Europe/Amsterdam"
+    assert period.start == ms(AMSTERDAM, 2026, 3, 23)
+    assert period.end - period.start == 7 * DAY_MS - HOUR_MS
+
+def test_week_runs_monday_to_monday():
+    monday = report_period(local(AMSTERDAM, 2026, 10, 19, 8), "week", AMSTERDAM)
+    sunday = report_period(local(AMSTERDAM, 2026, 10, 18, 23, 59), "week", AMSTERDAM)
+    assert monday.key == "week:2026-W42:Europe/Amsterdam"
+    assert (monday.start, monday.end) == (ms(AMSTERDAM, 2026, 10, 12), ms(AMSTERDAM, 2026, 10, 19))
+    assert sunday.key == "week:2026-W41:Europe/Amsterdam"
+    assert sunday.end == monday.start
+
+@pytest.mark.parametrize("now, key, start", [
+    # ISO week 53 of 2020 ends in January 2021
+    ((2021, 1, 4), "week:2020-W53:Europe/Amsterdam", (2020, 12, 28)),
+    # ISO week 1 of 2026 starts in December 2025
+    ((2026, 1, 5), "week:2026-W01:Europe/Amsterdam", (2025, 12, 29)),
+    ((2026, 1, 1), "week:2025-W52:Europe/Amsterdam", (2025, 12, 22)),
+])
+def test_week_keys_use_the_iso_year(now, key, start):
+    period = report_period(local(AMSTERDAM, *now, 8), "week", AMSTERDAM)
+    assert period.key == key
+    assert period.start == ms(AMSTERDAM, *start)
+    assert period.end - period.start == 7 * DAY_MS
+
+def test_month_quarter_and_year_cross_the_year_boundary():
+    new_year = local(AMSTERDAM, 2026, 1, 1, 0, 30)
+    month = report_period(new_year, "month", AMSTERDAM)
+    quarter = report_period(new_year, "quarter", AMSTERDAM)
+    year = report_period(new_year, "year", AMSTERDAM)
+
+    assert month.key == "month:2025-12:Europe/Amsterdam"
+    assert (month.start, month.end) == (ms(AMSTERDAM, 2025, 12, 1), ms(AMSTERDAM, 2026, 1, 1))
+    assert quarter.key == "quarter:2025-Q4:Europe/Amsterdam"
+    assert (quarter.start, quarter.end) == (ms(AMSTERDAM, 2025, 10, 1), ms(AMSTERDAM, 2026, 1, 1))
+    assert year.key == "year:2025:Europe/Amsterdam"
+    assert (year.start, year.end) == (ms(AMSTERDAM, 2025, 1, 1), ms(AMSTERDAM, 2026, 1, 1))
+
+def test_new_year_in_utc_is_still_the_old_year_in_new_york():
+    moment = datetime(2026, 1, 1, 2, 0, tzinfo=timezone.utc)
+    assert report_period(moment, "year", "America/New_York").key == "year:2024:America/New_York"
+    assert report_period(moment, "year", AMSTERDAM).key == "year:2025:Europe/Amsterdam"
+
+def test_month_with_the_dst_change():
+    period = report_period(local(AMSTERDAM, 2026, 4, 1, 8), "month", AMSTERDAM)
+    assert period.key == "month:2026-03:Europe/Amsterdam"
+    assert period.end - period.start == 31 * DAY_MS - HOUR_MS
+
+def test_previous_period_crosses_the_year_boundary():
+    week = report_period(local(AMSTERDAM, 2026, 1, 5, 8), "week", AMSTERDAM)
+    quarter = report_period(local(AMSTERDAM, 2026, 4, 1, 8), "quarter", AMSTERDAM)
+
+    assert previous_period(week).key == "week:2025-W52:Europe/Amsterdam"
+    assert previous_period(week).end == week.start
+    assert previous_period(quarter).key == "quarter:2025-Q4:Europe/Amsterdam"
+    assert previous_period(previous_period(quarter)).key == "quarter:2025-Q3:Europe/Amsterdam"
+
+def test_local_timezone_has_its_own_key():
+    period = report_period(datetime(2026, 10, 17, 8, 5), "day")
+    assert period.key == "day:2026-10-16:local"
+    assert period.tz == ""
+
+def test_invalid_frequency_and_timezone_raise():
+    with pytest.raises(ValueError):
+        report_period(datetime(2026, 10, 17), "fortnight", AMSTERDAM)
+    with pytest.raises(ValueError):
+        report_period(datetime(2026, 10, 17), "day", "Mars/Olympus_Mons")
+
+def test_calculate_date_range_ends_on_the_last_millisecond():
+    period = report_period(local(AMSTERDAM, 2026, 10, 17, 8), "week", AMSTERDAM)
+    assert calculate_date_range(local(AMSTERDAM, 2026, 10, 17, 8), "week", AMSTERDAM) == (period.start, period.end - 1)
+    assert calculate_date_range(datetime(2026, 10, 17), "fortnight") == (0, 0)
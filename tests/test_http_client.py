@@ -0,0 +1,123 @@
+"""Tests for helpers.http_client: the per-host concurrency limiter and retrying throttled requests."""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+import helpers.http_client
+from helpers.http_client import HostLimiter, configure_http, get_limiter, request, retry_delay
+
+URL = "https://umami.example.com/api/websites/site-1/stats"
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeSession:
+    """Answers requests with the given responses, or raises the given exceptions, in turn."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+@pytest.fixture
+def http(monkeypatch):
+    """Configure the client with a pool of 10 and record the retry delays instead of sleeping."""
+    configure_http(pool_size=10, retries=2, backoff_base=0.5, backoff_max=30, initial_concurrency=0)
+    delays = []
+    monkeypatch.setattr(helpers.http_client.time, "sleep", delays.append)
+    yield delays
+    configure_http(pool_size=10, retries=3, initial_concurrency=0)
+
+def use_session(monkeypatch, session):
+    monkeypatch.setattr(helpers.http_client, "get_session", lambda: session)
+    return session
+
+def test_limiter_starts_at_the_pool_size(http):
+    assert int(get_limiter("umami.example.com").limit) == 10
+
+    configure_http(initial_concurrency=3)
+    assert int(get_limiter("umami.example.com").limit) == 3
+
+def test_limiter_halves_once_per_push_back_and_grows_back(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(helpers.http_client.time, "monotonic", lambda: now[0])
+    limiter = HostLimiter(initial=10, minimum=2, maximum=10)
+
+    for _ in range(3):
+        limiter.acquire()
+    # Requests that were already in flight do not lower the limit again
+    limiter.release(throttled=True)
+    limiter.release(throttled=True)
+    assert limiter.limit == 5
+    now[0] += HostLimiter.DECREASE_INTERVAL
+    limiter.release(throttled=True)
+    assert limiter.limit == 2.5
+
+    now[0] += HostLimiter.DECREASE_INTERVAL
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2
+
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release()
+    assert int(limiter.limit) == 4
+
+def test_retry_after_in_seconds_and_as_a_date(http):
+    assert retry_delay(0, FakeResponse(429, {"Retry-After": "7"})) == 7
+    assert retry_delay(0, FakeResponse(429, {"Retry-After": "3600"})) == 30
+
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=10)
+    assert retry_delay(0, FakeResponse(503, {"Retry-After": format_datetime(retry_at, usegmt=True)})) == \
+        pytest.approx(10, abs=1.5)
+
+def test_backoff_without_retry_after_is_jittered_and_capped(http):
+    for attempt in range(10):
+        assert 0 <= retry_delay(attempt) <= min(30, 0.5 * 2 ** attempt)
+    assert 0 <= retry_delay(0, FakeResponse(429, {"Retry-After": "soon"})) <= 0.5
+
+def test_throttled_requests_are_retried_after_retry_after(http, monkeypatch):
+    throttled = FakeResponse(429, {"Retry-After": "2"})
+    session = use_session(monkeypatch, FakeSession(throttled, FakeResponse(503, {"Retry-After": "4"}),
+                                                    FakeResponse(200)))
+
+    assert request("GET", URL).status_code == 200
+    assert session.calls == 3
+    assert http == [2, 4]
+    assert throttled.closed
+
+def test_last_throttled_response_is_returned_after_the_retries(http, monkeypatch):
+    session = use_session(monkeypatch, FakeSession(*(FakeResponse(429, {"Retry-After": "1"}) for _ in range(3))))
+
+    assert request("GET", URL).status_code == 429
+    assert session.calls == 3
+
+def test_client_errors_are_not_retried(http, monkeypatch):
+    session = use_session(monkeypatch, FakeSession(FakeResponse(404)))
+    assert request("GET", URL).status_code == 404
+    assert session.calls == 1 and http == []
+
+def test_connection_errors_are_retried_then_raised(http, monkeypatch):
+    error = requests.exceptions.ConnectionError("connection reset")
+    session = use_session(monkeypatch, FakeSession(error, FakeResponse(200)))
+    assert request("GET", URL).status_code == 200
+
+    session = use_session(monkeypatch, FakeSession(error, error, error))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        request("GET", URL)
+    assert session.calls == 3
+    assert get_limiter("umami.example.com").in_flight == 0
@@ -0,0 +1,198 @@
+"""Tests for helpers.mail_spool: planning, claiming, acknowledging, failing and resuming."""
+import socket
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+from helpers.mail_spool import MailSpool
+
+SITE = {"website_id": "site-1", "name": "Site 1"}
+RUN_AT = datetime(2026, 10, 17, 8, 0)
+
+@pytest.fixture
+def dead_owner():
+    """The owner name of a run on this host that is no longer alive."""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "spool.sqlite")
+
+def open_spool(path, owner=None, **kwargs):
+    spool = MailSpool(path, **kwargs)
+    if owner:
+        spool.owner = owner
+    return spool
+
+def age(spool, table, seconds, column="updated_at"):
+    """Move the timestamps of every row of a table back in time."""
+    spool._conn.execute(f"UPDATE {table} SET {column} = {column} - ?", (seconds,))
+
+def state(spool, table, key_column, key):
+    row = spool._conn.execute(f"SELECT state FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def test_plan_runs_a_job_once(spool_path):
+    spool = open_spool(spool_path)
+    assert spool.plan("job", SITE, RUN_AT)
+    # Planning again in the same run is harmless, another live run keeps its hands off
+    assert spool.plan("job", SITE, RUN_AT)
+    other = open_spool(spool_path, owner="other-host:1")
+    assert not other.plan("job", SITE, RUN_AT)
+
+def test_ack_marks_the_job_sent_after_its_last_message(spool_path):
+    spool = open_spool(spool_path)
+    spool.plan("job", SITE, RUN_AT)
+    first, second = spool.enqueue("job", "from@example.com", [(["a@example.com"], "A"), (["b@example.com"], "B")])
+    assert state(spool, "jobs", "key", "job") == "queued"
+
+    spool.ack(first)
+    assert state(spool, "jobs", "key", "job") == "queued"
+    spool.ack(second)
+    assert state(spool, "jobs", "key", "job") == "sent"
+
+    # A report that was sent is not sent again, not even by the same run
+    assert not spool.plan("job", SITE, RUN_AT)
+    assert not spool.has_unfinished_work()
+
+def test_shared_body_is_stored_once_and_restored(spool_path, dead_owner):
+    spool = open_spool(spool_path, owner=dead_owner)
+    spool.plan("job", SITE, RUN_AT)
+    body = b"Subject: Report\r\n\r\nbody\r\n"
+    spool.enqueue("job", "from@example.com", [
+        (["a@example.com"], (b"To: a@example.com\r\n", body)),
+        (["b@example.com"], (b"To: b@example.com\r\n", body)),
+    ])
+    assert spool._conn.execute("SELECT COUNT(*) FROM bodies").fetchone()[0] == 1
+
+    claimed = open_spool(spool_path).claim_pending()
+    assert sorted(message for _, _, _, message in claimed) == [
+        (b"To: a@example.com\r\n", body),
+        (b"To: b@example.com\r\n", body),
+    ]
+
+def test_claim_pending_takes_over_messages_of_a_dead_run_only_once(spool_path, dead_owner):
+    crashed = open_spool(spool_path, owner=dead_owner)
+    crashed.plan("job", SITE, RUN_AT)
+    (message_id,) = crashed.enqueue("job", "from@example.com", [(["a@example.com"], "A")])
+
+    resumer = open_spool(spool_path)
+    assert resumer.has_unfinished_work()
+    assert resumer.claim_pending() == [(message_id, "from@example.com", ["a@example.com"], "A")]
+    assert resumer.claim_pending() == []
+
+    resumer.ack(message_id)
+    assert state(resumer, "jobs", "key", "job") == "sent"
+
+def test_claim_pending_leaves_messages_of_a_live_run_alone(spool_path):
+    running = open_spool(spool_path, owner="other-host:1")
+    running.plan("job", SITE, RUN_AT)
+    running.enqueue("job", "from@example.com", [(["a@example.com"], "A")])
+
+    assert open_spool(spool_path).claim_pending() == []
+
+def test_messages_not_touched_for_the_lease_are_retried_by_their_own_run(spool_path):
+    spool = open_spool(spool_path, lease=60)
+    spool.plan("job", SITE, RUN_AT)
+    (message_id,) = spool.enqueue("job", "from@example.com", [(["a@example.com"], "A")])
+    spool.fail(message_id, "450 mailbox busy")
+    assert spool.claim_pending() == []
+
+    # A daemon retries its own failed messages once the lease has passed
+    age(spool, "messages", 61)
+    assert [row[0] for row in spool.claim_pending()] == [message_id]
+
+def test_fail_gives_up_after_max_attempts(spool_path, dead_owner):
+    spool = open_spool(spool_path, owner=dead_owner, max_attempts=2)
+    spool.plan("job", SITE, RUN_AT)
+    (message_id,) = spool.enqueue("job", "from@example.com", [(["a@example.com"], "A")])
+
+    spool.fail(message_id, "450 mailbox busy")
+    assert state(spool, "messages", "id", message_id) == "pending"
+    spool.fail(message_id, "450 mailbox busy")
+    assert state(spool, "messages", "id", message_id) == "failed"
+
+    assert open_spool(spool_path).claim_pending() == []
+    last_error = spool._conn.execute("SELECT last_error FROM messages WHERE id = ?", (message_id,)).fetchone()[0]
+    assert last_error == "450 mailbox busy"
+
+def test_unfinished_jobs_resumes_jobs_of_a_dead_run(spool_path, dead_owner):
+    crashed = open_spool(spool_path, owner=dead_owner)
+    crashed.plan("job", SITE, RUN_AT)
+
+    resumer = open_spool(spool_path)
+    assert resumer.unfinished_jobs() == [("job", SITE, RUN_AT)]
+    assert resumer.unfinished_jobs() == []
+
+    # The resumed job now belongs to this run, which may plan and send it
+    assert resumer.plan("job", SITE, RUN_AT)
+
+def test_unfinished_jobs_stops_after_max_attempts(spool_path, dead_owner):
+    crashed = open_spool(spool_path, owner=dead_owner, max_attempts=2)
+    crashed.plan("job", SITE, RUN_AT)
+    assert len(open_spool(spool_path, max_attempts=2).unfinished_jobs()) == 1
+
+    # The second attempt did not finish either: its lease has passed, but it was the last attempt
+    age(crashed, "jobs", 901)
+    assert open_spool(spool_path, owner="other-host:1", max_attempts=2).unfinished_jobs() == []
+    assert len(open_spool(spool_path, owner="other-host:1", max_attempts=3).unfinished_jobs()) == 1
+
+def test_old_work_is_not_resumed(spool_path, dead_owner):
+    spool = open_spool(spool_path, owner=dead_owner, resume_window=3600)
+    spool.plan("job", SITE, RUN_AT)
+    spool.plan("other job", SITE, RUN_AT)
+    spool.enqueue("other job", "from@example.com", [(["a@example.com"], "A")])
+    age(spool, "jobs", 7200, column="created_at")
+    age(spool, "messages", 7200, column="created_at")
+
+    resumer = open_spool(spool_path, resume_window=3600)
+    assert not resumer.has_unfinished_work()
+    assert resumer.unfinished_jobs() == []
+    assert resumer.claim_pending() == []
+
+def test_purge_abandons_pending_messages_past_the_resume_window(spool_path, dead_owner):
+    spool = open_spool(spool_path, owner=dead_owner, resume_window=3600, retention=86400)
+    spool.plan("job", SITE, RUN_AT)
+    (message_id,) = spool.enqueue("job", "from@example.com", [
+        (["a@example.com"], (b"To: a@example.com\r\n", b"body")),
+    ])
+    age(spool, "messages", 7200, column="created_at")
+
+    spool.purge()
+    assert state(spool, "messages", "id", message_id) == "abandoned"
+    assert spool._conn.execute("SELECT COUNT(*) FROM bodies").fetchone()[0] == 0
+
+    # Kept for the retention period, then removed with its job
+    age(spool, "messages", 86401)
+    age(spool, "jobs", 86401)
+    spool.purge()
+    assert state(spool, "messages", "id", message_id) is None
+    assert state(spool, "jobs", "key", "job") is None
+
+def test_purge_keeps_sent_jobs_for_the_retention_period(spool_path):
+    spool = open_spool(spool_path, retention=86400)
+    spool.plan("job", SITE, RUN_AT)
+    (message_id,) = spool.enqueue("job", "from@example.com", [(["a@example.com"], "A")])
+    spool.ack(message_id)
+
+    spool.purge()
+    assert state(spool, "jobs", "key", "job") == "sent"
+
+    age(spool, "messages", 86401)
+    age(spool, "jobs", 86401)
+    spool.purge()
+    assert state(spool, "jobs", "key", "job") is None
+    assert spool.plan("job", SITE, RUN_AT)
+
+def test_spool_survives_reopening(spool_path):
+    spool = open_spool(spool_path)
+    spool.plan("job", SITE, RUN_AT)
+    (message_id,) = spool.enqueue("job", "from@example.com", [(["a@example.com"], "A")])
+    spool.ack(message_id)
+    spool.close()
+
+    assert not open_spool(spool_path).plan("job", SITE, RUN_AT)
@@ -0,0 +1,157 @@
+"""Tests for helpers.rollup: building reports from stored days and filling the gaps."""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from helpers.rollup import RollupStore, day_bounds, day_types, days_in_range, get_rollup_data
+
+TZ = "Europe/Amsterdam"
+WHAT_STATS = ["stats", "url", "browser", "referrer"]
+DAY_TYPES = ["url", "referrer"]
+# A finished week: Monday 2024-03-25 up to and including Sunday 2024-03-31, with the DST change
+FIRST, LAST = date(2024, 3, 25), date(2024, 3, 31)
+
+class FakeUmami:
+    """Answers fetches with one visit of "/" per day; stats and browsers count one visitor in any range."""
+
+    def __init__(self, empty_days=(), delay=0):
+        self.calls = []
+        self.empty_days = set(empty_days)
+        self.delay = delay
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, range_start, range_end, what_stats):
+        with self._lock:
+            self.calls.append((range_start, range_end, list(what_stats)))
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+
+        days = days_in_range(range_start, range_end, TZ)
+        if len(days) == 1 and days[0] in self.empty_days:
+            return {}
+
+        mystats = {}
+        for type in what_stats:
+            if type == "stats":
+                mystats[type] = {name: {"value": 1, "prev": 1}
+                                 for name in ("pageviews", "visitors", "visits", "bounces", "totaltime")}
+            elif type == "browser":
+                mystats[type] = [{"label": "Firefox", "value": 1}]
+            else:
+                mystats[type] = [{"label": "/", "value": len(days)}]
+        return mystats
+
+    def day_calls(self):
+        """The (day, types) of the calls for a single day."""
+        return sorted((days_in_range(start, end, TZ)[0], types) for start, end, types in self.calls
+                      if len(days_in_range(start, end, TZ)) == 1)
+
+    def range_calls(self):
+        return [(start, end, types) for start, end, types in self.calls if len(days_in_range(start, end, TZ)) > 1]
+
+@pytest.fixture
+def store(tmp_path):
+    store = RollupStore(str(tmp_path / "rollups.sqlite"))
+    yield store
+    store.close()
+
+def report(store, fetch, first=FIRST, last=LAST, **kwargs):
+    return get_rollup_data(store, fetch, "site-1", day_bounds(first, TZ)[0], day_bounds(last, TZ)[1],
+                           WHAT_STATS, tz=TZ, **kwargs)
+
+def range_of(first, last):
+    return day_bounds(first, TZ)[0], day_bounds(last, TZ)[1]
+
+def test_days_in_range_and_day_bounds_follow_dst():
+    assert days_in_range(*range_of(FIRST, LAST), TZ) == [FIRST + timedelta(days=offset) for offset in range(7)]
+    start, end = day_bounds(date(2024, 3, 31), TZ)
+    assert end + 1 - start == 23 * 3600 * 1000
+
+def test_only_metrics_that_add_up_are_built_from_days():
+    assert day_types(["stats", "url", "referrer", "browser", "os", "device", "country", "event"]) == \
+        ["url", "referrer", "event"]
+
+def test_missing_days_are_fetched_and_stored(store):
+    fetch = FakeUmami()
+    mystats = report(store, fetch, max_missing_days=7)
+
+    assert fetch.day_calls() == [(FIRST + timedelta(days=offset), DAY_TYPES) for offset in range(7)]
+    # Visitors and sessions are not added up over days, they come from one query for the range
+    assert fetch.range_calls() == [(*range_of(FIRST, LAST), ["stats", "browser"])]
+    assert mystats == {
+        "stats": {name: {"value": 1, "prev": 1} for name in ("pageviews", "visitors", "visits", "bounces", "totaltime")},
+        "url": [{"label": "/", "value": 7}],
+        "browser": [{"label": "Firefox", "value": 1}],
+        "referrer": [{"label": "/", "value": 7}],
+    }
+    assert list(mystats) == WHAT_STATS
+
+def test_stored_days_are_not_fetched_again(store):
+    first = report(store, FakeUmami())
+    fetch = FakeUmami()
+    assert report(store, fetch) == first
+    assert fetch.day_calls() == []
+    assert len(fetch.range_calls()) == 1
+
+def test_only_the_gaps_are_fetched(store):
+    report(store, FakeUmami())
+    store._conn.execute("DELETE FROM day_buckets WHERE day = '2024-03-28'")
+    store._conn.execute("DELETE FROM day_buckets WHERE day = '2024-03-30' AND type = 'url'")
+
+    fetch = FakeUmami()
+    mystats = report(store, fetch)
+    assert fetch.day_calls() == [(date(2024, 3, 28), DAY_TYPES), (date(2024, 3, 30), ["url"])]
+    assert mystats["url"] == [{"label": "/", "value": 7}]
+
+def test_too_many_missing_days_fetch_the_range_once(store):
+    fetch = FakeUmami()
+    mystats = report(store, fetch, first=date(2024, 1, 1), last=date(2024, 12, 31), max_missing_days=31)
+
+    # A first yearly report does not fetch 366 days, and stores nothing
+    assert fetch.calls == [(*range_of(date(2024, 1, 1), date(2024, 12, 31)), WHAT_STATS)]
+    assert mystats["url"] == [{"label": "/", "value": 366}]
+    assert store.get("site-1", date(2024, 1, 1), date(2024, 12, 31), DAY_TYPES, TZ) == {}
+
+def test_days_share_the_workers_of_one_report(store):
+    fetch = FakeUmami(delay=0.02)
+    report(store, fetch, max_missing_days=7, max_workers=4)
+
+    # Two day types per day and four workers: two days in flight at a time
+    assert fetch.most_in_flight == 2
+
+def test_a_day_that_cannot_be_fetched_falls_back_to_the_whole_range(store):
+    gap = date(2024, 3, 27)
+    fetch = FakeUmami(empty_days=[gap])
+    mystats = report(store, fetch)
+
+    # Every other day was stored, the report itself comes from one fetch of the range
+    assert fetch.calls[-1] == (*range_of(FIRST, LAST), WHAT_STATS)
+    assert mystats["url"] == [{"label": "/", "value": 7}]
+    stored = store.get("site-1", FIRST, LAST, ["url"], TZ)
+    assert sorted(day for day, _ in stored) == [day for day in days_in_range(*range_of(FIRST, LAST), TZ) if day != gap]
+
+def test_a_range_that_has_not_ended_is_fetched_whole_and_not_stored(store):
+    today = datetime.now().date()
+    fetch = FakeUmami()
+    report(store, fetch, first=today - timedelta(days=2), last=today)
+
+    assert len(fetch.calls) == 1
+    assert store.get("site-1", today - timedelta(days=5), today, DAY_TYPES, TZ) == {}
+
+def test_reports_without_day_types_are_fetched_whole(store):
+    fetch = FakeUmami()
+    start, end = range_of(FIRST, LAST)
+    get_rollup_data(store, fetch, "site-1", start, end, ["stats", "country"], tz=TZ)
+    assert fetch.calls == [(start, end, ["stats", "country"])]
+
+def test_days_are_stored_per_timezone(store):
+    report(store, FakeUmami())
+    assert store.get("site-1", FIRST, LAST, ["url"], "America/New_York") == {}
+    assert len(store.get("site-1", FIRST, LAST, ["url"], TZ)) == 7
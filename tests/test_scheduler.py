@@ -0,0 +1,137 @@
+"""Tests for helpers.scheduler: due moments, the due index and reloading the daemon's websites."""
+import threading
+from datetime import datetime
+
+import pytest
+
+import helpers.scheduler
+from helpers.scheduler import DueIndex, is_due, next_due_time, run_daemon
+
+# A Saturday
+NOW = datetime(2026, 10, 17, 8, 5)
+
+def site(name, frequency, email_time="08:00", send_day=()):
+    return {"name": name, "frequency": frequency, "email_time": email_time, "send_day": list(send_day)}
+
+@pytest.mark.parametrize("config, due", [
+    (site("daily", "day", "09:00"), datetime(2026, 10, 17, 9)),
+    # 08:00 has passed today
+    (site("daily", "day"), datetime(2026, 10, 18, 8)),
+    (site("weekdays", "day", "07:00", ["mon", "wed"]), datetime(2026, 10, 19, 7)),
+    (site("weekly", "week", "08:00", ["wed"]), datetime(2026, 10, 21, 8)),
+    (site("monthly", "month", "06:00"), datetime(2026, 11, 1, 6)),
+    (site("quarterly", "quarter"), datetime(2027, 1, 1, 8)),
+    (site("yearly", "year"), datetime(2027, 1, 1, 8)),
+])
+def test_next_due_time(config, due):
+    assert next_due_time(config, NOW) == due
+    assert is_due(config, due)
+
+def test_a_report_due_at_the_moment_itself_counts():
+    assert next_due_time(site("daily", "day"), datetime(2026, 10, 17, 8)) == datetime(2026, 10, 17, 8)
+
+def test_invalid_schedules_are_never_due():
+    assert next_due_time(site("broken", "day", "eight"), NOW) is None
+    assert next_due_time(site("unknown", "fortnight"), NOW) is None
+    assert not is_due(site("broken", "day", "eight"), NOW)
+
+def test_due_index_pops_due_websites_and_schedules_them_again():
+    daily, weekly, never = site("daily", "day", "09:00"), site("weekly", "week", "08:00", ["mon"]), site("x", "x")
+    index = DueIndex([weekly, daily, never], NOW)
+    assert len(index) == 2
+    assert index.next_due() == datetime(2026, 10, 17, 9)
+
+    assert index.pop_due(datetime(2026, 10, 17, 8, 59)) == []
+    assert index.pop_due(datetime(2026, 10, 17, 9)) == [(datetime(2026, 10, 17, 9), daily)]
+    assert index.next_due() == datetime(2026, 10, 18, 9)
+
+    # A website is popped once per call, at its earliest due moment
+    assert index.pop_due(datetime(2026, 10, 19, 9)) == [
+        (datetime(2026, 10, 18, 9), daily),
+        (datetime(2026, 10, 19, 8), weekly),
+    ]
+    assert index.next_due() == datetime(2026, 10, 19, 9)
+    assert len(index) == 2
+
+class FakeClock:
+    """Stands in for datetime in helpers.scheduler; stop_event.wait moves the clock instead of sleeping."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def install(self, monkeypatch, stop_event):
+        clock = self
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now
+
+        monkeypatch.setattr(helpers.scheduler, "datetime", FakeDatetime)
+
+        def wait(seconds):
+            clock.now = clock.now + helpers.scheduler.timedelta(seconds=seconds)
+            return stop_event.is_set()
+
+        monkeypatch.setattr(stop_event, "wait", wait)
+
+def test_daemon_reschedules_when_the_configuration_changes(monkeypatch):
+    stop_event = threading.Event()
+    clock = FakeClock(NOW)
+    clock.install(monkeypatch, stop_event)
+
+    original, added = site("daily", "day", "10:00"), site("added", "day", "09:00")
+    reloads = iter([None, [original, added]])
+    processed = []
+
+    def process_website(config, now):
+        processed.append((config["name"], now))
+        stop_event.set()
+
+    run_daemon([original], process_website, max_workers=1, stop_event=stop_event,
+               reload=lambda: next(reloads, None))
+
+    # The website added a minute after the start is sent before the one that was waited for
+    assert processed == [("added", datetime(2026, 10, 17, 9))]
+
+def test_daemon_keeps_a_due_moment_that_passed_while_reloading(monkeypatch):
+    stop_event = threading.Event()
+    clock = FakeClock(NOW)
+    clock.install(monkeypatch, stop_event)
+
+    config = site("daily", "day", "09:00")
+    processed = []
+    reloaded = []
+
+    def reload():
+        # The configuration changes just as the report is due
+        if clock.now >= datetime(2026, 10, 17, 9) and not reloaded:
+            clock.now = datetime(2026, 10, 17, 9, 0, 30)
+            reloaded.append(clock.now)
+            return [config]
+        return None
+
+    def process_website(config, now):
+        processed.append(now)
+        stop_event.set()
+
+    run_daemon([config], process_website, max_workers=1, stop_event=stop_event, reload=reload)
+    assert processed == [datetime(2026, 10, 17, 9)]
+
+def test_daemon_without_due_reports_waits_for_a_configuration_change(monkeypatch):
+    stop_event = threading.Event()
+    clock = FakeClock(NOW)
+    clock.install(monkeypatch, stop_event)
+
+    reloads = iter([None, None, [site("daily", "day", "09:00")]])
+    processed = []
+
+    def process_website(config, now):
+        processed.append(now)
+        stop_event.set()
+
+    run_daemon([], process_website, max_workers=1, stop_event=stop_event, reload=lambda: next(reloads, None))
+    assert processed == [datetime(2026, 10, 17, 9)]
+
+    # Without a way to reload there is nothing to wait for
+    run_daemon([], process_website, max_workers=1, stop_event=threading.Event())
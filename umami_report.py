@@ -12,51 +12,141 @@ Features:
 
 Modules Used:
 - `helpers.config`: Load configuration files.
+- `helpers.startup_snapshot`: Reuse the parsed configs and translations of the previous run.
 - `helpers.auth`: Authenticate with the Umami API.
+- `helpers.http_client`: Shared, pooled HTTP session for the Umami API.
+- `helpers.cache`: On-disk cache for Umami API responses.
 - `helpers.general`: Has some general functions
 - `helpers.email`: Send emails via SMTP.
+- `helpers.templates`: Compile and cache the email templates.
+- `helpers.render_cache`: Reuse identical HTML and PDF renders.
 - `helpers.umami`: Fetch analytics data from the Umami API.
 - `helpers.scheduler`: Schedule and process reports.
+- `helpers.pipeline`: Run reports through fetch, render, PDF and send stages.
 - `helpers.date_ranges`: Calculate date ranges for the reports.
 
 Author: Theo van der Sluijs
 Contact: [📧 Email](mailto:theo@vandersluijs.nl)
 License: MIT
 """
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Any
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Tuple, Any
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import os
+import signal
+import threading
 import re
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from sys import exit
 import traceback
 
-from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML
-
-# Import helper functions and modules
-from helpers.config import load_config
-from helpers.auth import authenticate
+# Import helper functions and modules. WeasyPrint, Jinja2 and requests are only
+# imported once a report is due that needs them.
+from helpers.startup_snapshot import StartupSnapshot
+from helpers.auth import AuthenticationError, TokenManager
+from helpers.cache import ResponseCache
+from helpers.render_cache import RenderCache
+from helpers.http_client import configure_http
 from helpers.frequency_options import frequency_options
 from helpers.general import capitalize_sentences, check_create_dir, type_mapping
-from helpers.email import send_email
-from helpers.umami import get_umami_data
-from helpers.translation_validator import load_smart_translation
-from helpers.scheduler import schedule_reports, should_send_report
-from helpers.date_ranges import calculate_date_range
-
-# Load configurations
-CONFIG: Dict[str, Any] = load_config("configs/config.json")
-WEBSITES: List[Dict[str, Any]] = load_config("configs/websites_config.json")
-
-COMPANY: Dict[str, str] = CONFIG["company"]
-UMAMI_API_URL: str = CONFIG["umami"]["api_url"]
-UMAMI_USERNAME: str = CONFIG["umami"]["username"]
-UMAMI_PASSWORD: str = CONFIG["umami"]["password"]
-SMTP_CONFIG: Dict[str, Any] = CONFIG["smtp"]
+from helpers.email import (MailSender, SMTPPool, send_email, send_spooled_messages, set_dry_run, set_mail_sender,
+                           set_mail_spool)
+from helpers.mail_spool import MailSpool
+from helpers.pipeline import render_pdf, run_pipeline
+from helpers.telemetry import Telemetry, per_site, set_stage_profiler, set_telemetry, span
+from helpers.templates import get_environment, get_template, precompile_templates, template_source_hash
+from helpers.umami import get_umami_data, request_coalescer, set_response_cache, set_token_manager
+from helpers.umami_db import UmamiDatabase
+from helpers.rollup import RollupStore, day_bounds, day_types, get_rollup_data
+from helpers.translation_validator import get_translation, translation_catalog
+from helpers.scheduler import due_websites, is_due, process_sites, run_daemon, schedule_reports
+from helpers.date_ranges import get_timezone, report_period
+
+if TYPE_CHECKING:
+    from helpers.profiling import Profiler
+
+CONFIG_PATH = "configs/config.json"
+WEBSITES_PATH = "configs/websites_config.json"
+
+# Loaded by load_settings, so importing this module (as spawned worker processes do) reads no configuration
+STARTUP_SNAPSHOT: Optional[StartupSnapshot] = None
+CONFIG: Dict[str, Any] = {}
+WEBSITES: List[Dict[str, Any]] = []
+
+COMPANY: Dict[str, str] = {}
+UMAMI_API_URL: str = ""
+UMAMI_USERNAME: str = ""
+UMAMI_PASSWORD: str = ""
+UMAMI_FETCH_WORKERS: int = 8
+UMAMI_CONNECT_TIMEOUT: float = 5
+UMAMI_READ_TIMEOUT: float = 30
+UMAMI_DATABASE_CONFIG: Dict[str, Any] = {}
+SCHEDULER_WORKERS: int = 5
+CACHE_CONFIG: Dict[str, Any] = {}
+PIPELINE_CONFIG: Dict[str, Any] = {}
+TEMPLATES_CONFIG: Dict[str, Any] = {}
+RENDER_CACHE_CONFIG: Dict[str, Any] = {}
+MAIL_SPOOL_CONFIG: Dict[str, Any] = {}
+ROLLUP_CONFIG: Dict[str, Any] = {}
+TELEMETRY_CONFIG: Dict[str, Any] = {}
+SMTP_CONFIG: Dict[str, Any] = {}
+TIMEZONE: Optional[str] = None  # Default timezone of the websites, None for local time
 
 BEARER_TOKEN: Optional[str] = None
+TOKEN_MANAGER: Optional[TokenManager] = None
+RENDER_CACHE: Optional[RenderCache] = None
+MAIL_SENDER: Optional[MailSender] = None
+MAIL_SPOOL: Optional[MailSpool] = None
+UMAMI_DB: Optional[UmamiDatabase] = None
+ROLLUP_STORE: Optional[RollupStore] = None
+TELEMETRY: Optional[Telemetry] = None
+IGNORE_SCHEDULE: bool = False  # Report on every website now, due or not (profiling a single website)
+DRY_RUN: bool = False  # Render the reports but do not send them or record them in the mail spool
+
+def load_settings() -> None:
+    """Load the configurations, from the snapshot of the previous run while they are unchanged."""
+    global STARTUP_SNAPSHOT, CONFIG, WEBSITES, COMPANY, UMAMI_API_URL, UMAMI_USERNAME, UMAMI_PASSWORD
+    global UMAMI_FETCH_WORKERS, UMAMI_CONNECT_TIMEOUT, UMAMI_READ_TIMEOUT, UMAMI_DATABASE_CONFIG, SCHEDULER_WORKERS
+    global CACHE_CONFIG, PIPELINE_CONFIG, TEMPLATES_CONFIG, RENDER_CACHE_CONFIG, MAIL_SPOOL_CONFIG, ROLLUP_CONFIG
+    global TELEMETRY_CONFIG, SMTP_CONFIG, TIMEZONE
+
+    STARTUP_SNAPSHOT = StartupSnapshot(".cache/startup.snapshot")
+    CONFIG = STARTUP_SNAPSHOT.load_config(CONFIG_PATH)
+    WEBSITES = STARTUP_SNAPSHOT.load_config(WEBSITES_PATH)
+    STARTUP_SNAPSHOT.restore_translations(translation_catalog)
+
+    COMPANY = CONFIG["company"]
+    UMAMI_API_URL = CONFIG["umami"]["api_url"]
+    UMAMI_USERNAME = CONFIG["umami"]["username"]
+    UMAMI_PASSWORD = CONFIG["umami"]["password"]
+    UMAMI_FETCH_WORKERS = CONFIG["umami"].get("fetch_workers", 8)
+    UMAMI_CONNECT_TIMEOUT = CONFIG["umami"].get("connect_timeout", 5)
+    UMAMI_READ_TIMEOUT = CONFIG["umami"].get("read_timeout", 30)
+    UMAMI_DATABASE_CONFIG = CONFIG["umami"].get("database", {})
+    SCHEDULER_WORKERS = CONFIG.get("scheduler", {}).get("workers", 5)
+    CACHE_CONFIG = CONFIG.get("cache", {})
+    PIPELINE_CONFIG = CONFIG.get("pipeline", {})
+    TEMPLATES_CONFIG = CONFIG.get("templates", {})
+    RENDER_CACHE_CONFIG = CONFIG.get("render_cache", {})
+    MAIL_SPOOL_CONFIG = CONFIG.get("mail_spool", {})
+    ROLLUP_CONFIG = CONFIG.get("rollup", {})
+    TELEMETRY_CONFIG = CONFIG.get("telemetry", {})
+    SMTP_CONFIG = CONFIG["smtp"]
+    TIMEZONE = CONFIG.get("timezone")
+
+def config_version() -> List[Optional[Tuple[int, int]]]:
+    """Return the modification time and size of the configuration files, None for a missing file."""
+    versions = []
+    for path in (CONFIG_PATH, WEBSITES_PATH):
+        try:
+            stat = os.stat(path)
+            versions.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            versions.append(None)
+    return versions
 
 def setup_logging() -> None:
     """Configure logging with rotation and formatting."""
@@ -113,37 +203,89 @@ def get_website_settings(site: Dict[str, Any]) -> Tuple[str, str, str, List[str]
         site.get('send_login_url', '')
     )
 
-def load_translation(lang_code: str) -> Dict[str, Any]:
+def load_translation(lang_code: str) -> Mapping[str, Any]:
     """
     Load a translation file with automatic fallback for missing translations.
+    Translations are loaded once per language and shared read-only.
 
     Args:
         lang_code: Language code for the translation file
 
     Returns:
-        Complete translation dictionary
+        Complete, read-only translation mapping
     """
     try:
-        return load_smart_translation(lang_code)
+        return get_translation(lang_code)
     except Exception as e:
         logger.error(f"Error loading translations: {e}")
         logger.warning("Falling back to English translations")
-        return load_smart_translation('en')
+        return get_translation('en')
+
+def pdf_attachment_name(website_name: str) -> str:
+    """Return the file name of the PDF attachment for a website."""
+    return f"{website_name.replace(' ', '_').lower()}_report.pdf"
+
+def pdf_archive_path(job: Dict[str, Any]) -> str:
+    """Return a unique path for an archived PDF report, stamped with the website, language and range."""
+    slug = job['website_name'].replace(' ', '_').lower()
+    tz = get_timezone(job['period'].tz)
+    start = datetime.fromtimestamp(job['range_start'] / 1000, tz=tz).strftime('%Y%m%d')
+    end = datetime.fromtimestamp(job['range_end'] / 1000, tz=tz).strftime('%Y%m%d')
+    return f"pdf-files/{slug}_{job['website_id']}_{job['lang']}_{start}-{end}_report.pdf"
+
+def render_cache_key(email_template: str, context: Dict[str, Any]) -> Optional[str]:
+    """Return the render cache key for a report, or None when the render cache is disabled."""
+    if RENDER_CACHE is None:
+        return None
+    return RENDER_CACHE.key(template_source_hash(email_template), context)
+
+def archive_pdf(job: Dict[str, Any], pdf_data: bytes) -> Optional[str]:
+    """Write a rendered PDF report to the archive and return its path."""
+    pdf_filename = pdf_archive_path(job)
+    tmp_filename = f"{pdf_filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(pdf_data)
+        os.replace(tmp_filename, pdf_filename)
+    except OSError as e:
+        logger.error(f"Failed to archive report {pdf_filename}: {e}")
+        return None
+
+    logger.info(f"Report saved to {pdf_filename}")
+    return pdf_filename
 
 def generate_report(website_name: str, context: Dict[str, Any],
                    email_template: str, generate_pdf: bool,
-                   generate_html: bool) -> Tuple[str, Optional[str]]:
-    """Generate HTML and optionally PDF reports."""
-    env = Environment(loader=FileSystemLoader('templates'))
-    template = env.get_template(email_template)
+                   generate_html: bool, cache_key: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+    """Generate HTML and optionally PDF reports, reusing identical earlier renders.
 
-    report = template.render(context)
-    pdf_filename = None
+    Args:
+        cache_key: The render cache key of the report, when the caller already computed it
+
+    Returns:
+        The HTML report and the PDF document (or None when no PDF was requested)
+    """
+    if cache_key is None:
+        cache_key = render_cache_key(email_template, context)
+
+    cached_report = RENDER_CACHE.get(cache_key, 'html') if cache_key else None
+    if cached_report is not None:
+        report = cached_report.decode('utf-8')
+    else:
+        with span("render"):
+            report = get_template(email_template).render(context)
+        if cache_key:
+            RENDER_CACHE.put(cache_key, 'html', report.encode('utf-8'))
+
+    pdf_data = None
 
     if generate_pdf:
-        pdf_filename = f"pdf-files/{website_name.replace(' ', '_').lower()}_report.pdf"
-        HTML(string=report).write_pdf(pdf_filename)
-        logger.info(f"Report saved to {pdf_filename}")
+        pdf_data = RENDER_CACHE.get(cache_key, 'pdf') if cache_key else None
+        if pdf_data is None:
+            with span("pdf"):
+                pdf_data = render_pdf(report)  # Rendered in memory, no temporary file
+            if cache_key:
+                RENDER_CACHE.put(cache_key, 'pdf', pdf_data)
 
     if generate_html:
         html_filename = f"html-files/{website_name.replace(' ', '_').lower()}_report.html"
@@ -151,115 +293,748 @@ def generate_report(website_name: str, context: Dict[str, Any],
             f.write(report)
         logger.info(f"Report saved to {html_filename}")
 
-    return report, pdf_filename
+    return report, pdf_data
 
-def process_website(site: Dict[str, Any], now: datetime) -> None:
-    """Process a single website to generate and send analytics reports."""
+def prepare_website(site: Dict[str, Any], now: datetime) -> Optional[Dict[str, Any]]:
+    """Check whether a website is due and collect everything needed to report on it.
+
+    Args:
+        site: Website configuration dictionary
+        now: The moment the run was started
+
+    Returns:
+        A report job dictionary, or None when no report has to be sent
+    """
+    if not validate_website_config(site):
+        return None
+
+    # Check if report should be sent at this time
+    if not IGNORE_SCHEDULE and not is_due(site, now):
+        return None
+
+    # Extract settings
+    lang, frequency, email_template, what_stats, generate_pdf, generate_html, login_url = get_website_settings(site)
+
+    # Load translations, with the website specific values in a small overlay
+    base_translations = load_translation(lang)
+    translations = ChainMap(
+        {'frequency_options': frequency_options(frequency, base_translations)},
+        base_translations
+    )
+
+    # The previous calendar period in the website's timezone; the API includes the end
+    timezone = site.get('timezone', TIMEZONE)
     try:
-        if not validate_website_config(site):
-            return
+        period = report_period(now, frequency, timezone)
+    except ValueError as e:
+        logger.error(f"Invalid report period for website {site['name']}: {e}")
+        return None
+    range_start, range_end = period.start, period.end - 1
 
-        # Extract settings
-        lang, frequency, email_template, what_stats, generate_pdf, generate_html, login_url = get_website_settings(site)
+    return {
+        'site': site,
+        'website_id': site["website_id"],
+        'website_name': site["name"],
+        'recipients': site["emails"],
+        'top': site.get('top', 5),
+        'lang': lang,
+        'frequency': frequency,
+        'email_template': email_template,
+        'what_stats': what_stats,
+        'generate_pdf': generate_pdf,
+        'archive_pdf': site.get('archive_pdf', False),
+        'per_recipient': site.get('per_recipient', False),
+        'generate_html': generate_html,
+        'login_url': login_url,
+        'translations': translations,
+        'period': period,
+        'timezone': timezone or "CET",
+        'range_start': range_start,
+        'range_end': range_end
+    }
 
-        # Check scheduled time
-        timer = site.get('email_time', "08:00")
-        if int(timer.split(":")[0]) != now.hour:
-            return
+def report_key(job: Dict[str, Any]) -> str:
+    """Key that identifies one report: the website, its recipients and the period it covers."""
+    site = job['site']
+    return "|".join([
+        site["website_id"],
+        site.get("lang", "en"),
+        site.get("email_template", "email_template.html"),
+        ",".join(sorted(site.get("emails", []))),
+        job['period'].key
+    ])
 
-        website_id = site["website_id"]
-        website_name = site["name"]
-        recipients = site["emails"]
-        send_day = site.get('send_day', [])
-        top = site.get('top', 5)
+def claim_report(job: Dict[str, Any], now: datetime) -> bool:
+    """Record a report job in the mail spool.
 
-        # Load translations
-        translations = load_translation(lang)
-        translations['frequency_options'] = frequency_options(frequency, translations)
+    Returns:
+        False when the report was already sent (or is being sent by another run)
+    """
+    if not MAIL_SPOOL:
+        return True
 
-        # Check if report should be sent
-        if not should_send_report(frequency, send_day):
-            return
+    job['spool_key'] = report_key(job)
+    if MAIL_SPOOL.plan(job['spool_key'], job['site'], now):
+        return True
 
-        # Get date range and fetch data
-        range_start, range_end = calculate_date_range(now, frequency)
-        web_stats = get_umami_data(UMAMI_API_URL, BEARER_TOKEN, website_id,
-                                 range_start, range_end, frequency, what_stats)
+    logger.info(f"Report for {job['website_name']} was already sent or is in progress, skipped")
+    return False
 
-        # Prepare email content
-        subject = translations['website_analytics_report_for'].format(
-            frequency_options=translations['frequency_options'],
-            website_name=website_name
+def fetch_range(website_id: str, frequency: str, range_start: int, range_end: int,
+                what_stats: List[str], top: Optional[int] = None, tz: str = "CET") -> Dict[str, Any]:
+    """Fetch the Umami statistics of a website for a range, from the database or the API."""
+    if UMAMI_DB:
+        return UMAMI_DB.get_umami_data(website_id, range_start, range_end, frequency, what_stats, top=top)
+
+    return get_umami_data(UMAMI_API_URL, BEARER_TOKEN, website_id, range_start, range_end,
+                          frequency, what_stats, max_workers=UMAMI_FETCH_WORKERS, tz=tz)
+
+def fetch_website_data(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Fetch the Umami statistics for a prepared report job."""
+    if ROLLUP_STORE:
+        return get_rollup_data(
+            ROLLUP_STORE,
+            lambda range_start, range_end, what_stats: fetch_range(
+                job['website_id'], job['frequency'], range_start, range_end, what_stats, tz=job['timezone']),
+            job['website_id'], job['range_start'], job['range_end'], job['what_stats'],
+            max_missing_days=ROLLUP_CONFIG.get("max_missing_days", 7),
+            max_workers=UMAMI_FETCH_WORKERS,
+            tz=job['period'].tz
         )
 
-        login_url_text = translations['link_to_login'].format(login_url=login_url) if login_url else ""
+    return fetch_range(job['website_id'], job['frequency'], job['range_start'], job['range_end'],
+                       job['what_stats'], top=job['top'], tz=job['timezone'])
 
-        report_header = capitalize_sentences(
-            translations["report_header"].format(
-                website_name=website_name,
-                frequency_text=translations[frequency],
-                frequency_options_text=translations['frequency_options']
-            )
+def build_context(job: Dict[str, Any], web_stats: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Build the email subject and template context for a report job.
+
+    Args:
+        job: Report job dictionary from prepare_website
+        web_stats: Statistics returned by get_umami_data
+
+    Returns:
+        Tuple with the email subject and the template context
+    """
+    translations = job['translations']
+    website_name = job['website_name']
+    frequency = job['frequency']
+    login_url = job['login_url']
+
+    # Prepare email content
+    subject = translations['website_analytics_report_for'].format(
+        frequency_options=translations['frequency_options'],
+        website_name=website_name
+    )
+
+    login_url_text = translations['link_to_login'].format(login_url=login_url) if login_url else ""
+
+    report_header = capitalize_sentences(
+        translations["report_header"].format(
+            website_name=website_name,
+            frequency_text=translations[frequency],
+            frequency_options_text=translations['frequency_options']
         )
+    )
 
-        comp_url = COMPANY.get('url', '#')
-        comp_email = COMPANY.get('email', 'support@example.com')
-        report_footer = capitalize_sentences(
-            translations["report_footer"].format(
-                comp_email=comp_email,
-                comp_url=comp_url
-            )
+    comp_url = COMPANY.get('url', '#')
+    comp_email = COMPANY.get('email', 'support@example.com')
+    report_footer = capitalize_sentences(
+        translations["report_footer"].format(
+            comp_email=comp_email,
+            comp_url=comp_url
         )
+    )
+
+    # Prepare template context
+    context = {
+        'lang': job['lang'],
+        'report_header': report_header,
+        'report_footer': report_footer,
+        'company': COMPANY,
+        'frequency': frequency,
+        'stats': web_stats.get("stats", {}),
+        'mystats': web_stats,
+        'what_stats': job['what_stats'],
+        'stat_type_mapping': type_mapping(),
+        'website_name': website_name,
+        'top': job['top'],
+        'translations': translations,
+        'login_url_text': login_url_text
+    }
 
-        # Prepare template context
-        context = {
-            'lang': lang,
-            'report_header': report_header,
-            'report_footer': report_footer,
-            'company': COMPANY,
-            'frequency': frequency,
-            'stats': web_stats.get("stats", {}),
-            'mystats': web_stats,
-            'what_stats': what_stats,
-            'stat_type_mapping': type_mapping(),
-            'website_name': website_name,
-            'top': top,
-            'translations': translations,
-            'login_url_text': login_url_text
-        }
+    return subject, context
+
+@per_site
+def deliver_report(job: Dict[str, Any], web_stats: Dict[str, Any]) -> None:
+    """Render the report for a job and email it to the recipients."""
+    try:
+        if not web_stats:
+            logger.error(f"No statistics could be fetched for website {job['website_name']}, report not sent")
+            return
+
+        subject, context = build_context(job, web_stats)
 
         # Generate report
-        report, pdf_filename = generate_report(
-            website_name, context, email_template,
-            generate_pdf, generate_html
+        report, pdf_data = generate_report(
+            job['website_name'], context, job['email_template'],
+            job['generate_pdf'], job['generate_html']
         )
 
-        # Send email (currently disabled)
+        if pdf_data and job['archive_pdf']:
+            archive_pdf(job, pdf_data)
+
+        # Send email
         if report:
-            send_email(subject, report, recipients, SMTP_CONFIG, pdf_filename)
+            send_email(subject, report, job['recipients'], SMTP_CONFIG,
+                       pdf_data=pdf_data, pdf_name=pdf_attachment_name(job['website_name']),
+                       spool_key=job.get('spool_key'), per_recipient=job['per_recipient'])
+
+    except Exception as e:
+        logger.error(f"Error processing website {job.get('website_name', 'unknown')}: {str(e)}")
+        logger.debug(traceback.format_exc())
+
+@per_site
+def render_job(job: Dict[str, Any], web_stats: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Pipeline render stage: render the HTML report and decide whether a PDF is needed.
+
+    Returns:
+        The rendered report (subject, HTML, render cache key and a cached PDF, if any)
+        and the HTML to render to PDF in the PDF stage, or None when no PDF has to be
+        rendered
+    """
+    if not web_stats:
+        raise ValueError("no statistics could be fetched, report not sent")
+
+    subject, context = build_context(job, web_stats)
+    # Hashing the context is not free, so the key is computed once for the HTML and the PDF
+    cache_key = render_cache_key(job['email_template'], context)
+    report, _ = generate_report(
+        job['website_name'], context, job['email_template'],
+        False, job['generate_html'], cache_key=cache_key
+    )
+
+    rendered = {'subject': subject, 'report': report, 'cache_key': None, 'pdf_data': None}
+    if not job['generate_pdf']:
+        return rendered, None
+
+    rendered['cache_key'] = cache_key
+    if rendered['cache_key']:
+        rendered['pdf_data'] = RENDER_CACHE.get(rendered['cache_key'], 'pdf')
+
+    return rendered, (report if rendered['pdf_data'] is None else None)
+
+@per_site
+def send_job(job: Dict[str, Any], rendered: Dict[str, Any], pdf_data: Optional[bytes]) -> None:
+    """Pipeline send stage: email a rendered report to the recipients."""
+    if pdf_data is not None and rendered['cache_key']:
+        RENDER_CACHE.put(rendered['cache_key'], 'pdf', pdf_data)
+
+    pdf_data = pdf_data if pdf_data is not None else rendered['pdf_data']
+    if pdf_data and job['archive_pdf']:
+        archive_pdf(job, pdf_data)
+
+    if rendered['report']:
+        send_email(rendered['subject'], rendered['report'], job['recipients'], SMTP_CONFIG,
+                   pdf_data=pdf_data, pdf_name=pdf_attachment_name(job['website_name']),
+                   spool_key=job.get('spool_key'), per_recipient=job['per_recipient'])
+
+@per_site
+def process_website(site: Dict[str, Any], now: datetime) -> None:
+    """Process a single website to generate and send analytics reports."""
+    try:
+        job = prepare_website(site, now)
+        if not job or not claim_report(job, now):
+            return
 
+        web_stats = fetch_website_data(job)
+        deliver_report(job, web_stats)
+
+    except AuthenticationError as e:
+        logger.error(f"Failed to authenticate with Umami API, no report for {site.get('name', 'unknown')}: {e}")
     except Exception as e:
         logger.error(f"Error processing website {site.get('name', 'unknown')}: {str(e)}")
         logger.debug(traceback.format_exc())
 
+def run_scheduled(websites: List[Dict[str, Any]]) -> None:
+    """Authenticate and process every website in the scheduler's worker pool."""
+    # Reading from the database, the statistics of all due websites are fetched at once
+    if UMAMI_DB:
+        run_batched(websites)
+        return
+
+    # Authenticate with Umami API
+    global BEARER_TOKEN
+    BEARER_TOKEN = TOKEN_MANAGER.token
+
+    # Schedule and process reports
+    if IGNORE_SCHEDULE:
+        process_sites(websites, process_website, max_workers=SCHEDULER_WORKERS)
+    else:
+        schedule_reports(websites, process_website, max_workers=SCHEDULER_WORKERS)
+
+def log_run_summary() -> None:
+    """Log the request statistics of a run and reset them for the next one."""
+    logger.info(f"API calls: {request_coalescer.calls}, "
+                f"saved by coalescing identical requests: {request_coalescer.saved}")
+    request_coalescer.reset()
+
+    if RENDER_CACHE:
+        logger.info(f"Render cache hits: {RENDER_CACHE.hits}, misses: {RENDER_CACHE.misses}")
+        RENDER_CACHE.reset_counters()
+
+    if MAIL_SENDER:
+        logger.info(f"Emails sent: {MAIL_SENDER.sent}, failed: {MAIL_SENDER.failed}")
+        MAIL_SENDER.reset_counters()
+
+    if TELEMETRY:
+        TELEMETRY.finish_run()
+
+def setup_telemetry() -> None:
+    """Record timing spans of the run as JSON lines, and export the run summary."""
+    global TELEMETRY
+    if not TELEMETRY_CONFIG.get("enabled", False):
+        return
+
+    TELEMETRY = Telemetry(
+        path=TELEMETRY_CONFIG.get("path", "logs/spans.jsonl"),
+        prometheus_path=TELEMETRY_CONFIG.get("prometheus_textfile") or None,
+        slowest_sites=TELEMETRY_CONFIG.get("slowest_sites", 5)
+    )
+    set_telemetry(TELEMETRY)
+
+def start_profiling(website_id: str, output_dir: Optional[str]) -> "Profiler":
+    """
+    Profile the run, limited to one website when website_id is set. That website is
+    reported on right away, due or not, as a dry run so no email is sent. Websites
+    are processed one at a time, so the memory of every stage can be told apart.
+
+    Args:
+        website_id (str): The website to profile, or "" for all due websites.
+        output_dir (str): Where the profile is written, or None for profiles/<date-time>.
+
+    Returns:
+        Profiler: The started profiler.
+    """
+    from helpers.profiling import Profiler
+
+    global WEBSITES, IGNORE_SCHEDULE, DRY_RUN, SCHEDULER_WORKERS
+    if website_id:
+        WEBSITES = [site for site in WEBSITES if site.get('website_id') == website_id]
+        if not WEBSITES:
+            logger.error(f"Website {website_id} is not in websites_config.json")
+            exit(1)
+        IGNORE_SCHEDULE = True
+        DRY_RUN = True
+    SCHEDULER_WORKERS = 1
+    logging.getLogger().setLevel(logging.INFO)
+
+    profiler = Profiler(output_dir or os.path.join('profiles', datetime.now().strftime('%Y%m%d-%H%M%S')))
+    set_stage_profiler(profiler.start())
+    return profiler
+
+def stop_profiling(profiler: "Profiler") -> None:
+    """Stop profiling and write the profile, memory snapshots and stack samples."""
+    set_stage_profiler(None)
+    output_dir = profiler.stop()
+    logger.info(f"Profile written to {output_dir}: profile.txt, profile.prof, memory.txt, stacks.collapsed")
+
+def close_telemetry() -> None:
+    """Stop recording spans and close the spans file."""
+    if TELEMETRY:
+        set_telemetry(None)
+        TELEMETRY.close()
+
+def setup_mail_sender() -> None:
+    """Send emails through a pool of reused SMTP connections, drained by sender workers."""
+    global MAIL_SENDER
+    if DRY_RUN or not SMTP_CONFIG.get("pool", True):
+        return
+
+    pool = SMTPPool(
+        SMTP_CONFIG,
+        size=SMTP_CONFIG.get("pool_size", 2),
+        max_messages=SMTP_CONFIG.get("max_messages_per_connection", 100),
+        idle_check=SMTP_CONFIG.get("noop_interval", 30),
+        timeout=SMTP_CONFIG.get("timeout", 60)
+    )
+    MAIL_SENDER = MailSender(
+        pool,
+        workers=SMTP_CONFIG.get("sender_workers", SMTP_CONFIG.get("pool_size", 2)),
+        queue_size=SMTP_CONFIG.get("queue_size", 100)
+    )
+    set_mail_sender(MAIL_SENDER)
+
+def close_mail_sender() -> None:
+    """Wait until every queued email has been sent and close the SMTP connections."""
+    if MAIL_SENDER:
+        MAIL_SENDER.close()
+        set_mail_sender(None)
+
+def setup_mail_spool() -> None:
+    """Store every report job and email in the mail spool before it is sent."""
+    global MAIL_SPOOL
+    # A dry run neither claims reports nor resumes the work of other runs
+    if DRY_RUN or not MAIL_SPOOL_CONFIG.get("enabled", True):
+        return
+
+    MAIL_SPOOL = MailSpool(
+        path=MAIL_SPOOL_CONFIG.get("path", ".cache/mail_spool.sqlite"),
+        max_attempts=MAIL_SPOOL_CONFIG.get("max_attempts", 3),
+        lease=MAIL_SPOOL_CONFIG.get("lease", 900),
+        retention=MAIL_SPOOL_CONFIG.get("retention", 7 * 24 * 3600),
+        resume_window=MAIL_SPOOL_CONFIG.get("resume_window", 24 * 3600)
+    )
+    set_mail_spool(MAIL_SPOOL)
+    MAIL_SPOOL.purge()
+
+def resume_spooled_reports() -> None:
+    """Finish the work an interrupted run left in the mail spool."""
+    if not MAIL_SPOOL:
+        return
+
+    # Emails that were rendered but never accepted by the SMTP server
+    send_spooled_messages(SMTP_CONFIG)
+
+    # Report jobs that never got as far as an email, run for the moment they were planned
+    jobs = MAIL_SPOOL.unfinished_jobs()
+    if not jobs:
+        return
+
+    logger.info(f"Resuming {len(jobs)} unfinished reports from the mail spool")
+    with ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS) as executor:
+        for _, site, run_at in jobs:
+            executor.submit(process_website, site, run_at)
+
+def nothing_due(now: datetime) -> bool:
+    """Check whether a run has nothing to do: no website is due and no earlier run left work in the mail spool."""
+    if due_websites(WEBSITES, now):
+        return False
+    return not (MAIL_SPOOL and MAIL_SPOOL.has_unfinished_work())
+
+def save_startup_snapshot() -> None:
+    """Keep the parsed configs and the translations of this run for the next run."""
+    STARTUP_SNAPSHOT.store_translations(translation_catalog)
+    STARTUP_SNAPSHOT.save()
+
+def close_mail_spool() -> None:
+    """Close the mail spool after the last email was sent."""
+    if MAIL_SPOOL:
+        set_mail_spool(None)
+        MAIL_SPOOL.close()
+
+def run_as_daemon(websites: List[Dict[str, Any]]) -> None:
+    """Keep running and process every website when its report is due."""
+    global BEARER_TOKEN
+    if not UMAMI_DB:
+        BEARER_TOKEN = TOKEN_MANAGER.token
+
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping daemon")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def on_tick(now, sites):
+        # Retry the emails and reports that failed in this or an earlier cycle
+        if MAIL_SPOOL:
+            MAIL_SPOOL.purge()
+            resume_spooled_reports()
+        log_run_summary()
+
+    loaded_version = config_version()
+
+    def reload():
+        # Pick up edited configuration files, keeping the loaded ones while a file is missing or invalid
+        nonlocal loaded_version
+        version = config_version()
+        if version == loaded_version or None in version:
+            return None
+        loaded_version = version
+
+        try:
+            load_settings()
+        except Exception as e:
+            logger.error(f"Failed to reload the configuration, keeping the loaded one: {e}")
+            return None
+        logger.info("Configuration files changed, reloaded")
+        return WEBSITES
+
+    run_daemon(websites, process_website, max_workers=SCHEDULER_WORKERS,
+               stop_event=stop_event, on_tick=on_tick, reload=reload)
+
+def prepare_due_jobs(websites: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+    """Prepare a report job for every website that is due."""
+    jobs = []
+    for site in (websites if IGNORE_SCHEDULE else due_websites(websites, now)):
+        try:
+            job = prepare_website(site, now)
+        except Exception as e:
+            logger.error(f"Error processing website {site.get('name', 'unknown')}: {str(e)}")
+            continue
+        if job and claim_report(job, now):
+            jobs.append(job)
+    return jobs
+
+def fetch_all_website_data(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fetch the statistics of all report jobs from the database, in a few queries (or per job with rollups)."""
+    if not ROLLUP_STORE:
+        return UMAMI_DB.get_many([
+            {
+                'website_id': job['website_id'],
+                'range_start': job['range_start'],
+                'range_end': job['range_end'],
+                'what_stats': job['what_stats'],
+                'top': job['top']
+            }
+            for job in jobs
+        ])
+
+    # Every job needs its own queries for its missing rollup days
+    with ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS) as executor:
+        return list(executor.map(fetch_website_data, jobs))
+
+def run_batched(websites: List[Dict[str, Any]]) -> None:
+    """Database mode: fetch the data of every due website first, then render and send in workers."""
+    jobs = prepare_due_jobs(websites, datetime.now())
+    if not jobs:
+        return
+
+    all_stats = fetch_all_website_data(jobs)
+
+    # Rendering and sending are handed to the worker pool
+    with ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS) as executor:
+        for job, web_stats in zip(jobs, all_stats):
+            executor.submit(deliver_report, job, web_stats)
+
+def run_pipelined(websites: List[Dict[str, Any]]) -> None:
+    """Run every due website through the fetch, render, PDF and send stages."""
+    jobs = prepare_due_jobs(websites, datetime.now())
+    if not jobs:
+        return
+
+    global BEARER_TOKEN
+    if not UMAMI_DB:
+        BEARER_TOKEN = TOKEN_MANAGER.token
+
+    sent = run_pipeline(
+        jobs, fetch_website_data, render_job, send_job,
+        fetch_workers=PIPELINE_CONFIG.get("fetch_workers", SCHEDULER_WORKERS),
+        render_workers=PIPELINE_CONFIG.get("render_workers", 1),
+        pdf_workers=PIPELINE_CONFIG.get("pdf_workers", os.cpu_count() or 2),
+        send_workers=PIPELINE_CONFIG.get("send_workers", 2),
+        queue_size=PIPELINE_CONFIG.get("queue_size", 20)
+    )
+    logger.info(f"Pipeline sent {sent} of {len(jobs)} reports")
+
+def run_backfill(websites: List[Dict[str, Any]], days: int) -> None:
+    """Fill the rollup store with the last days of every website."""
+    if not ROLLUP_STORE:
+        logger.error("The rollup store is disabled, set rollup.enabled to true to backfill")
+        return
+
+    # One entry per website and timezone, with every stat type any of its reports builds from days
+    site_stats: Dict[Tuple[str, str], set] = {}
+    for site in websites:
+        if validate_website_config(site):
+            timezone = site.get('timezone', TIMEZONE) or ""
+            types = day_types(get_website_settings(site)[3])
+            if types:
+                site_stats.setdefault((site['website_id'], timezone), set()).update(types)
+
+    def backfill_days(timezone: str) -> List[date]:
+        today = datetime.now(get_timezone(timezone)).date()
+        return [today - timedelta(days=offset) for offset in range(days, 0, -1)]
+
+    def missing_types(website_id: str, timezone: str, day: date) -> List[str]:
+        types = site_stats[(website_id, timezone)]
+        stored = ROLLUP_STORE.get(website_id, day, day, types, timezone)
+        return sorted(type for type in types if (day, type) not in stored)
+
+    filled = 0
+    if UMAMI_DB:
+        # All websites of a day in one batch
+        timezones = {timezone for _, timezone in site_stats}
+        for timezone in sorted(timezones):
+            for day in backfill_days(timezone):
+                todo = [(website_id, missing_types(website_id, timezone, day))
+                        for website_id, site_timezone in site_stats if site_timezone == timezone]
+                todo = [(website_id, types) for website_id, types in todo if types]
+                range_start, range_end = day_bounds(day, timezone)
+                results = UMAMI_DB.get_many([
+                    {'website_id': website_id, 'range_start': range_start, 'range_end': range_end,
+                     'what_stats': types, 'top': None}
+                    for website_id, types in todo
+                ])
+                for (website_id, types), day_stats in zip(todo, results):
+                    if day_stats:
+                        ROLLUP_STORE.put(website_id, day, day_stats, timezone)
+                        filled += 1
+    else:
+        def backfill_website(key: Tuple[str, str]) -> int:
+            website_id, timezone = key
+            count = 0
+            for day in backfill_days(timezone):
+                types = missing_types(website_id, timezone, day)
+                if types:
+                    day_stats = fetch_range(website_id, 'day', *day_bounds(day, timezone), types,
+                                            tz=timezone or "CET")
+                    if day_stats:
+                        ROLLUP_STORE.put(website_id, day, day_stats, timezone)
+                        count += 1
+            return count
+
+        with ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS) as executor:
+            filled = sum(executor.map(backfill_website, site_stats))
+
+    logger.info(f"Backfilled {filled} days for {len(site_stats)} websites")
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description="Send Umami analytics reports by email.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--pipeline', action='store_true',
+                      help="fetch, render HTML, render PDFs (in separate processes) and send in pipelined stages")
+    mode.add_argument('--daemon', action='store_true',
+                      help="keep running and send every report when it is due, instead of running from cron")
+    mode.add_argument('--backfill', type=int, metavar='DAYS',
+                      help="fill the rollup store with the last DAYS days of every website and exit")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="render the reports but do not send them or record them in the mail spool")
+    parser.add_argument('--profile', nargs='?', const='', metavar='WEBSITE_ID',
+                        help="profile the run (CPU, memory per stage and stack samples); with a WEBSITE_ID "
+                             "only that website is reported on, right away and as a dry run")
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help="where the profile is written (default: profiles/<date-time>)")
+    return parser.parse_args()
+
 def main() -> None:
     """Main execution function."""
+    args = parse_args()
     setup_logging()
+    load_settings()
+    setup_telemetry()
+
+    global DRY_RUN
+    DRY_RUN = args.dry_run
+    profiler = start_profiling(args.profile, args.profile_dir) if args.profile is not None else None
+
+    try:
+        run_reports(args, profiling=profiler is not None)
+    except AuthenticationError as e:
+        # Only a run that cannot log in at all stops here; workers skip the report instead
+        logger.error(f"Failed to authenticate with Umami API: {e}")
+        exit(1)
+    finally:
+        # Also when the run fails, so the profile is written and threads are no longer profiled
+        if profiler:
+            stop_profiling(profiler)
+
+def run_reports(args: argparse.Namespace, profiling: bool) -> None:
+    """Run the mode chosen on the command line."""
+    set_dry_run(DRY_RUN)
+
+    # Keep track of what was sent, and finish what an interrupted run left behind
+    setup_mail_spool()
+
+    # Most cron runs have nothing to do: stop before the heavy dependencies are loaded
+    if not (args.daemon or args.backfill or profiling) and nothing_due(datetime.now()):
+        logger.info("No reports due")
+        close_mail_spool()
+        log_run_summary()
+        close_telemetry()
+        save_startup_snapshot()
+        return
 
     # Create necessary directories
     for folder in ['pdf-files', 'html-files']:
         check_create_dir(folder)
 
-    # Authenticate with Umami API
-    global BEARER_TOKEN
-    BEARER_TOKEN = authenticate(UMAMI_API_URL, UMAMI_USERNAME, UMAMI_PASSWORD)
+    # Compiled templates are cached in memory and on disk
+    get_environment(cache_dir=TEMPLATES_CONFIG.get("cache_dir", ".cache/jinja"))
+    if TEMPLATES_CONFIG.get("precompile", False):
+        precompile_templates(site.get('email_template', 'email_template.html') for site in WEBSITES)
 
-    if not BEARER_TOKEN:
-        logger.error("Failed to authenticate with Umami API")
-        exit(1)
+    # Reuse identical renders
+    global RENDER_CACHE
+    if RENDER_CACHE_CONFIG.get("enabled", True):
+        RENDER_CACHE = RenderCache(
+            cache_dir=RENDER_CACHE_CONFIG.get("dir", "pdf-files/.cache"),
+            max_bytes=RENDER_CACHE_CONFIG.get("max_bytes", 200 * 1024 * 1024)
+        )
 
-    # Schedule and process reports
-    schedule_reports(WEBSITES, process_website)
+    # One pooled connection per concurrent API call
+    configure_http(
+        pool_size=SCHEDULER_WORKERS * UMAMI_FETCH_WORKERS,
+        connect_timeout=UMAMI_CONNECT_TIMEOUT,
+        read_timeout=UMAMI_READ_TIMEOUT,
+        retries=CONFIG["umami"].get("retries", 3),
+        backoff_base=CONFIG["umami"].get("backoff_base", 0.5),
+        backoff_max=CONFIG["umami"].get("backoff_max", 30),
+        initial_concurrency=CONFIG["umami"].get("initial_concurrency", 0)
+    )
+
+    # Cache API responses on disk
+    if CACHE_CONFIG.get("enabled", True):
+        set_response_cache(ResponseCache(
+            path=CACHE_CONFIG.get("path", ".cache/umami_responses.sqlite"),
+            ttl=CACHE_CONFIG.get("ttl", 300),
+            max_entries=CACHE_CONFIG.get("max_entries", 10000)
+        ))
+
+    # Read the statistics straight from Umami's database
+    global UMAMI_DB
+    if UMAMI_DATABASE_CONFIG.get("url"):
+        try:
+            UMAMI_DB = UmamiDatabase(
+                UMAMI_DATABASE_CONFIG["url"],
+                batch_size=UMAMI_DATABASE_CONFIG.get("batch_size", 500)
+            )
+        except Exception as e:
+            logger.error(f"Failed to connect to the Umami database: {e}")
+            exit(1)
+
+    # Build longer reports from stored daily statistics
+    global ROLLUP_STORE
+    if ROLLUP_CONFIG.get("enabled", False):
+        ROLLUP_STORE = RollupStore(ROLLUP_CONFIG.get("path", ".cache/rollups.sqlite"))
+
+    # Reuse the bearer token of a previous run while it is valid
+    global TOKEN_MANAGER
+    TOKEN_MANAGER = TokenManager(
+        UMAMI_API_URL, UMAMI_USERNAME, UMAMI_PASSWORD,
+        token_file=CONFIG["umami"].get("token_file", ".cache/umami_token.json"),
+        max_age=CONFIG["umami"].get("token_max_age", 12 * 3600)
+    )
+    set_token_manager(TOKEN_MANAGER)
+
+    request_coalescer.reset()
+
+    # Reuse authenticated SMTP connections
+    setup_mail_sender()
+
+    try:
+        if args.backfill:
+            run_backfill(WEBSITES, args.backfill)
+            return
+
+        resume_spooled_reports()
+
+        if args.daemon:
+            run_as_daemon(WEBSITES)
+        elif args.pipeline:
+            run_pipelined(WEBSITES)
+        else:
+            run_scheduled(WEBSITES)
+    finally:
+        close_mail_sender()
+        close_mail_spool()
+
+    log_run_summary()
+    close_telemetry()
+    save_startup_snapshot()
 
 if __name__ == "__main__":
     main()